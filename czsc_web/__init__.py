@@ -0,0 +1,4 @@
+# coding: utf-8
+"""
+czsc_web 是各数据源网页服务共用的组件，包括线程池/进程池调度、K线分析等
+"""
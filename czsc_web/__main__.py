@@ -0,0 +1,5 @@
+# coding: utf-8
+"""python -m czsc_web --provider=ts,jq"""
+from .app import main
+
+main()
@@ -0,0 +1,213 @@
+# coding: utf-8
+"""
+缠论分析，在进程池中执行
+
+每个分析进程按 key（数据源、标的、K线级别）缓存 KlineAnalyze 对象，同一个图表再次刷新时，
+只把新增的K线通过 update 喂给缓存的对象，分型、笔、线段以及 KlineAnalyze 内部的均线、MACD
+都从上一次的状态增量计算，不再对全部K线重新分析。请求的均线、MACD 等指标由挂在同一个对象上的
+czsc_web.indicators.IndicatorEngine 增量计算，随分析状态一起缓存。
+
+czsc 导入较慢（依赖 matplotlib、pyecharts 等绘图库），只在分析进程中第一次分析时导入（见 czsc_web.incremental），
+网页服务进程不导入 czsc；--warmup 时服务启动后在后台提前导入。
+"""
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from tornado.options import define, options
+from .wire import encode_payload
+from .indicators import IndicatorEngine
+from .lod import view as lod_view
+from .profiler import Sampler
+
+define('analyzer_cache_mb', type=int, default=512, help='每个分析进程缓存 KlineAnalyze 对象的内存上限（MB）')
+
+# 每根K线在 KlineAnalyze 中占用内存的粗略估计（原始K线、去包含K线、均线、MACD 等）
+_bytes_per_bar = 6 * 1024
+
+
+class AnalyzerCache:
+    """按内存上限淘汰的 LRU 缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, ka):
+        self.pop(key)
+        size = len(ka.kline_raw) * _bytes_per_bar
+        self._items[key] = (ka, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, (_, size) = self._items.popitem(last=False)
+            self.nbytes -= size
+
+    def pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+        return item
+
+
+_analyzers = None
+
+
+def get_analyzers():
+    global _analyzers
+    if _analyzers is None:
+        _analyzers = AnalyzerCache(options.analyzer_cache_mb * 1024 * 1024)
+    return _analyzers
+
+
+def _new_bars(ka, kline):
+    """找出 kline 中需要喂给 ka 的K线，kline 不能接续 ka 的状态时返回 None"""
+    last = ka.kline_raw[-1]
+    dts = kline['dt'].values
+    pos = dts.searchsorted(pd.Timestamp(last['dt']).to_datetime64())
+    if pos >= len(dts) or dts[pos] != pd.Timestamp(last['dt']).to_datetime64():
+        return None
+
+    # 已完成的K线价格发生变化，说明数据源重新复权了
+    if len(ka.kline_raw) >= 2 and pos >= 1:
+        prev = ka.kline_raw[-2]
+        row = kline.iloc[pos - 1]
+        if row['dt'] != prev['dt'] or row['close'] != prev['close'] or row['open'] != prev['open']:
+            return None
+    return kline.iloc[pos:].to_dict('records')
+
+
+def to_result(ka, max_count=5000, indicators=None):
+    """把分析结果整理成按列存放的数组，分型、笔、线段只记录所在K线的下标
+
+    与 to_df 的取数范围一致；均线和 MACD 只在请求了指标时计算，不像 to_df 那样每次对全部K线重新计算
+
+    :param indicators: tuple
+        需要计算的指标，见 czsc_web.indicators.parse_indicators
+    :return: dict
+        dt/open/close/high/low/vol 为 np.ndarray，fx_index/bi_index/xd_index 为下标数组，
+        fx_mark/fx/bi/xd 为对应的取值；请求了指标时 indicators 为 输出名称 -> 与 dt 对齐的数组
+    """
+    bars = ka.kline_raw[-max_count:]
+    dt = np.array([k['dt'] for k in bars], dtype='datetime64[ns]')
+    result = {"dt": dt}
+    for col in ['open', 'close', 'high', 'low', 'vol']:
+        result[col] = np.array([k[col] for k in bars], dtype=np.float64)
+
+    for name, points, n in [('fx', ka.fx_list, max_count // 2), ('bi', ka.bi_list, max_count // 4),
+                            ('xd', ka.xd_list, max_count // 8)]:
+        points = points[-n:]
+        points_dt = np.array([x['dt'] for x in points], dtype='datetime64[ns]')
+        index = np.searchsorted(dt, points_dt)
+        found = (index < len(dt)) & (dt[np.minimum(index, len(dt) - 1)] == points_dt)
+        result[name + "_index"] = index[found]
+        result[name] = [x[name] for x, ok in zip(points, found) if ok]
+        if name == 'fx':
+            result['fx_mark'] = [x['fx_mark'] for x, ok in zip(points, found) if ok]
+
+    if indicators:
+        if ka.indicator_engine is None:
+            ka.indicator_engine = IndicatorEngine(ka.max_count)
+        result['indicators'] = ka.indicator_engine.get(indicators, dt, result['close'])
+    return result
+
+
+def _analyzer(kline, key):
+    """返回分析完 kline 的 KlineAnalyze 对象，优先增量更新缓存中的对象"""
+    kline["dt"] = pd.to_datetime(kline["dt"])
+    analyzers = get_analyzers()
+    ka = analyzers.get(key) if key is not None else None
+
+    if ka is not None:
+        bars = _new_bars(ka, kline)
+        if bars is not None:
+            for k in bars:
+                ka.update(k)
+            return ka
+        if kline['dt'].iloc[-1] < ka.end_dt:
+            # 更早日期的请求，不替换缓存中最新的分析状态
+            key = None
+        else:
+            analyzers.pop(key)
+
+    from .incremental import IncrementalKlineAnalyze
+    ka = IncrementalKlineAnalyze(kline, bi_mode="new", verbose=False, use_xd=True, max_count=5000)
+    if key is not None:
+        analyzers.put(key, ka)
+    return ka
+
+
+def analyze_kline(kline, key=None, timings=None, indicators=None):
+    """对K线进行缠论分析
+
+    :param kline: pd.DataFrame
+        columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]
+    :param key: hashable
+        缓存分析状态的 key，如 (数据源, 标的, K线级别)；为 None 时不缓存。
+        带 key 的任务需要通过 run_cpu_on(key, ...) 提交，保证落在同一个进程中
+    :param timings: dict
+        给出时记录 analyze（KlineAnalyze 创建或增量更新）和 to_result 的耗时（秒）
+    :param indicators: tuple
+        需要计算的指标，见 czsc_web.indicators.parse_indicators
+    :return: dict
+        见 to_result
+    """
+    start = time.perf_counter()
+    ka = _analyzer(kline, key)
+    analyzed = time.perf_counter()
+    result = to_result(ka, indicators=indicators)
+    if timings is not None:
+        timings['analyze'] = analyzed - start
+        timings['to_result'] = time.perf_counter() - analyzed
+    return result
+
+
+def analyze_payload(kline, key=None, fmt="json", profile=False, view=None, indicators=None):
+    """对K线进行缠论分析，并编码成指定的输出格式
+
+    :param fmt: str
+        输出格式，见 czsc_web.wire
+    :param view: dict
+        窗口和抽稀参数，见 czsc_web.lod.view；为 None 时返回全部K线
+    :param indicators: tuple
+        需要计算的指标，见 czsc_web.indicators.parse_indicators
+    :param profile: bool
+        是否对分析过程采样，结果保存在 Payload.profile 中
+    :return: Payload
+        Payload.timings 为各阶段的耗时
+    """
+    timings = dict()
+
+    def run():
+        result = analyze_kline(kline, key, timings, indicators)
+        if view is not None:
+            start = time.perf_counter()
+            result = lod_view(result, **view)
+            timings['lod'] = time.perf_counter() - start
+        start = time.perf_counter()
+        payload_ = encode_payload(result, fmt)
+        timings['serialize'] = time.perf_counter() - start
+        return payload_
+
+    if profile:
+        with Sampler() as sampler:
+            payload = run()
+        payload.profile = sampler.stacks
+    else:
+        payload = run()
+    payload.timings = timings
+    return payload
+
+
+def warm_up():
+    """在分析进程中提前导入 czsc，返回当前进程号"""
+    from . import incremental
+    return os.getpid()
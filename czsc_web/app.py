@@ -0,0 +1,362 @@
+# coding: utf-8
+"""
+网页服务
+
+所有数据源共用同一套接口，请求中的 provider 参数指定数据源，不指定时使用 --provider 中的第一个：
+
+    python -m czsc_web --provider=ts,jq
+
+    http://localhost:8005/kline?ts_code=000001.SH&asset=I&freq=D&trade_date=null
+    http://localhost:8005/kline?provider=jq&ts_code=000001.XSHG&freq=D&trade_date=null
+
+/kline 和 /klines 可以只返回图表可见的部分（start/end 或 offset/limit），并按图表宽度抽稀（points），见 czsc_web.lod：
+
+    http://localhost:8005/kline?ts_code=000001.SH&asset=I&freq=5min&limit=500&points=800
+    http://localhost:8005/kline?ts_code=000001.SH&asset=I&freq=5min&offset=500&limit=500&points=800
+
+ma/ema/macd 参数指定随K线一起返回的指标，见 czsc_web.indicators：
+
+    http://localhost:8005/kline?ts_code=000001.SH&asset=I&freq=D&ma=5,10,20,60&macd=12,26,9
+"""
+import json
+import time
+from importlib.metadata import version
+import pandas as pd
+from datetime import datetime, timedelta
+from tornado.options import define, options, parse_command_line
+from tornado.web import RequestHandler, Application, HTTPError
+from tornado.iostream import StreamClosedError
+from tornado.ioloop import IOLoop
+from .executor import run_cpu_on, QueueTimeout
+from .analyze import analyze_kline, analyze_payload
+from .indicators import parse_indicators
+from .wire import negotiate
+from .live import LiveHub, LiveSocket
+from .server import serve
+from .cache import CachedResponseMixin, CacheEntry, get_or_compute, get_or_compute_result, kline_ttl, stream_entries
+from .metrics import MetricsHandler, request_seconds, observe_stage, start_timing, server_timing, timer
+from .profiler import ProfileHandler
+from .prefetch import Prefetcher, read_watchlist
+from .resample import market_of
+from .static import AssetHandler, preload
+from .providers import create_providers
+from .upstream import UpstreamUnavailable
+from .screen import ScreenJob, jobs, start_job, iter_lines, universe
+from . import profiler
+
+# czsc 只在分析进程中导入（见 czsc_web.analyze），这里只检查安装的版本
+czsc_version = version("czsc")
+assert czsc_version == "0.5.8", "当前 czsc 版本为 {}，请升级为 0.5.8 版本".format(czsc_version)
+
+# 端口固定为 8005，不可以调整
+define('port', type=int, default=8005, help='服务器端口')
+define('warmup', type=bool, default=False, help='服务启动后在后台导入 czsc、连接数据源，第一次打开图表不用等待')
+
+
+async def kline_entry(provider, ts_code, freq, trade_date, params, fmt="json", view=None, indicators=None):
+    """单个级别的 K 线分析结果，结果会被缓存，相同参数的并发调用只计算一次
+
+    :param provider: Provider
+        数据源
+    :param params: dict
+        数据源特有的参数，见 Provider.request_params
+    :param fmt: str
+        输出格式，见 czsc_web.wire
+    :param view: dict
+        窗口和抽稀参数，见 czsc_web.lod.view
+    :param indicators: tuple
+        需要计算的指标，见 czsc_web.indicators.parse_indicators
+    :return: CacheEntry
+    """
+    async def compute():
+        end_dt = datetime.strptime(trade_date, "%Y%m%d") + timedelta(days=1)
+        with timer("fetch", provider.name):
+            kline = await provider.fetch_bars(ts_code, freq, end_dt, **params)
+        key = (provider.name, ts_code, freq)
+        start = time.perf_counter()
+        payload = await run_cpu_on(key, analyze_payload, kline, key, fmt, profile=profiler.active(), view=view,
+                                   indicators=indicators)
+        payload.stale = kline.attrs.get('stale', False)
+        elapsed = time.perf_counter() - start
+        # 分析进程中各阶段的耗时随结果一起返回，其余的时间为排队和进出进程池的序列化
+        for stage, seconds in payload.timings.items():
+            observe_stage(stage, seconds, provider.name)
+        observe_stage("cpu_wait", max(0.0, elapsed - sum(payload.timings.values())), provider.name)
+        profiler.merge(payload.profile)
+        return payload
+
+    if profiler.active():
+        # 采样的请求不使用缓存，完整地执行一次
+        return CacheEntry(await compute(), 0)
+    key = (provider.name, ts_code, freq, trade_date, fmt) + tuple(sorted(params.items()))
+    if view is not None:
+        key += tuple(sorted(view.items()))
+    if indicators is not None:
+        key += indicators
+    return await get_or_compute(key, kline_ttl(freq, trade_date, market_of(ts_code, params.get('asset'))), compute)
+
+
+def live_fetch(providers):
+    """实时推送使用的当天最新分析结果，订阅消息中的 provider 指定数据源"""
+    default = next(iter(providers.values()))
+
+    async def fetch(ts_code, freq, provider=None, **params):
+        p = providers[provider] if provider else default
+        params = p.request_params(params)
+        # 订阅同一品种、级别的连接在同一轮询周期内只请求一次数据源
+        key = ("live", p.name, ts_code, freq) + tuple(sorted(params.items()))
+
+        async def compute():
+            end_dt = datetime.strptime(datetime.now().strftime("%Y%m%d"), "%Y%m%d") + timedelta(days=1)
+            kline = await p.fetch_bars(ts_code, freq, end_dt, **params)
+            shard = (p.name, ts_code, freq)
+            return await run_cpu_on(shard, analyze_kline, kline, shard)
+
+        return await get_or_compute_result(key, options.live_interval, compute)
+
+    return fetch
+
+
+def prefetch_load(provider):
+    """预取自选股使用的加载函数：与打开图表的请求相同，结果进入响应缓存"""
+    async def load(ts_code, freq, params):
+        trade_date = datetime.now().strftime("%Y%m%d")
+        await kline_entry(provider, ts_code, freq, trade_date, params)
+
+    return load
+
+
+class BaseHandler(RequestHandler):
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")  # 这个地方可以写域名
+        self.set_header("Access-Control-Allow-Headers", "x-requested-with")
+        self.set_header('Access-Control-Allow-Methods', 'POST, GET, DELETE, OPTIONS')
+
+    def post(self):
+        self.write('some post')
+
+    def get(self):
+        self.write('some get')
+
+    def options(self):
+        self.set_status(204)
+        self.finish()
+
+    def on_finish(self):
+        request_seconds.observe(self.request.request_time(), handler=type(self).__name__, code=self.get_status())
+
+    def get_provider(self):
+        """请求参数 provider 指定的数据源，不指定时使用默认数据源"""
+        providers = self.settings['providers']
+        name = self.get_argument('provider', None)
+        if not name:
+            return next(iter(providers.values()))
+        if name not in providers:
+            raise HTTPError(400, "未启用的数据源：{}，已启用 {}".format(name, list(providers)))
+        return providers[name]
+
+    def get_provider_params(self, provider):
+        return provider.request_params({k: self.get_argument(k) for k in provider.params if self.get_argument(k, None)})
+
+    def get_trade_date(self, view=None):
+        """没有给出 trade_date 时，有 end 参数则分析到 end 当天，否则分析到今天"""
+        trade_date = self.get_argument('trade_date', None)
+        if trade_date is None and view and view.get('end'):
+            return view['end'][:10].replace("-", "")
+        if trade_date in [None, 'null']:
+            trade_date = datetime.now().date().__str__().replace("-", "")
+        return trade_date
+
+    def get_view(self):
+        """窗口和抽稀参数，都没有给出时返回 None，见 czsc_web.lod.view"""
+        view = dict()
+        for name in ['start', 'end']:
+            value = self.get_argument(name, None)
+            if value:
+                try:
+                    dt = pd.Timestamp(value)
+                except ValueError:
+                    raise HTTPError(400, "{} 参数不是有效的时间：{}".format(name, value))
+                if name == 'end' and ":" not in value:
+                    # 只给出日期时包含当天的全部K线
+                    dt = dt.normalize() + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+                view[name] = str(dt)
+        for name in ['offset', 'limit', 'points']:
+            value = self.get_argument(name, None)
+            if value:
+                try:
+                    view[name] = int(value)
+                except ValueError:
+                    raise HTTPError(400, "{} 参数不是整数：{}".format(name, value))
+                if view[name] < 0:
+                    raise HTTPError(400, "{} 参数不能小于 0".format(name))
+        return view or None
+
+    def get_indicators(self):
+        """ma/ema/macd 参数，都没有给出时返回 None，见 czsc_web.indicators.parse_indicators"""
+        try:
+            return parse_indicators({k: self.get_argument(k, None) for k in ['ma', 'ema', 'macd']})
+        except ValueError as e:
+            raise HTTPError(400, "指标参数错误：{}".format(e))
+
+
+class BasicHandler(BaseHandler):
+    """股票基本信息"""
+    def get(self):
+        ts_code = self.get_argument('ts_code')
+        basic = self.get_provider().symbol_info(ts_code)
+        results = {"msg": "success", "basic": [basic] if basic else None}
+        self.write(json.dumps(results, ensure_ascii=False))
+
+
+class SearchHandler(BaseHandler):
+    """按代码前缀或者名称搜索标的"""
+    def get(self):
+        q = self.get_argument('q')
+        limit = int(self.get_argument('limit', 20))
+        results = {"msg": "success", "data": self.get_provider().search(q, min(limit, 100))}
+        self.write(json.dumps(results, ensure_ascii=False))
+
+
+class KlineHandler(CachedResponseMixin, BaseHandler):
+    """K 线"""
+    async def get(self):
+        provider = self.get_provider()
+        ts_code = self.get_argument('ts_code')
+        freq = self.get_argument('freq')
+        params = self.get_provider_params(provider)
+        view = self.get_view()
+        trade_date = self.get_trade_date(view)
+        indicators = self.get_indicators()
+        fmt = negotiate(self)
+        timings = start_timing()
+        profile = self.get_argument('profile', None) == '1' and profiler.enabled()
+        stacks = profiler.start_profile() if profile else None
+        try:
+            entry = await kline_entry(provider, ts_code, freq, trade_date, params, fmt, view, indicators)
+        except (QueueTimeout, UpstreamUnavailable) as e:
+            raise HTTPError(503, str(e))
+
+        if profile:
+            self.set_header("X-Profile-Id", profiler.save(stacks, self.request.uri))
+        if options.server_timing or self.get_argument('timing', None) == '1':
+            self.set_header("Server-Timing", server_timing(timings))
+        self.finish_entry(entry)
+
+
+class KlinesHandler(BaseHandler):
+    """多个级别的 K 线，各级别并行计算，按完成的先后逐行输出"""
+    async def get(self):
+        provider = self.get_provider()
+        ts_code = self.get_argument('ts_code')
+        freqs = self.get_argument('freqs').split(",")
+        params = self.get_provider_params(provider)
+        view = self.get_view()
+        trade_date = self.get_trade_date(view)
+        indicators = self.get_indicators()
+        fmt = negotiate(self, allowed=["json", "columnar"])
+        await stream_entries(self, {freq: kline_entry(provider, ts_code, freq, trade_date, params, fmt, view,
+                                                      indicators)
+                                    for freq in freqs})
+
+
+class ScreenHandler(BaseHandler):
+    """多标的批量分析，按完成先后逐行输出摘要，客户端断开时取消任务（尽力取消，见 ScreenJob.cancel），见 czsc_web.screen"""
+    job = None
+
+    async def get(self):
+        provider = self.get_provider()
+        try:
+            symbols = universe(provider, self.get_argument('symbols'))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        freqs = self.get_argument('freqs', 'D').split(",")
+        bars = int(self.get_argument('bars', 0)) or None
+        self.job = start_job(ScreenJob(provider, symbols, freqs, self.get_trade_date(),
+                                       self.get_provider_params(provider), bars))
+
+        self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+        async for line in iter_lines(self.job):
+            self.write(line + "\n")
+            try:
+                await self.flush()
+            except StreamClosedError:
+                self.job.cancel()
+                return
+        self.finish()
+
+    async def post(self):
+        await self.get()
+
+    def on_connection_close(self):
+        if self.job is not None:
+            self.job.cancel()
+
+
+class ScreenJobsHandler(BaseHandler):
+    """批量分析任务的进度；DELETE id=.. 取消任务
+
+    取消是尽力而为的：之后不再开始新的K线获取和分析，已经发给数据源的请求和正在执行的分析会继续完成，
+    任务状态立即变为 cancelled，不再输出结果。
+    """
+    def get(self):
+        self.write(json.dumps({"msg": "success", "data": [job.status_dict() for job in jobs.values()]},
+                              ensure_ascii=False))
+
+    def delete(self):
+        job = jobs.get(self.get_argument('id'))
+        if job is None:
+            raise HTTPError(404, "没有这个批量分析任务")
+        job.cancel()
+        self.write(json.dumps({"msg": "success", "data": job.status_dict()}, ensure_ascii=False))
+
+
+def make_app(providers):
+    """
+
+    :param providers: dict
+        名称 -> Provider，第一个为默认数据源，见 czsc_web.providers.create_providers
+    :return: tornado.web.Application
+    """
+    live_hub = LiveHub(live_fetch(providers))
+    return Application([
+            ('/kline', KlineHandler),
+            ('/klines', KlinesHandler),
+            ('/basic', BasicHandler),
+            ('/search', SearchHandler),
+            ('/live', LiveSocket, {"hub": live_hub}),
+            ('/screen', ScreenHandler),
+            ('/screen/jobs', ScreenJobsHandler),
+            ('/metrics', MetricsHandler),
+            ('/debug/profile', ProfileHandler),
+            (r'^/(.*?)$', AssetHandler, {"path": options.static_path, "default_filename": "index.html"}),
+        ],
+        static_path=options.static_path,
+        providers=providers,
+    )
+
+
+def main(**defaults):
+    """解析命令行参数并启动服务
+
+    :param defaults:
+        命令行参数的默认值，如 provider=["jq"]，命令行中给出的参数优先
+    """
+    for name, value in defaults.items():
+        setattr(options, name, value)
+    parse_command_line()
+    providers = create_providers(options.provider)
+    app = make_app(providers)
+
+    def on_start():
+        for provider in providers.values():
+            provider.start()
+        if options.static_preload:
+            IOLoop.current().spawn_callback(preload, options.static_path)
+        if options.warmup:
+            from .startup import warm_up
+            IOLoop.current().spawn_callback(warm_up, providers)
+        provider = next(iter(providers.values()))
+        Prefetcher(provider, prefetch_load(provider), read_watchlist(), options.watchlist_freqs).start()
+
+    serve(app, options.port, on_start)
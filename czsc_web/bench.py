@@ -0,0 +1,246 @@
+# coding: utf-8
+"""
+/kline 端到端压测
+
+使用 replay 数据源（见 czsc_web/providers/replay.py），不需要数据源账号和网络：
+
+    python -m czsc_web.bench --bench_bars=1000,10000,50000 --bench_panels=1,4,16 --bench_output=bench.json
+    python -m czsc_web.bench --bench_baseline=bench.json --bench_output=bench_new.json
+
+在当前进程中启动服务，通过 HTTP 请求 /kline，每个场景同时请求 panels 个图表，重复 bench_rounds 轮：
+
+* cold - 每个请求使用不同的标的，响应缓存和分析进程中的分析缓存都不命中
+* warm - 先请求一次，之后重复请求相同的标的，命中响应缓存
+
+统计每个场景的 p50/p95/p99 延迟、吞吐量以及当前进程和分析进程的 RSS。另外在当前进程中逐段计时：
+fetch（生成原始K线，含注入的延迟）、normalize、analyze（KlineAnalyze）、serialize（编码为 bench_format 格式）。
+
+分析耗时随K线数量增长很快，K线数量大、并发图表多的场景需要较长时间，可以通过参数缩小范围。
+
+结果保存为 JSON，给出 bench_baseline 时与基准比较，p95 或者某一段的耗时比基准慢 bench_tolerance 以上时
+返回值为 1，可以在 CI 中使用。
+"""
+import os
+import sys
+import json
+import logging
+import time
+import asyncio
+import platform
+import numpy as np
+from datetime import datetime, timedelta
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.options import define, options, parse_command_line
+from .app import make_app
+from .analyze import analyze_kline
+from .wire import encode_payload
+from .normalize import normalize_kline
+from .providers.replay import ReplayProvider, raw_rename
+
+define('bench_bars', type=int, multiple=True, default=[1000, 10000, 50000], help='压测的K线数量，多个用逗号分隔')
+define('bench_panels', type=int, multiple=True, default=[1, 4, 16], help='同时请求的图表数，多个用逗号分隔')
+define('bench_rounds', type=int, default=3, help='每个场景重复的轮数')
+define('bench_freq', type=str, default='1min', help='压测的K线级别')
+define('bench_format', type=str, default='json', help='压测的输出格式')
+define('bench_trade_date', type=str, default='20200228', help='压测的交易日期')
+define('bench_output', type=str, default='bench.json', help='压测结果的保存文件')
+define('bench_baseline', type=str, default='', help='基准结果文件，给出时与基准比较')
+define('bench_tolerance', type=float, default=0.2, help='比基准慢超过这个比例时认为性能下降')
+
+
+def rss_mb():
+    """当前进程及其子进程（分析进程池）的常驻内存（MB），非 Linux 系统只统计当前进程的峰值"""
+    if not os.path.exists("/proc/self/statm"):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    pid = os.getpid()
+    pids = [pid]
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(name)) as f:
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    pids.append(int(name))
+        except (OSError, IndexError, ValueError):
+            pass
+
+    pages = 0
+    for p in pids:
+        try:
+            with open("/proc/{}/statm".format(p)) as f:
+                pages += int(f.read().split()[1])
+        except OSError:
+            pass
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+            "mean_ms": round(float(np.mean(latencies)), 2)}
+
+
+def stage_timings(provider, bars, rounds):
+    """在当前进程中逐段计时，返回各段耗时的中位数（ms）"""
+    end_dt = datetime.strptime(options.bench_trade_date, "%Y%m%d") + timedelta(days=1)
+    times = {"fetch": [], "normalize": [], "analyze": [], "serialize": []}
+    for i in range(rounds):
+        t0 = time.perf_counter()
+        raw = provider.fetch_raw("STAGE{}.SH".format(i), options.bench_freq, end_dt, bars)
+        t1 = time.perf_counter()
+        kline = normalize_kline(raw, rename=raw_rename)
+        t2 = time.perf_counter()
+        result = analyze_kline(kline)
+        t3 = time.perf_counter()
+        encode_payload(result, options.bench_format)
+        t4 = time.perf_counter()
+        for name, t in zip(times, [t1 - t0, t2 - t1, t3 - t2, t4 - t3]):
+            times[name].append(t * 1000)
+    return dict({"bars": bars}, **{name + "_ms": round(float(np.median(v)), 2) for name, v in times.items()})
+
+
+class Bench:
+    def __init__(self, port):
+        self.base = "http://127.0.0.1:{}".format(port)
+        self.client = AsyncHTTPClient(force_instance=True, max_clients=max(options.bench_panels) * 2)
+
+    def url(self, symbol, bars):
+        return "{}/kline?ts_code={}&freq={}&trade_date={}&bars={}&format={}".format(
+            self.base, symbol, options.bench_freq, options.bench_trade_date, bars, options.bench_format)
+
+    async def request(self, symbol, bars):
+        """返回延迟（ms），请求失败时返回 None"""
+        start = time.perf_counter()
+        response = await self.client.fetch(self.url(symbol, bars), raise_error=False, request_timeout=3600)
+        if response.code != 200:
+            return None
+        return (time.perf_counter() - start) * 1000
+
+    async def scenario(self, cache, bars, panels, rounds):
+        latencies = []
+        errors = 0
+        peak_rss = 0
+        symbols = ["W{}P{}.SH".format(bars, i) for i in range(panels)]
+        if cache == "warm":
+            await asyncio.gather(*[self.request(s, bars) for s in symbols])
+
+        start = time.perf_counter()
+        for r in range(rounds):
+            if cache == "cold":
+                symbols = ["C{}N{}R{}P{}.SH".format(bars, panels, r, i) for i in range(panels)]
+            for latency in await asyncio.gather(*[self.request(s, bars) for s in symbols]):
+                if latency is None:
+                    errors += 1
+                else:
+                    latencies.append(latency)
+            peak_rss = max(peak_rss, rss_mb())
+        elapsed = time.perf_counter() - start
+
+        result = {"cache": cache, "bars": bars, "panels": panels, "requests": rounds * panels, "errors": errors}
+        result.update(_percentiles(latencies))
+        result["throughput_rps"] = round(len(latencies) / elapsed, 2)
+        result["rss_mb"] = round(peak_rss, 1)
+        return result
+
+
+async def run_scenarios():
+    provider = ReplayProvider()
+    app = make_app({provider.name: provider})
+    sockets = bind_sockets(0, "127.0.0.1")
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    bench = Bench(sockets[0].getsockname()[1])
+
+    # 启动分析进程池，不计入结果
+    await bench.request("WARMUP.SH", 1000)
+
+    scenarios = []
+    for bars in options.bench_bars:
+        for panels in options.bench_panels:
+            for cache in ["cold", "warm"]:
+                result = await bench.scenario(cache, bars, panels, options.bench_rounds)
+                print("{cache:>5} bars={bars:<6} panels={panels:<3} p50={p50_ms}ms p95={p95_ms}ms "
+                      "p99={p99_ms}ms {throughput_rps}req/s rss={rss_mb}MB errors={errors}".format(**result))
+                scenarios.append(result)
+    server.stop()
+    return scenarios
+
+
+def compare(report, baseline, tolerance):
+    """与基准比较
+
+    :return: list of str
+        比基准慢超过 tolerance 的指标
+    """
+    regressions = []
+
+    def check(name, value, base):
+        # 差值不到 1ms 的视为误差
+        if value is not None and base and value > base * (1 + tolerance) and value - base > 1:
+            regressions.append("{}: {} -> {}（+{:.0%}）".format(name, base, value, value / base - 1))
+
+    base_scenarios = {(s['cache'], s['bars'], s['panels']): s for s in baseline.get('scenarios', [])}
+    for s in report['scenarios']:
+        b = base_scenarios.get((s['cache'], s['bars'], s['panels']))
+        if b is not None:
+            check("{cache} bars={bars} panels={panels} p95_ms".format(**s), s['p95_ms'], b['p95_ms'])
+
+    base_stages = {s['bars']: s for s in baseline.get('stages', [])}
+    for s in report['stages']:
+        b = base_stages.get(s['bars'])
+        if b is not None:
+            for name in ['fetch_ms', 'normalize_ms', 'analyze_ms', 'serialize_ms']:
+                check("stage bars={} {}".format(s['bars'], name), s[name], b.get(name))
+    return regressions
+
+
+def main():
+    parse_command_line()
+    # 不输出每个请求的访问日志
+    logging.getLogger("tornado.access").setLevel(logging.WARNING)
+    report = {
+        "meta": {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": {name: options[name] for name in ['bench_freq', 'bench_format', 'bench_rounds',
+                                                         'replay_latency', 'cpu_workers', 'io_workers']},
+        },
+        "stages": [],
+        "scenarios": [],
+    }
+
+    provider = ReplayProvider()
+    # 第一次分析时 czsc 有额外的初始化开销，先预热，不计入结果
+    analyze_kline(normalize_kline(provider.fetch_raw("WARMUP.SH", options.bench_freq, datetime.now(), 1000),
+                                  rename=raw_rename))
+    for bars in options.bench_bars:
+        stages = stage_timings(provider, bars, options.bench_rounds)
+        print("stage bars={bars:<6} fetch={fetch_ms}ms normalize={normalize_ms}ms "
+              "analyze={analyze_ms}ms serialize={serialize_ms}ms".format(**stages))
+        report["stages"].append(stages)
+
+    report["scenarios"] = asyncio.run(run_scenarios())
+
+    with open(options.bench_output, 'w', encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("结果已保存到", options.bench_output)
+
+    if options.bench_baseline:
+        with open(options.bench_baseline, 'r', encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), options.bench_tolerance)
+        for line in regressions:
+            print("性能下降", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+# coding: utf-8
+"""
+/kline 的请求合并与响应缓存
+
+相同参数的并发请求只执行一次获取数据和缠论分析，其余请求等待同一个结果；
+结果按K线级别设置有效期缓存起来，历史日期的结果长期有效，当天的结果在当前K线结束时过期。
+缓存的响应带有 ETag，浏览器带 If-None-Match 请求未变化的图表时直接返回 304。
+
+/klines 一次请求多个级别时，各级别并行计算，通过 stream_entries 按完成先后逐行输出。
+/live 的轮询通过 get_or_compute_result 共用同一个缓存和请求合并，缓存的是未编码的分析结果。
+
+多个 worker 进程运行时（--workers），响应同时写入 shared_cache 指定的 sqlite 文件，
+进程内缓存没有命中时先查这个文件，一个进程计算过的结果其他进程直接使用。
+sqlite 的读写（包括等待其他进程释放锁）在 IO 线程池中执行，不阻塞 IOLoop。
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from tornado import gen
+from tornado.escape import json_encode, utf8
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.log import app_log
+from tornado.options import define, options
+from .executor import run_io
+from .wire import Payload
+from .metrics import cache_requests, mark
+from .resample import next_close
+from .upstream import Priority, get_priority, set_priority
+
+define('kline_cache_size', type=int, default=256, help='/kline 响应缓存的最大条目数')
+define('kline_cache_ttl_history', type=int, default=86400, help='历史日期 /kline 响应的缓存秒数')
+define('kline_cache_max_ttl', type=int, default=3600, help='当天 /kline 响应的最长缓存秒数')
+define('kline_cache_ttl_stale', type=int, default=30, help='数据源不可用时用本地K线生成的响应的缓存秒数')
+define('shared_cache', type=str, default='', help='多个进程共用的响应缓存文件（sqlite），为空时只使用进程内缓存')
+define('shared_cache_size', type=int, default=4096, help='共用响应缓存的最大条目数')
+
+shared_cache_path = os.path.join(os.path.expanduser("~"), ".czsc_web", "cache.sqlite")
+
+# K线级别对应的周期长度（秒）
+freq_seconds = {'1min': 60, '5min': 300, '15min': 900, '30min': 1800, '60min': 3600,
+                'D': 86400, 'W': 86400 * 7}
+
+
+def kline_ttl(freq, trade_date, market="stock", now=None):
+    """计算 /kline 响应的缓存秒数
+
+    :param freq: str
+        K线级别
+    :param trade_date: str
+        交易日期，如 20200613
+    :param market: str
+        交易时段类型，见 czsc_web.resample.market_of
+    :param now: datetime
+        当前时间，默认为 datetime.now()
+    :return: float
+    """
+    now = now or datetime.now()
+    end = datetime.strptime(trade_date, "%Y%m%d") + timedelta(days=1)
+    if end <= now:
+        return options.kline_cache_ttl_history
+
+    # 缓存到当前K线结束，按交易时段计算（如A股 60 分钟K线在 10:30、11:30、14:00、15:00 结束），
+    # 午休、收盘后等非交易时间缓存到下一根K线结束
+    ttl = (next_close(freq, market, now) - now).total_seconds()
+    return min(ttl, options.kline_cache_max_ttl)
+
+
+class CacheEntry:
+    def __init__(self, payload, ttl):
+        """
+
+        :param payload: Payload
+            编码后的响应内容，见 czsc_web.wire
+        :param ttl: float
+            缓存秒数
+        """
+        self.payload = payload
+        self.body = payload.body
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()
+        self.expire_at = time.time() + ttl
+
+
+class ResultEntry:
+    """缓存未编码的结果（如 /live 轮询的分析结果），只在进程内缓存"""
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.expire_at = time.time() + ttl
+
+
+class ResponseCache:
+    """有效期 + LRU 淘汰的响应缓存"""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key):
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry.expire_at < time.time():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self._items[key] = entry
+        self._items.move_to_end(key)
+        while len(self._items) > (self.maxsize or options.kline_cache_size):
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+class SharedCache:
+    """多个进程共用的响应缓存，保存在 sqlite 文件中；读写失败时当作没有命中，不影响请求
+
+    get / put 阻塞，在 IO 线程池中执行，同一个进程中的读写共用一个连接，依次进行
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        # 连接在第一次使用时创建，保证在 fork 之后
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS response (key TEXT PRIMARY KEY, expire_at REAL, "
+                       "content_type TEXT, body BLOB, gzip BLOB, br BLOB)")
+            self._db = db
+        return self._db
+
+    def get(self, key):
+        try:
+            with self._lock:
+                row = self._conn().execute("SELECT expire_at, content_type, body, gzip, br FROM response "
+                                           "WHERE key = ?", (repr(key),)).fetchone()
+        except sqlite3.Error as e:
+            app_log.warning("读取共用响应缓存失败：%s", e)
+            return None
+        if row is None or row[0] < time.time():
+            return None
+        payload = Payload(row[2], row[1])
+        for encoding, body in [('gzip', row[3]), ('br', row[4])]:
+            if body is not None:
+                payload.variants[encoding] = body
+        return CacheEntry(payload, row[0] - time.time())
+
+    def put(self, key, entry):
+        payload = entry.payload
+        try:
+            with self._lock:
+                db = self._conn()
+                db.execute("INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?)",
+                           (repr(key), entry.expire_at, payload.content_type, payload.body,
+                            payload.variants.get('gzip'), payload.variants.get('br')))
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    db.execute("DELETE FROM response WHERE expire_at < ?", (time.time(),))
+                    db.execute("DELETE FROM response WHERE key NOT IN (SELECT key FROM response "
+                               "ORDER BY expire_at DESC LIMIT ?)", (options.shared_cache_size,))
+        except sqlite3.Error as e:
+            app_log.warning("写入共用响应缓存失败：%s", e)
+
+
+class SingleFlight:
+    """合并相同 key 的并发调用
+
+    计算以发起者调用数据源的优先级开始（见 czsc_web.upstream），更高优先级的调用者加入时提高，
+    后台预取发起的计算不会让随后打开同一图表的请求排在批量分析后面。
+    """
+
+    def __init__(self):
+        self._calls = dict()
+
+    async def do(self, key, fn):
+        """执行 fn()，同一个 key 正在执行时直接等待已有的结果
+
+        :param key: hashable
+        :param fn: callable
+            返回 awaitable 的函数
+        """
+        call = self._calls.get(key)
+        if call is None:
+            priority = Priority(get_priority())
+
+            async def run():
+                # 只影响这个任务及其子任务
+                set_priority(priority)
+                return await fn()
+
+            fut = asyncio.ensure_future(run())
+            call = self._calls[key] = (fut, priority)
+            fut.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            call[1].raise_to(get_priority())
+        # 某个请求被取消时不能影响其他等待同一结果的请求
+        return await asyncio.shield(call[0])
+
+    def running(self, key):
+        return key in self._calls
+
+
+kline_cache = ResponseCache()
+kline_flight = SingleFlight()
+_shared_cache = None
+
+
+def get_shared_cache():
+    """options.shared_cache 为空时返回 None"""
+    global _shared_cache
+    if _shared_cache is None and options.shared_cache:
+        _shared_cache = SharedCache(options.shared_cache)
+    return _shared_cache
+
+
+async def _save_shared(shared, key, entry):
+    try:
+        await run_io(shared.put, key, entry)
+    except Exception as e:
+        # 如 IO 线程池排队超时，不影响请求
+        app_log.warning("写入共用响应缓存失败：%s", e)
+
+
+def _count_cache(result):
+    cache_requests.inc(result=result)
+    mark("cache", result)
+
+
+async def get_or_compute(key, ttl, compute):
+    """从缓存中读取响应，没有命中时执行 compute 生成
+
+    :param key: hashable
+    :param ttl: float
+        缓存秒数
+    :param compute: callable
+        返回 awaitable 的函数，结果为 Payload
+    :return: CacheEntry
+    """
+    entry = kline_cache.get(key)
+    if entry is not None:
+        _count_cache("hit")
+        return entry
+
+    shared = get_shared_cache()
+    if shared is not None:
+        try:
+            entry = await run_io(shared.get, key)
+        except Exception as e:
+            app_log.warning("读取共用响应缓存失败：%s", e)
+        if entry is not None:
+            kline_cache.put(key, entry)
+            _count_cache("shared")
+            return entry
+    _count_cache("joined" if kline_flight.running(key) else "miss")
+
+    async def _compute():
+        payload = await compute()
+        if payload.stale:
+            # 数据源恢复后尽快更新，也不写入共用缓存
+            entry_ = CacheEntry(payload, min(ttl, options.kline_cache_ttl_stale))
+            kline_cache.put(key, entry_)
+            return entry_
+        entry_ = CacheEntry(payload, ttl)
+        kline_cache.put(key, entry_)
+        if shared is not None:
+            # 写入不需要等待，响应先返回
+            IOLoop.current().spawn_callback(_save_shared, shared, key, entry_)
+        return entry_
+
+    return await kline_flight.do(key, _compute)
+
+
+async def get_or_compute_result(key, ttl, compute):
+    """与 get_or_compute 相同，但缓存 compute 返回的对象本身，不编码、不写入共用缓存
+
+    :param compute: callable
+        返回 awaitable 的函数
+    :return: compute 的结果
+    """
+    entry = kline_cache.get(key)
+    if entry is not None:
+        _count_cache("hit")
+        return entry.value
+    _count_cache("joined" if kline_flight.running(key) else "miss")
+
+    async def _compute():
+        value = await compute()
+        kline_cache.put(key, ResultEntry(value, ttl))
+        return value
+
+    return await kline_flight.do(key, _compute)
+
+
+class CachedResponseMixin:
+    """配合 RequestHandler 使用，输出缓存的响应并处理 If-None-Match"""
+
+    def finish_entry(self, entry):
+        encoding, body = entry.payload.choose(self.request.headers.get("Accept-Encoding"))
+        # 不同压缩方式的内容不同，ETag 也要区分
+        etag = entry.etag if encoding is None else entry.etag[:-1] + "-" + encoding + '"'
+        self.set_header("Etag", etag)
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("Vary", "Accept, Accept-Encoding")
+        if entry.payload.stale:
+            self.set_header("Warning", '110 czsc_web "Response is Stale"')
+        if self.check_etag_header():
+            self.set_status(304)
+            return self.finish()
+        self.set_header("Content-Type", entry.payload.content_type)
+        if encoding is not None:
+            self.set_header("Content-Encoding", encoding)
+        return self.finish(body)
+
+
+async def stream_entries(handler, entries):
+    """逐行输出多个响应，哪个先计算完成就先输出哪个（chunked 传输）
+
+    每行为一个 JSON 对象：{"freq": 名称, "data": 响应内容} 或 {"freq": 名称, "error": 错误信息}，
+    所以只能用于 JSON 格式的响应
+
+    :param handler: RequestHandler
+    :param entries: dict
+        名称 -> 返回 CacheEntry 的 awaitable
+    """
+    handler.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+    names = list(entries.keys())
+    wait = gen.WaitIterator(*[asyncio.ensure_future(entries[name]) for name in names])
+    while not wait.done():
+        try:
+            entry = await wait.next()
+            line = b'{"freq": ' + utf8(json_encode(names[wait.current_index])) + b', "data": ' + entry.body + b'}\n'
+        except Exception as e:
+            line = utf8(json_encode({"freq": names[wait.current_index], "error": str(e)})) + b'\n'
+        handler.write(line)
+        try:
+            await handler.flush()
+        except StreamClosedError:
+            return
+    handler.finish()
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""
+IO 线程池与 CPU 进程池
+
+网络请求（获取K线）放到有界线程池中执行，KlineAnalyze 之类的计算密集任务放到进程池中执行，
+避免阻塞 Tornado 的 IOLoop；任务在队列中等待超过 queue_timeout 秒后直接放弃执行。
+
+进程池由 cpu_workers 个单进程的执行器组成，带 key 的任务总是交给同一个进程执行，
+这样进程内缓存的分析状态（见 czsc_web.analyze）可以在多次请求之间复用。
+
+线程池中的任务在提交时的 contextvars 上下文中执行，当前请求的耗时统计和采样分析在线程中同样生效。
+"""
+import time
+import zlib
+import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tornado.ioloop import IOLoop
+from tornado.options import define, options
+from .metrics import track_future
+from .profiler import sampled_call
+
+define('io_workers', type=int, default=16, help='获取K线数据的线程池大小')
+define('cpu_workers', type=int, default=4, help='执行缠论分析的进程池大小')
+define('queue_timeout', type=float, default=30, help='任务在池中排队的最长等待时间（秒）')
+
+_io_executor = None
+_cpu_executors = None
+_cpu_counter = itertools.count()
+
+
+class QueueTimeout(Exception):
+    """任务排队时间超过 queue_timeout"""
+    pass
+
+
+def _timed_call(submit_time, timeout, fn, args, kwargs):
+    """在线程池/进程池中执行任务，排队超时则直接放弃；必须是模块级函数，才能被进程池序列化"""
+    waited = time.time() - submit_time
+    if timeout and waited > timeout:
+        raise QueueTimeout("任务排队 {:.1f} 秒，超过 {} 秒的限制".format(waited, timeout))
+    return sampled_call(fn, *args, **kwargs)
+
+
+def get_io_executor():
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=options.io_workers, thread_name_prefix="czsc-io")
+    return _io_executor
+
+
+def get_cpu_executors():
+    """全部分析进程的执行器，每个执行器一个进程"""
+    global _cpu_executors
+    if _cpu_executors is None:
+        _cpu_executors = [ProcessPoolExecutor(max_workers=1) for _ in range(options.cpu_workers)]
+    return _cpu_executors
+
+
+def get_cpu_executor(key=None):
+    """获取执行计算任务的进程，key 相同的任务总是分配到同一个进程"""
+    executors = get_cpu_executors()
+    if key is None:
+        i = next(_cpu_counter)
+    else:
+        i = zlib.crc32(str(key).encode("utf-8"))
+    return executors[i % len(executors)]
+
+
+def run_io(fn, *args, **kwargs):
+    """在 IO 线程池中执行阻塞的网络请求
+
+    :return: Future，在协程中 await 获取结果
+    """
+    context = contextvars.copy_context()
+    return track_future("io", IOLoop.current().run_in_executor(
+        get_io_executor(), context.run, _timed_call, time.time(), options.queue_timeout, fn, args, kwargs))
+
+
+def run_cpu(fn, *args, **kwargs):
+    """在进程池中执行计算密集的任务，fn 及其参数必须可以被 pickle
+
+    :return: Future，在协程中 await 获取结果
+    """
+    return track_future("cpu", IOLoop.current().run_in_executor(
+        get_cpu_executor(), _timed_call, time.time(), options.queue_timeout, fn, args, kwargs))
+
+
+def run_cpu_on(key, fn, *args, **kwargs):
+    """同 run_cpu，但 key 相同的任务总是在同一个进程中执行
+
+    :return: Future，在协程中 await 获取结果
+    """
+    return track_future("cpu", IOLoop.current().run_in_executor(
+        get_cpu_executor(key), _timed_call, time.time(), options.queue_timeout, fn, args, kwargs))
@@ -0,0 +1,43 @@
+# coding: utf-8
+"""
+支持增量更新的 KlineAnalyze
+
+导入 czsc 较慢，这个模块只在分析进程中导入，见 czsc_web.analyze
+"""
+from czsc import KlineAnalyze
+
+
+class IncrementalKlineAnalyze(KlineAnalyze):
+    """根据 dt 而不是 open 判断新K线是替换最后一根未完成的K线还是追加"""
+
+    indicator_engine = None
+
+    def update(self, k):
+        if self.kline_raw and k['dt'] == self.kline_raw[-1]['dt']:
+            self.kline_raw[-1] = k
+        else:
+            self.kline_raw.append(k)
+
+        if self.use_ta:
+            self._update_ta()
+
+        self._update_kline_new()
+        self._update_fx_list()
+        self._update_bi_list()
+
+        if self.use_xd:
+            self._update_xd_list()
+
+        self.end_dt = self.kline_raw[-1]['dt']
+        self.latest_price = self.kline_raw[-1]['close']
+
+        if len(self.kline_raw) > self.max_count:
+            last_dt = self.kline_raw[-self.max_count:][0]['dt']
+            self.kline_raw = self.kline_raw[-self.max_count:]
+            self.kline_new = self.kline_new[-self.max_count:]
+            self.ma = [x for x in self.ma if x['dt'] > last_dt]
+            self.macd = [x for x in self.macd if x['dt'] > last_dt]
+            self.fx_list = [x for x in self.fx_list if x['dt'] > last_dt]
+            self.bi_list = [x for x in self.bi_list if x['dt'] > last_dt]
+            if self.use_xd:
+                self.xd_list = [x for x in self.xd_list if x['dt'] > last_dt]
@@ -0,0 +1,254 @@
+# coding: utf-8
+"""
+均线、MACD 等技术指标的增量计算
+
+/kline 和 /klines 通过请求参数指定需要的指标，结果随K线一起返回：
+
+    ma=5,10,20,60      简单移动平均，输出 ma5、ma10 ...
+    ema=12,26          指数移动平均，输出 ema12、ema26
+    macd=12,26,9       MACD，输出 diff、dea、macd
+
+计算方法与 czsc.utils.ta 一致：SMA 前 n 根K线为已有K线的平均值，EMA 以第一根K线的收盘价为初值，
+macd = (diff - dea) * 2。
+
+指标引擎挂在分析进程缓存的 KlineAnalyze 对象上，与分析状态一起缓存和淘汰。收盘价和指标值保存在连续的
+float64 数组中，第一次计算时对整个序列做一次向量化计算，之后每根新K线对每个指标只做 O(1) 的递推；
+最后一根未完成的K线更新时从上一根K线的状态重新递推。新请求的指标在已有的收盘价数组上单独计算一次，
+不影响其他指标。数据源重新复权等K线对不上的情况下全部重新计算。
+"""
+import numpy as np
+import pandas as pd
+
+# 一次新增的K线超过这个数量时直接重新计算，向量化计算比逐根递推快
+_max_steps = 64
+# 均线周期的上限
+max_period = 1000
+
+
+class _Buffer:
+    """可以在末尾追加的连续数组，容量不够时翻倍"""
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.n = 0
+
+    def set(self, values):
+        self.data = np.empty(max(1024, 2 * len(values)), dtype=self.data.dtype)
+        self.data[:len(values)] = values
+        self.n = len(values)
+
+    def append(self, value):
+        if self.n == len(self.data):
+            data = np.empty(2 * len(self.data), dtype=self.data.dtype)
+            data[:self.n] = self.data[:self.n]
+            self.data = data
+        self.data[self.n] = value
+        self.n += 1
+
+    def drop_front(self, n):
+        """丢掉前面 n 个"""
+        self.data[:self.n - n] = self.data[n:self.n]
+        self.n -= n
+
+    @property
+    def values(self):
+        return self.data[:self.n]
+
+    def __len__(self):
+        return self.n
+
+
+def _ema(values, n):
+    # adjust=False 时与 czsc.utils.ta.EMA 的递推公式相同
+    return pd.Series(values, copy=False).ewm(span=n, adjust=False).mean().values
+
+
+def _ema_step(prev, value, n):
+    """EMA 递推一步，prev 为 None 表示第一根K线"""
+    return value if prev is None else prev + 2.0 / (n + 1) * (value - prev)
+
+
+# 每个指标有两个方法：
+#   compute(close) 向量化计算整个序列，返回 (各输出, 最后一根K线之后的状态, 最后一根K线之前的状态)
+#   step(state, close, i) 从第 i-1 根K线之后的状态递推第 i 根K线，返回 (各输出在第 i 根的值, 新状态)
+
+class SMA:
+    def __init__(self, n):
+        self.n = n
+        self.names = ["ma%d" % n]
+
+    def compute(self, close):
+        n = self.n
+        csum = np.cumsum(close)
+        out = np.empty(len(close))
+        k = min(n, len(close))
+        out[:k] = csum[:k] / np.arange(1, k + 1)
+        out[k:] = (csum[k:] - csum[:-k]) / n
+        dropped = close[-n - 1] if len(close) > n else 0.0
+        total = csum[-1] - (csum[-n - 1] if len(close) > n else 0.0)
+        return [out], total, total - close[-1] + dropped
+
+    def step(self, state, close, i):
+        # 状态为最近 n 根K线收盘价的和
+        total = state + close[i] - (close[i - self.n] if i >= self.n else 0.0)
+        return [total / min(i + 1, self.n)], total
+
+
+class EMA:
+    def __init__(self, n):
+        self.n = n
+        self.names = ["ema%d" % n]
+
+    def compute(self, close):
+        out = _ema(close, self.n)
+        return [out], out[-1], out[-2] if len(out) > 1 else None
+
+    def step(self, state, close, i):
+        value = _ema_step(state, close[i], self.n)
+        return [value], value
+
+
+class MACD:
+    names = ["diff", "dea", "macd"]
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = fast
+        self.slow = slow
+        self.signal = signal
+
+    def compute(self, close):
+        fast = _ema(close, self.fast)
+        slow = _ema(close, self.slow)
+        diff = fast - slow
+        dea = _ema(diff, self.signal)
+        state = (fast[-1], slow[-1], dea[-1])
+        prev = (fast[-2], slow[-2], dea[-2]) if len(close) > 1 else (None, None, None)
+        return [diff, dea, (diff - dea) * 2], state, prev
+
+    def step(self, state, close, i):
+        fast = _ema_step(state[0], close[i], self.fast)
+        slow = _ema_step(state[1], close[i], self.slow)
+        diff = fast - slow
+        dea = _ema_step(state[2], diff, self.signal)
+        return [diff, dea, (diff - dea) * 2], (fast, slow, dea)
+
+
+def parse_indicators(args):
+    """从请求参数中解析指标
+
+    :param args: dict
+        参数名 -> 字符串，如 {"ma": "5,10,20", "macd": "12,26,9"}
+    :return: tuple
+        如 (("ma", 5), ("ma", 10), ("ma", 20), ("macd", 12, 26, 9))，可以用作缓存 key；没有指标时返回 None
+    :raise: ValueError 参数不正确
+    """
+    spec = []
+    for name in ['ma', 'ema']:
+        if args.get(name):
+            for p in args[name].split(","):
+                n = int(p)
+                if not 1 <= n <= max_period:
+                    raise ValueError("{} 的周期应在 1 到 {} 之间：{}".format(name, max_period, p))
+                if (name, n) not in spec:
+                    spec.append((name, n))
+    if args.get('macd'):
+        params = [int(p) for p in args['macd'].split(",")] if args['macd'] not in ["1", "true"] else [12, 26, 9]
+        if len(params) != 3 or not all(1 <= p <= max_period for p in params):
+            raise ValueError("macd 参数应为 快周期,慢周期,信号周期，如 12,26,9")
+        spec.append(("macd",) + tuple(params))
+    return tuple(spec) or None
+
+
+def _create(item):
+    name, params = item[0], item[1:]
+    return {"ma": SMA, "ema": EMA, "macd": MACD}[name](*params)
+
+
+class IndicatorEngine:
+    """一个K线序列上的全部指标"""
+
+    def __init__(self, max_count=5000):
+        self.max_count = max_count
+        self.dt = _Buffer('datetime64[ns]')
+        self.close = _Buffer(np.float64)
+        # spec 中的一项 -> [指标, 各输出的 _Buffer, 最后一根K线之后的状态, 之前的状态]
+        self._items = dict()
+
+    def _compute(self, item):
+        indicator = self._items[item][0] if item in self._items else _create(item)
+        outputs, state, prev = indicator.compute(self.close.values)
+        buffers = [_Buffer(np.float64) for _ in outputs]
+        for buffer, values in zip(buffers, outputs):
+            buffer.set(values)
+        self._items[item] = [indicator, buffers, state, prev]
+
+    def _recompute(self, dt, close):
+        self.dt.set(dt)
+        self.close.set(close)
+        for item in list(self._items):
+            self._compute(item)
+
+    def _step(self, i, replace):
+        """递推第 i 根K线；replace 为 True 时第 i 根K线是替换原来的最后一根"""
+        close = self.close.values
+        for entry in self._items.values():
+            indicator, buffers, state, prev = entry
+            values, new_state = indicator.step(prev if replace else state, close, i)
+            for buffer, value in zip(buffers, values):
+                if replace:
+                    buffer.data[buffer.n - 1] = value
+                else:
+                    buffer.append(value)
+            entry[2], entry[3] = new_state, (prev if replace else state)
+
+    def sync(self, dt, close):
+        """与最新的K线对齐
+
+        :param dt: np.ndarray
+            datetime64[ns]，升序
+        :param close: np.ndarray
+            float64 收盘价
+        """
+        if len(self.dt) == 0:
+            return self._recompute(dt, close)
+
+        last = self.dt.values[-1]
+        i = int(np.searchsorted(dt, last))
+        if i == len(dt) or dt[i] != last or len(dt) - i - 1 > _max_steps \
+                or len(self.dt) < i + 1 or self.dt.values[-i - 1] != dt[0] \
+                or (i > 0 and self.close.values[-2] != close[i - 1]):
+            # K线不连续、新增太多或者前面的K线有变化（重新复权）
+            return self._recompute(dt, close)
+
+        if close[i] != self.close.values[-1]:
+            # 最后一根未完成的K线有更新
+            self.close.data[self.close.n - 1] = close[i]
+            self._step(len(self.close) - 1, replace=True)
+        for j in range(i + 1, len(dt)):
+            self.dt.append(dt[j])
+            self.close.append(close[j])
+            self._step(len(self.close) - 1, replace=False)
+
+        if len(self.close) > 2 * self.max_count:
+            n = len(self.close) - self.max_count
+            for buffer in [self.dt, self.close] + [b for entry in self._items.values() for b in entry[1]]:
+                buffer.drop_front(n)
+
+    def get(self, spec, dt, close):
+        """计算 spec 中的指标
+
+        :return: dict
+            输出名称 -> 与 dt 对齐的 float64 数组
+        """
+        if len(dt) == 0:
+            return {name: np.array([], dtype=np.float64) for item in spec for name in _create(item).names}
+
+        self.sync(dt, close)
+        result = dict()
+        for item in spec:
+            if item not in self._items:
+                self._compute(item)
+            indicator, buffers = self._items[item][:2]
+            for name, buffer in zip(indicator.names, buffers):
+                result[name] = buffer.values[-len(dt):]
+        return result
@@ -0,0 +1,164 @@
+# coding: utf-8
+"""
+聚宽 JQData HTTP 接口客户端
+
+* token 缓存在内存中，过期或者接口返回 token 相关的错误时才重新获取
+* 服务运行时通过 Tornado 的 AsyncHTTPClient 发起请求，max_clients 限制并发数；pycurl 是可选依赖，
+  安装了时使用 CurlAsyncHTTPClient，连接可以复用（keep-alive），没有时退回 SimpleAsyncHTTPClient，
+  每次请求都要重新建立 TLS 连接，启动时给出警告
+* 线程池中的同步调用会被提交到 IOLoop 上执行，多个 get_price / get_price_period 请求可以并发
+* 没有绑定 IOLoop 时（如在脚本中直接调用）使用 requests.Session，同样可以复用连接
+* 这里不重试，网络错误由 UpstreamGate 统一重试和熔断，见 czsc_web.upstream；接口返回的错误（JqError）不重试
+"""
+import os
+import json
+import time
+import pickle
+import asyncio
+import threading
+from tornado.httpclient import HTTPRequest
+from tornado.log import app_log
+from tornado.options import define, options
+from .upstream import ProviderError
+
+define('jq_max_clients', type=int, default=10, help='聚宽接口的最大并发请求数')
+define('jq_timeout', type=float, default=30, help='聚宽接口的请求超时时间（秒）')
+define('jq_token_ttl', type=int, default=3600 * 6, help='聚宽 token 的缓存秒数')
+
+url = "https://dataapi.joinquant.com/apis"
+file_token = os.path.join(os.path.expanduser("~"), "jq.token")
+
+
+class JqError(ProviderError):
+    """聚宽接口返回的错误，不重试"""
+    pass
+
+
+def _new_http_client():
+    try:
+        from tornado.curl_httpclient import CurlAsyncHTTPClient
+        return CurlAsyncHTTPClient(force_instance=True, max_clients=options.jq_max_clients)
+    except ImportError:
+        from tornado.simple_httpclient import SimpleAsyncHTTPClient
+        app_log.warning("没有安装 pycurl，聚宽接口的每次请求都要重新建立连接，请执行 pip install pycurl")
+        return SimpleAsyncHTTPClient(force_instance=True, max_clients=options.jq_max_clients)
+
+
+def _is_token_error(text):
+    return text.startswith("error") and "token" in text.lower()
+
+
+class JqClient:
+    def __init__(self, path=None):
+        """
+
+        :param path: str
+            set_token 保存的账号文件，默认为 ~/jq.token
+        """
+        self.file_token = path or file_token
+        self._token = None
+        self._token_time = 0
+        self._token_future = None
+        self._token_lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+        self._http = None
+        self._session = None
+
+    def bind(self, io_loop):
+        """绑定服务的 IOLoop，之后其他线程中的同步调用都会提交到这个 IOLoop 上异步执行"""
+        self._loop = io_loop.asyncio_loop
+        self._loop_thread = threading.get_ident()
+        self._http = _new_http_client()
+
+    def _credential(self):
+        if not os.path.exists(self.file_token):
+            raise ValueError(f"{self.file_token} 文件不存在，请先调用 set_token 进行设置")
+        with open(self.file_token, 'rb') as f:
+            jq_mob, jq_pwd = pickle.load(f)
+        return {"method": "get_current_token", "mob": jq_mob, "pwd": jq_pwd}
+
+    def _cached_token(self):
+        if self._token and time.time() - self._token_time < options.jq_token_ttl:
+            return self._token
+        return None
+
+    def _set_token(self, token):
+        if token.startswith("error"):
+            raise JqError(token)
+        self._token = token
+        self._token_time = time.time()
+        return token
+
+    def invalidate_token(self):
+        self._token = None
+
+    # 异步调用 -----------------------------------------------------------------
+    async def _post(self, body):
+        response = await self._http.fetch(HTTPRequest(url, method="POST", body=json.dumps(body),
+                                                      request_timeout=options.jq_timeout))
+        return response.body.decode("utf-8")
+
+    async def get_token(self):
+        token = self._cached_token()
+        if token:
+            return token
+        # 并发的请求共用一次 token 获取
+        if self._token_future is None:
+            self._token_future = asyncio.ensure_future(self._post(self._credential()))
+            self._token_future.add_done_callback(lambda _: setattr(self, "_token_future", None))
+        return self._set_token(await asyncio.shield(self._token_future))
+
+    async def call(self, method, **params):
+        """调用聚宽接口
+
+        :param method: str
+            接口名称，如 get_price / get_price_period
+        :return: str
+            接口返回的文本
+        """
+        for retry_token in [True, False]:
+            body = dict(method=method, token=await self.get_token(), **params)
+            text = await self._post(body)
+            if _is_token_error(text) and retry_token:
+                self.invalidate_token()
+                continue
+            if text.startswith("error"):
+                raise JqError(text)
+            return text
+
+    # 同步调用 -----------------------------------------------------------------
+    def _post_sync(self, body):
+        # requests 只在没有绑定 IOLoop 时使用，用到时才导入
+        import requests
+        if self._session is None:
+            self._session = requests.Session()
+        response = self._session.post(url, data=json.dumps(body), timeout=options.jq_timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.text
+
+    def get_token_sync(self):
+        with self._token_lock:
+            token = self._cached_token()
+            if token:
+                return token
+            return self._set_token(self._post_sync(self._credential()))
+
+    def call_sync(self, method, **params):
+        """同步调用聚宽接口，参数同 call
+
+        绑定了 IOLoop 且不在 IOLoop 线程中时，请求提交到 IOLoop 上执行，否则使用 requests.Session
+        """
+        if self._loop is not None and self._loop.is_running() and threading.get_ident() != self._loop_thread:
+            future = asyncio.run_coroutine_threadsafe(self.call(method, **params), self._loop)
+            return future.result()
+
+        for retry_token in [True, False]:
+            text = self._post_sync(dict(method=method, token=self.get_token_sync(), **params))
+            if _is_token_error(text) and retry_token:
+                self.invalidate_token()
+                continue
+            if text.startswith("error"):
+                raise JqError(text)
+            return text
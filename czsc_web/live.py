@@ -0,0 +1,260 @@
+# coding: utf-8
+"""
+WebSocket 实时推送
+
+客户端连接 /live 之后发送订阅消息：
+
+    {"action": "subscribe", "ts_code": "000001.SH", "freq": "1min", "asset": "I"}
+    {"action": "unsubscribe", "ts_code": "000001.SH", "freq": "1min", "asset": "I"}
+
+除 action 以外的字段都会传给数据源的 fetch 函数。同一组参数不管有多少个客户端订阅，
+服务端只有一个轮询任务：每 live_interval 秒获取一次最新的分析结果，与上一次的结果比较，
+有变化时通知订阅的客户端。参数写法不同（如省略 provider）但实际相同的订阅在 fetch 中按
+规范化的参数共用 czsc_web.cache 的缓存和请求合并，同一轮询周期内只请求一次数据源。
+
+第一次推送为完整的快照，之后只推送变化的部分：
+
+    {"type": "snapshot", "ts_code": ..., "freq": ..., "data": 与 format=columnar 的格式一致}
+    {"type": "delta", "ts_code": ..., "freq": ...,
+     "bars": {"dt": [...], "open": [...], ...},     # 更新的最后一根K线以及新增的K线
+     "fx": {"set": [[dt, mark, value], ...], "remove": [dt, ...]},
+     "bi": {"set": [[dt, value], ...], "remove": [dt, ...]},
+     "xd": {"set": [[dt, value], ...], "remove": [dt, ...]}}
+
+dt 均为秒级时间戳。每个客户端同一时间只有一条消息在发送，消费慢的客户端发送完成后
+直接收到从它已有的状态到最新状态的一条合并的 delta，中间的状态被跳过，不会在服务端堆积。
+"""
+import json
+import asyncio
+import numpy as np
+from tornado.escape import json_encode
+from tornado.log import app_log
+from tornado.options import define, options
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
+from .wire import columnar, _epoch_seconds
+
+define('live_interval', type=float, default=3, help='实时推送轮询数据源的间隔（秒）')
+define('live_max_subscriptions', type=int, default=16, help='每个 WebSocket 连接最多的订阅数')
+
+_bar_columns = ['open', 'close', 'high', 'low', 'vol']
+
+
+def _points(result, name, since):
+    """dt -> 取值，只保留 dt >= since 的点"""
+    dt = _epoch_seconds(result['dt'][result[name + '_index']]).tolist()
+    if name == 'fx':
+        values = [[m, v] for m, v in zip(result['fx_mark'], result['fx'])]
+    else:
+        values = [[v] for v in result[name]]
+    return {d: v for d, v in zip(dt, values) if d >= since}
+
+
+def diff_result(old, new):
+    """比较两次分析结果
+
+    :param old: dict
+        客户端已有的分析结果，见 czsc_web.analyze.to_result；为 None 时返回快照
+    :param new: dict
+        最新的分析结果
+    :return: dict
+        snapshot 或 delta 消息的内容（不含订阅参数），没有变化时返回 None
+    """
+    if old is None or len(old['dt']) == 0:
+        return {"type": "snapshot", "data": columnar(new)}
+
+    old_dt, new_dt = old['dt'], new['dt']
+    pos = int(np.searchsorted(new_dt, old_dt[-1]))
+    if pos >= len(new_dt) or new_dt[pos] != old_dt[-1]:
+        return {"type": "snapshot", "data": columnar(new)}
+    # 已完成的K线发生变化，说明数据源重新复权了
+    if pos >= 1 and len(old_dt) >= 2 and (new_dt[pos - 1] != old_dt[-2] or
+                                          any(new[c][pos - 1] != old[c][-2] for c in _bar_columns)):
+        return {"type": "snapshot", "data": columnar(new)}
+
+    if pos == len(new_dt) - 1 and all(new[c][pos] == old[c][-1] for c in _bar_columns):
+        return None
+
+    message = {"type": "delta", "bars": {"dt": _epoch_seconds(new_dt[pos:]).tolist()}}
+    for col in _bar_columns:
+        message['bars'][col] = new[col][pos:].tolist()
+
+    since = int(_epoch_seconds(new_dt[:1])[0])
+    for name in ['fx', 'bi', 'xd']:
+        old_points = _points(old, name, since)
+        new_points = _points(new, name, since)
+        message[name] = {
+            "set": [[d] + v for d, v in new_points.items() if old_points.get(d) != v],
+            "remove": [d for d in old_points if d not in new_points],
+        }
+    return message
+
+
+class Channel:
+    """一组订阅参数对应的轮询任务"""
+
+    def __init__(self, hub, key, params):
+        self.hub = hub
+        self.key = key
+        self.params = params
+        self.clients = set()
+        self.latest = None
+        self._prev = None
+        self._delta = None
+        self._error = None
+        self._task = None
+
+    def add(self, client):
+        self.clients.add(client)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._poll())
+        elif self.latest is not None:
+            client.notify(self)
+
+    def discard(self, client):
+        self.clients.discard(client)
+        if not self.clients and self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.hub.remove(self)
+
+    def publish(self, result):
+        """更新最新结果，有变化时通知所有客户端"""
+        delta = diff_result(self.latest, result)
+        if delta is None:
+            return
+        self._prev, self.latest = self.latest, result
+        self._delta = self._encode(delta)
+        for client in list(self.clients):
+            client.notify(self)
+
+    def _encode(self, message):
+        return json_encode(dict(self.params, **message))
+
+    def message_for(self, sent):
+        """客户端已有的结果为 sent 时需要发送的消息，没有需要发送的内容时返回 None"""
+        if sent is self.latest:
+            return None
+        if sent is self._prev:
+            return self._delta
+        message = diff_result(sent, self.latest)
+        return self._encode(message) if message is not None else None
+
+    async def _poll(self):
+        while self.clients:
+            try:
+                self.publish(await self.hub.fetch(**self.params))
+                self._error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 同样的错误只通知一次
+                if str(e) != self._error:
+                    self._error = str(e)
+                    app_log.warning("实时推送获取 %s 失败：%s", self.params, e)
+                    for client in list(self.clients):
+                        client.push_error(self.params, self._error)
+            await asyncio.sleep(options.live_interval)
+
+
+class LiveHub:
+    def __init__(self, fetch):
+        """
+
+        :param fetch: callable
+            fetch(**params) 返回 awaitable，结果为 czsc_web.analyze.to_result 格式的分析结果
+        """
+        self.fetch = fetch
+        self.channels = dict()
+
+    @staticmethod
+    def key_of(params):
+        return tuple(sorted(params.items()))
+
+    def subscribe(self, client, params):
+        key = self.key_of(params)
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = Channel(self, key, params)
+        channel.add(client)
+        return channel
+
+    def unsubscribe(self, client, params):
+        channel = self.channels.get(self.key_of(params))
+        if channel is not None:
+            channel.discard(client)
+
+    def remove(self, channel):
+        if self.channels.get(channel.key) is channel:
+            del self.channels[channel.key]
+
+
+class LiveSocket(WebSocketHandler):
+    """实时推送的 WebSocket 连接"""
+
+    def initialize(self, hub):
+        self.hub = hub
+        self.channels = dict()
+        self._sent = dict()
+        self._dirty = dict()
+        self._pumping = False
+
+    def check_origin(self, origin):
+        # 与其他接口一样允许跨域访问
+        return True
+
+    def on_message(self, message):
+        try:
+            params = json.loads(message)
+            action = params.pop('action')
+        except (ValueError, KeyError, AttributeError):
+            return self.push_error(None, "消息格式错误：{}".format(message))
+
+        params = {k: str(v) for k, v in params.items()}
+        key = self.hub.key_of(params)
+        if action == "subscribe" and key not in self.channels:
+            if len(self.channels) >= options.live_max_subscriptions:
+                return self.push_error(params, "订阅数超过 {} 的限制".format(options.live_max_subscriptions))
+            self.channels[key] = self.hub.subscribe(self, params)
+        elif action == "unsubscribe" and key in self.channels:
+            self._forget(self.channels.pop(key))
+            self.hub.unsubscribe(self, params)
+
+    def _forget(self, channel):
+        self._sent.pop(channel.key, None)
+        self._dirty.pop(channel.key, None)
+
+    def notify(self, channel):
+        """channel 有更新，空闲时立即发送，正在发送时等发送完成后合并发送"""
+        self._dirty[channel.key] = channel
+        if not self._pumping:
+            self._pumping = True
+            asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        try:
+            while self._dirty:
+                key, channel = self._dirty.popitem()
+                latest = channel.latest
+                message = channel.message_for(self._sent.get(key))
+                if message is None:
+                    continue
+                self._sent[key] = latest
+                # 等待写入完成，慢的客户端在这里形成背压
+                await self.write_message(message)
+        except WebSocketClosedError:
+            pass
+        finally:
+            self._pumping = False
+
+    def push_error(self, params, error):
+        message = dict(params or {}, type="error", error=error)
+        try:
+            self.write_message(json_encode(message))
+        except WebSocketClosedError:
+            pass
+
+    def on_close(self):
+        for channel in list(self.channels.values()):
+            self._forget(channel)
+            self.hub.unsubscribe(self, channel.params)
+        self.channels.clear()
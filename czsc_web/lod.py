@@ -0,0 +1,130 @@
+# coding: utf-8
+"""
+按图表可见范围截取分析结果，并按屏幕宽度抽稀
+
+缠论分析仍然在完整的K线上进行，这里只决定返回给前端的是哪一段、多少根K线：
+
+* 窗口 - start/end 按时间截取；offset/limit 从最新的K线往前数，跳过 offset 根后取 limit 根，
+  前端向左拖动图表时，用 offset 加上已有的K线数量继续加载更早的部分
+* 抽稀 - points 给出最多返回的K线数量（一般为图表宽度的像素数除以 2），K线数量超过 points 时
+  把相邻的K线合并成一根（开盘取第一根、收盘取最后一根、最高最低取极值、成交量求和，时间取最后一根），
+  笔和线段的端点所在的K线不参与合并，端点的时间和数值保持不变；
+  其余分型落在合并后的K线上，同一根合并K线中有多个分型时，保留与合并K线最高/最低价相同的那个；
+  均线、MACD 等指标与收盘价一样取合并K线中最后一根的值
+
+截取和抽稀之后，结果中增加 window 字段：
+
+    {"total": 分析结果的K线总数, "offset": 窗口之后（更新）的K线数量, "count": 窗口内的K线数量,
+     "step": 合并的K线数量最多为几根（1 表示没有抽稀）, "more": 窗口之前是否还有K线}
+"""
+import numpy as np
+import pandas as pd
+
+_bar_columns = ['open', 'close', 'high', 'low', 'vol']
+_points = ['fx', 'bi', 'xd']
+
+
+def _slice(result, lo, hi):
+    """截取 [lo, hi) 之间的K线，分型、笔、线段的下标相应平移"""
+    sliced = {"dt": result['dt'][lo:hi]}
+    for col in _bar_columns:
+        sliced[col] = result[col][lo:hi]
+    for name in _points:
+        index = result[name + '_index']
+        keep = (index >= lo) & (index < hi)
+        sliced[name + '_index'] = index[keep] - lo
+        sliced[name] = [v for v, ok in zip(result[name], keep) if ok]
+        if name == 'fx':
+            sliced['fx_mark'] = [v for v, ok in zip(result['fx_mark'], keep) if ok]
+    if 'indicators' in result:
+        sliced['indicators'] = {k: v[lo:hi] for k, v in result['indicators'].items()}
+    return sliced
+
+
+def window(result, start=None, end=None, offset=None, limit=None):
+    """按时间或者K线数量截取分析结果
+
+    :param result: dict
+        czsc_web.analyze.to_result 的返回值
+    :param start: str
+        开始时间（包含），如 20200101、2020-01-01 09:35:00
+    :param end: str
+        结束时间（包含）
+    :param offset: int
+        从 end（没有 end 时为最新的K线）往前跳过的K线数量
+    :param limit: int
+        最多返回的K线数量，从后往前取
+    :return: dict
+    """
+    dt = result['dt']
+    total = len(dt)
+    hi = total if end is None else int(np.searchsorted(dt, pd.Timestamp(end).to_datetime64(), side='right'))
+    lo = 0 if start is None else int(np.searchsorted(dt, pd.Timestamp(start).to_datetime64(), side='left'))
+    hi = max(lo, hi - (offset or 0))
+    if limit:
+        lo = max(lo, hi - limit)
+
+    windowed = _slice(result, lo, hi) if (lo, hi) != (0, total) else dict(result)
+    windowed['window'] = {"total": total, "offset": total - hi, "count": hi - lo, "step": 1, "more": lo > 0}
+    return windowed
+
+
+def _bucket_fx(result, starts, sizes, high, low):
+    """每根合并K线最多保留一个分型，优先保留与合并K线最高/最低价相同的分型"""
+    bucket = np.searchsorted(starts, result['fx_index'], side='right') - 1
+    chosen = dict()
+    for i, (b, mark, value) in enumerate(zip(bucket.tolist(), result['fx_mark'], result['fx'])):
+        extreme = sizes[b] == 1 or value == (high[b] if mark == 'g' else low[b])
+        if b not in chosen or (extreme and not chosen[b][1]):
+            chosen[b] = (i, extreme)
+    picked = sorted(i for i, _ in chosen.values())
+    return (bucket[picked] if picked else np.array([], dtype=np.int64),
+            [result['fx'][i] for i in picked], [result['fx_mark'][i] for i in picked])
+
+
+def downsample(result, points):
+    """把K线合并到最多约 points 根，保留笔和线段的端点
+
+    笔和线段的端点单独成为一根K线，端点较多时返回的K线数量会超过 points，但不超过 points 加上端点数量的两倍
+
+    :param result: dict
+        czsc_web.analyze.to_result 或 window 的返回值
+    :param points: int
+        最多返回的K线数量
+    :return: dict
+    """
+    n = len(result['dt'])
+    if not points or n <= points:
+        return result
+
+    pivots = np.union1d(result['bi_index'], result['xd_index']).astype(np.int64)
+    budget = max(points - 2 * len(pivots), points // 2, 1)
+    step = -(-n // budget)
+    starts = np.union1d(np.arange(0, n, step), np.r_[pivots, pivots + 1])
+    starts = starts[starts < n]
+    ends = np.r_[starts[1:], n]
+    sizes = ends - starts
+
+    sampled = {
+        "dt": result['dt'][ends - 1],
+        "open": result['open'][starts],
+        "close": result['close'][ends - 1],
+        "high": np.maximum.reduceat(result['high'], starts),
+        "low": np.minimum.reduceat(result['low'], starts),
+        "vol": np.add.reduceat(result['vol'], starts),
+    }
+    for name in ['bi', 'xd']:
+        sampled[name + '_index'] = np.searchsorted(starts, result[name + '_index'])
+        sampled[name] = list(result[name])
+    sampled['fx_index'], sampled['fx'], sampled['fx_mark'] = _bucket_fx(result, starts, sizes,
+                                                                        sampled['high'], sampled['low'])
+    if 'indicators' in result:
+        sampled['indicators'] = {k: v[ends - 1] for k, v in result['indicators'].items()}
+    if 'window' in result:
+        sampled['window'] = dict(result['window'], step=int(sizes.max()))
+    return sampled
+
+
+def view(result, start=None, end=None, offset=None, limit=None, points=None):
+    """先截取窗口再抽稀，参数见 window 和 downsample"""
+    return downsample(window(result, start, end, offset, limit), points)
@@ -0,0 +1,182 @@
+# coding: utf-8
+"""
+标的基本信息
+
+全部标的的基本信息保存在内存中，按标的代码建立哈希索引，/basic 直接查表返回；
+另外按代码排序建立前缀索引，配合名称的模糊匹配实现 /search。
+
+各数据源的基本信息统一为 meta_fields 中的字段，表在后台定期刷新，刷新完成后整体替换，
+请求不会等待刷新。刷新结果同时保存到本地，服务重启时先加载本地文件，不需要等待数据源返回。
+"""
+import os
+import json
+import time
+import asyncio
+from bisect import bisect_left
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.options import define, options
+from .executor import run_io
+
+define('meta_path', type=str, default=os.path.join(os.path.expanduser("~"), ".czsc_web", "meta"),
+       help='标的基本信息的本地缓存目录')
+define('meta_refresh_interval', type=int, default=3600, help='标的基本信息的刷新间隔（秒）')
+
+meta_fields = ['symbol', 'name', 'area', 'industry', 'market', 'list_date']
+
+# 掘金的代码格式为 交易所.代码，其他数据源为 代码.交易所
+_prefix_exchanges = ['SHSE', 'SZSE', 'CFFEX', 'SHFE', 'DCE', 'CZCE', 'INE', 'GFEX']
+
+
+def code_of(symbol):
+    """去掉交易所部分的代码，如 600000.SH / 600000.XSHG / SHSE.600000 都返回 600000"""
+    parts = symbol.split(".")
+    if len(parts) == 2 and parts[0] in _prefix_exchanges:
+        return parts[1]
+    return parts[0]
+
+
+def meta_records(df, rename=None):
+    """把数据源返回的基本信息整理成 meta_fields 的格式
+
+    :param df: pd.DataFrame
+    :param rename: dict
+        数据源列名 -> 标准列名
+    :return: list of dict
+    """
+    df = df.rename(columns=rename or {})
+    for field in meta_fields:
+        if field not in df.columns:
+            df[field] = ""
+    return df[meta_fields].fillna("").astype(str).to_dict('records')
+
+
+class SymbolTable:
+    """标的基本信息表，创建之后不再修改，刷新时整体替换"""
+
+    def __init__(self, records):
+        self.records = {r['symbol']: r for r in records}
+        self._codes = dict()
+        keys = []
+        for symbol in self.records:
+            code = code_of(symbol)
+            self._codes.setdefault(code.upper(), symbol)
+            keys.append((symbol.upper(), symbol))
+            if code != symbol:
+                keys.append((code.upper(), symbol))
+        self._keys = sorted(keys)
+        self._names = [(r['name'].upper(), r['symbol']) for r in records]
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, symbol):
+        """按标的代码查找，也可以只给出不含交易所的代码，如 600000
+
+        :return: dict，没有找到时返回 None
+        """
+        record = self.records.get(symbol)
+        if record is None and "." not in symbol:
+            record = self.records.get(self._codes.get(symbol.upper(), ""))
+        return record
+
+    def search(self, q, limit=20):
+        """搜索标的：先按代码前缀匹配，数量不够时再按代码、名称包含 q 匹配
+
+        :param q: str
+            代码或者名称的一部分
+        :param limit: int
+            最多返回的数量
+        :return: list of dict
+        """
+        q = q.strip().upper()
+        if not q:
+            return []
+
+        found = []
+        i = bisect_left(self._keys, (q,))
+        while i < len(self._keys) and len(found) < limit and self._keys[i][0].startswith(q):
+            if self._keys[i][1] not in found:
+                found.append(self._keys[i][1])
+            i += 1
+
+        if len(found) < limit:
+            for name, symbol in self._names:
+                if (q in name or q in symbol.upper()) and symbol not in found:
+                    found.append(symbol)
+                    if len(found) >= limit:
+                        break
+        return [self.records[symbol] for symbol in found]
+
+
+class MetaService:
+    def __init__(self, provider, loader, path=None):
+        """
+
+        :param provider: str
+            数据源名称，用作本地缓存的文件名
+        :param loader: callable
+            阻塞函数，返回 meta_records 格式的列表，在 IO 线程池中执行
+        :param path: str
+            本地缓存目录，默认为 options.meta_path
+        """
+        self.provider = provider
+        self.loader = loader
+        self.path = path
+        self.table = SymbolTable([])
+        self.updated_at = 0
+
+    def _file(self):
+        return os.path.join(self.path or options.meta_path, self.provider + ".json")
+
+    def load_local(self):
+        """加载本地缓存的基本信息"""
+        file = self._file()
+        if not os.path.exists(file):
+            return
+        with open(file, 'r', encoding="utf-8") as f:
+            self.table = SymbolTable(json.load(f))
+        self.updated_at = os.path.getmtime(file)
+
+    def _save_local(self, records):
+        file = self._file()
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        file_tmp = "{}.{}.tmp".format(file, os.getpid())
+        with open(file_tmp, 'w', encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(file_tmp, file)
+
+    async def refresh(self):
+        """从数据源重新获取基本信息，完成后替换内存中的表"""
+        records = await run_io(self.loader)
+        if not records:
+            raise ValueError("数据源没有返回 {} 的标的基本信息".format(self.provider))
+        self.table = SymbolTable(records)
+        self.updated_at = time.time()
+        await run_io(self._save_local, records)
+
+    async def _refresh_forever(self):
+        while True:
+            wait = self.updated_at + options.meta_refresh_interval - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await self.refresh()
+            except Exception:
+                app_log.exception("刷新 %s 的标的基本信息失败", self.provider)
+                # 一分钟后重试
+                self.updated_at = time.time() - options.meta_refresh_interval + 60
+
+    def start(self):
+        """加载本地缓存，并在 IOLoop 中启动后台刷新"""
+        try:
+            self.load_local()
+        except Exception:
+            app_log.exception("加载 %s 的本地标的基本信息失败", self.provider)
+        IOLoop.current().spawn_callback(self._refresh_forever)
+
+    def get(self, symbol):
+        return self.table.get(symbol)
+
+    def search(self, q, limit=20):
+        return self.table.search(q, limit)
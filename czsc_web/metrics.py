@@ -0,0 +1,251 @@
+# coding: utf-8
+"""
+运行指标
+
+* czsc_stage_seconds - 各阶段耗时，stage 取值：
+    fetch（获取K线的全部耗时，包含下面几项）、throttle（等待数据源的调用额度）、upstream（调用数据源）、normalize（K线标准化）、
+    cpu_wait（分析任务排队及进出进程池的序列化）、analyze（KlineAnalyze 创建或增量更新）、
+    to_result（整理分析结果）、lod（截取窗口和抽稀）、serialize（编码和压缩）
+* czsc_upstream_calls_total / czsc_upstream_errors_total / czsc_upstream_retries_total - 数据源调用次数
+* czsc_cache_requests_total - 响应缓存的查询结果：hit（进程内缓存）、shared（共用缓存）、joined（等待相同请求的结果）、miss
+* czsc_queue_depth - 线程池、进程池中未完成的任务数
+* czsc_request_seconds - 请求耗时
+
+/metrics 输出 Prometheus 文本格式。多 worker 时每个 worker 单独统计，抓取到的是其中一个 worker 的指标，
+用 pid 标签区分。
+
+开启 --server_timing 或者请求中带 timing=1 时，/kline 的响应带 Server-Timing 头，给出这个请求各阶段的耗时。
+"""
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from tornado.options import define, options
+from tornado.web import RequestHandler
+
+define('server_timing', type=bool, default=False, help='/kline 的响应是否都带 Server-Timing 头')
+
+_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 当前请求各阶段的耗时（秒），没有在统计时为 None
+_timings = contextvars.ContextVar("czsc_timings", default=None)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.kind)]
+        for name, key, value in self._samples():
+            lines.append("{}{} {}".format(name, _format_labels(self.labelnames, key), value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        """
+
+        :param function: callable
+            给出时输出这个函数的返回值，用于输出时才计算的指标
+        """
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.function is not None:
+            return [(self.name, (), self.function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # 各区间的数量、总数、总和
+                counts = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            if i < len(self.buckets):
+                counts[0][i] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            items = [(key, list(c[0]), c[1], c[2]) for key, c in self._values.items()]
+        for key, buckets, count, total in items:
+            cumulative = 0
+            for le, n in zip(self.buckets, buckets):
+                cumulative += n
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labelnames, key, [("le", le)]),
+                                                     cumulative))
+            lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labelnames, key, [("le", "+Inf")]),
+                                                 count))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labelnames, key), count))
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labelnames, key), round(total, 6)))
+        return lines
+
+
+registry = []
+
+stage_seconds = Histogram("czsc_stage_seconds", "各阶段耗时（秒）", ["stage", "provider"])
+upstream_calls = Counter("czsc_upstream_calls_total", "数据源调用次数", ["provider"])
+upstream_errors = Counter("czsc_upstream_errors_total", "数据源调用失败次数", ["provider"])
+upstream_retries = Counter("czsc_upstream_retries_total", "数据源调用重试次数", ["provider"])
+cache_requests = Counter("czsc_cache_requests_total", "响应缓存的查询次数", ["result"])
+queue_depth = Gauge("czsc_queue_depth", "线程池、进程池中未完成的任务数", ["pool"])
+request_seconds = Histogram("czsc_request_seconds", "请求耗时（秒）", ["handler", "code"])
+
+
+def _cache_hit_ratio():
+    total = sum(cache_requests._values.values())
+    miss = cache_requests.value(result="miss")
+    return round(1 - miss / total, 4) if total else 0
+
+
+cache_hit_ratio = Gauge("czsc_cache_hit_ratio", "响应缓存的命中率（不需要重新计算的比例）", function=_cache_hit_ratio)
+
+
+def render():
+    """Prometheus 文本格式的全部指标"""
+    pid = str(os.getpid())
+    lines = []
+    for metric in registry:
+        for line in metric.render():
+            if not line.startswith("#"):
+                # 加上 pid 标签，区分多个 worker
+                name, value = line.rsplit(" ", 1)
+                if name.endswith("}"):
+                    name = name[:-1] + ',pid="' + pid + '"}'
+                else:
+                    name = name + '{pid="' + pid + '"}'
+                line = name + " " + value
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def start_timing():
+    """开始统计当前请求各阶段的耗时
+
+    :return: dict
+        阶段 -> 秒，请求处理过程中不断累加
+    """
+    timings = dict()
+    _timings.set(timings)
+    return timings
+
+
+def observe_stage(stage, seconds, provider=""):
+    """记录一个阶段的耗时，同时计入当前请求的 Server-Timing"""
+    stage_seconds.observe(seconds, stage=stage, provider=provider)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + seconds
+
+
+@contextmanager
+def timer(stage, provider=""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, provider)
+
+
+@contextmanager
+def upstream(provider):
+    """统计一次数据源调用的耗时、次数和错误"""
+    upstream_calls.inc(provider=provider)
+    try:
+        with timer("upstream", provider):
+            yield
+    except Exception:
+        upstream_errors.inc(provider=provider)
+        raise
+
+
+def mark(name, desc):
+    """在当前请求的 Server-Timing 中加入一项说明，如 cache;desc=hit"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = desc
+
+
+def server_timing(timings):
+    """Server-Timing 头的内容"""
+    parts = []
+    for name, value in timings.items():
+        if isinstance(value, str):
+            parts.append('{};desc="{}"'.format(name, value))
+        else:
+            parts.append("{};dur={:.1f}".format(name, value * 1000))
+    return ", ".join(parts)
+
+
+def track_future(pool, future):
+    """统计线程池、进程池中未完成的任务数"""
+    queue_depth.inc(pool=pool)
+    future.add_done_callback(lambda _: queue_depth.dec(pool=pool))
+    return future
+
+
+class MetricsHandler(RequestHandler):
+    """Prometheus 格式的运行指标"""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(render())
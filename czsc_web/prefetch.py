@@ -0,0 +1,126 @@
+# coding: utf-8
+"""
+自选股预取
+
+服务启动时把自选股各级别的K线和分析结果加载到本地K线存储、分析进程的分析缓存和响应缓存中，
+交易时间内在每个级别的K线结束后再刷新一次，打开自选股的图表时直接命中缓存：
+
+    python -m czsc_web --provider=ts --watchlist=000001.SH?asset=I,600000.SH --watchlist_freqs=5min,30min,D
+    python -m czsc_web --provider=ts --watchlist_file=watchlist.txt
+
+自选股为默认数据源的标的代码，问号后面可以带数据源参数（与 /kline 的请求参数相同）；
+watchlist_file 每行一个，# 开头的行忽略。
+
+* 刷新时间 - 分钟K线在每根K线结束（按交易时段计算，与 czsc_web.resample 一致）后 prefetch_delay 秒，
+  日线和周线在 15:00 收盘后；周末不刷新
+* 优先级 - 以 PREFETCH 优先级调用数据源，排在打开图表之后，见 czsc_web.upstream
+* 预算 - 同时进行的预取不超过 prefetch_concurrency 个，标的数 x 级别数超过 prefetch_max_items 时只预取前面的部分；
+  某个级别上一轮还没有完成时跳过这一轮
+
+多 worker 时每个 worker 的分析缓存和响应缓存是独立的，所以每个 worker 都会预取；
+本地K线存储在 worker 之间共用，同一根K线只向数据源请求一次。
+"""
+import time
+import asyncio
+from datetime import datetime
+from urllib.parse import parse_qsl
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.options import define, options
+from .metrics import Counter
+from .resample import market_of, next_close
+from .upstream import PREFETCH, set_priority
+
+define('watchlist', type=str, multiple=True, default=[], help='预取的自选股，逗号分隔，如 000001.SH?asset=I,600000.SH')
+define('watchlist_file', type=str, default='', help='自选股文件，每行一个标的')
+define('watchlist_freqs', type=str, multiple=True, default=['1min', '5min', '30min', '60min', 'D', 'W'],
+       help='预取的K线级别，多个用逗号分隔')
+define('prefetch_concurrency', type=int, default=2, help='同时进行的预取数量')
+define('prefetch_max_items', type=int, default=200, help='预取的标的数 x 级别数的上限')
+define('prefetch_delay', type=float, default=5, help='K线结束后等待多少秒再预取，留给数据源生成这根K线')
+
+prefetch_total = Counter("czsc_prefetch_total", "预取次数", ["freq", "result"])
+
+
+def read_watchlist():
+    """合并 watchlist 和 watchlist_file
+
+    :return: list
+        [(标的代码, 数据源参数), ...]
+    """
+    items = list(options.watchlist)
+    if options.watchlist_file:
+        with open(options.watchlist_file, 'r', encoding="utf-8") as f:
+            items += [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    watchlist = []
+    for item in items:
+        symbol, _, query = item.partition("?")
+        watchlist.append((symbol.strip(), dict(parse_qsl(query))))
+    return watchlist
+
+
+class Prefetcher:
+    def __init__(self, provider, load, watchlist, freqs):
+        """
+
+        :param provider: Provider
+            自选股所在的数据源
+        :param load: callable
+            load(symbol, freq, params) 返回 awaitable，加载一个标的一个级别的K线和分析结果
+        :param watchlist: list
+            [(标的代码, 数据源参数), ...]，见 read_watchlist
+        :param freqs: list of str
+            K线级别
+        """
+        self.provider = provider
+        self.load = load
+        self.watchlist = watchlist
+        self.freqs = freqs
+        n = max(1, options.prefetch_max_items // max(1, len(freqs)))
+        if len(watchlist) > n:
+            app_log.warning("自选股 %s 个，超过预取上限，只预取前 %s 个", len(watchlist), n)
+            self.watchlist = watchlist[:n]
+        self._limit = None
+        self._running = set()
+
+    async def _load_one(self, symbol, freq, params):
+        async with self._limit:
+            try:
+                await self.load(symbol, freq, self.provider.request_params(params))
+                prefetch_total.inc(freq=freq, result="ok")
+            except Exception as e:
+                prefetch_total.inc(freq=freq, result="error")
+                app_log.warning("预取 %s %s 失败：%s", symbol, freq, e)
+
+    async def warm(self, freq):
+        """预取全部自选股的一个级别，上一轮没有完成时跳过"""
+        if freq in self._running:
+            prefetch_total.inc(freq=freq, result="skipped")
+            return
+        self._running.add(freq)
+        start = time.time()
+        try:
+            await asyncio.gather(*[self._load_one(symbol, freq, params) for symbol, params in self.watchlist])
+        finally:
+            self._running.discard(freq)
+        app_log.info("预取 %s 个自选股的 %s K线，耗时 %.1f 秒", len(self.watchlist), freq, time.time() - start)
+
+    async def _schedule(self, freq):
+        markets = {market_of(symbol, params.get('asset')) for symbol, params in self.watchlist}
+        while True:
+            close = min(next_close(freq, market) for market in markets)
+            await asyncio.sleep((close - datetime.now()).total_seconds() + options.prefetch_delay)
+            IOLoop.current().spawn_callback(self.warm, freq)
+
+    async def run(self):
+        set_priority(PREFETCH)
+        # 启动时先按级别从高到低预取一遍，日线、周线的历史最长，也最常被打开
+        await asyncio.gather(*[self.warm(freq) for freq in reversed(self.freqs)])
+        await asyncio.gather(*[self._schedule(freq) for freq in self.freqs])
+
+    def start(self):
+        """在 IOLoop 中启动预取，没有自选股时不启动"""
+        if not self.watchlist or not self.freqs:
+            return
+        self._limit = asyncio.Semaphore(options.prefetch_concurrency)
+        IOLoop.current().spawn_callback(self.run)
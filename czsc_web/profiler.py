@@ -0,0 +1,171 @@
+# coding: utf-8
+"""
+单个请求的采样分析
+
+定位某一个慢请求时，先在运行中的服务上开启采样（不需要重启），再带上 profile=1 重新请求：
+
+    curl -X POST "http://localhost:8005/debug/profile?enable=1"
+    curl -i "http://localhost:8005/kline?ts_code=000001.SH&freq=1min&trade_date=null&profile=1"
+    curl "http://localhost:8005/debug/profile?id=响应头 X-Profile-Id 的值"
+    curl -X POST "http://localhost:8005/debug/profile?enable=0"
+
+带 profile=1 的请求不使用响应缓存，获取K线的线程和分析进程中都会有后台线程每 profile_interval 秒
+记录一次调用栈。结果为折叠栈格式（每行为 "调用栈 次数"），可以直接用 flamegraph.pl 或 speedscope 生成火焰图。
+采样只在开启时生效，结果保存在 worker 进程的内存中，只保留最近的 profile_keep 个。
+多 worker 时开关和结果都只对处理这个请求的 worker 有效，可以用 --profiling 启动，让所有 worker 都开启。
+
+/debug/profile 默认只允许本机访问。设置了 --profile_token 时改为校验 token（token 参数或 X-Profile-Token 头），
+不再区分来源；服务在同一台机器的反向代理之后时所有请求都来自本机，这时必须设置 token。
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import itertools
+import threading
+import contextvars
+import ipaddress
+from collections import Counter, OrderedDict
+from tornado.options import define, options
+from tornado.web import RequestHandler, HTTPError
+
+define('profiling', type=bool, default=False, help='启动时是否开启单个请求的采样分析，运行中可以通过 /debug/profile 切换')
+define('profile_interval', type=float, default=0.005, help='采样分析的间隔（秒）')
+define('profile_keep', type=int, default=20, help='保留的采样分析结果数量')
+define('profile_token', type=str, default='', help='访问 /debug/profile 需要的 token，为空时只允许本机访问')
+
+# 当前请求的采样结果，没有在采样时为 None
+_stacks = contextvars.ContextVar("czsc_profile", default=None)
+_enabled = None
+_profiles = OrderedDict()
+_ids = itertools.count(1)
+
+
+class Sampler:
+    """在后台线程中对指定线程的调用栈采样"""
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or options.profile_interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="czsc-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = options.profiling
+    return _enabled
+
+
+def set_enabled(value):
+    global _enabled
+    _enabled = bool(value)
+
+
+def active():
+    """当前请求是否在采样"""
+    return _stacks.get() is not None
+
+
+def start_profile():
+    """开始对当前请求采样，之后在 IO 线程池中执行的任务都会被采样"""
+    stacks = Counter()
+    _stacks.set(stacks)
+    return stacks
+
+
+def sampled_call(fn, *args, **kwargs):
+    """当前请求在采样时，对 fn 的执行过程采样，否则直接执行"""
+    stacks = _stacks.get()
+    if stacks is None:
+        return fn(*args, **kwargs)
+    with Sampler() as sampler:
+        result = fn(*args, **kwargs)
+    stacks.update(sampler.stacks)
+    return result
+
+
+def merge(stacks):
+    """把其他进程中的采样结果合并到当前请求"""
+    current = _stacks.get()
+    if current is not None and stacks:
+        current.update(stacks)
+
+
+def save(stacks, description):
+    """保存采样结果
+
+    :return: str
+        结果的 id
+    """
+    pid = "{}-{}".format(os.getpid(), next(_ids))
+    _profiles[pid] = {"id": pid, "description": description, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                      "samples": sum(stacks.values()), "stacks": stacks}
+    while len(_profiles) > options.profile_keep:
+        _profiles.popitem(last=False)
+    return pid
+
+
+def collapsed(stacks):
+    """折叠栈格式的文本"""
+    return "".join("{} {}\n".format(stack, n) for stack, n in stacks.most_common())
+
+
+class ProfileHandler(RequestHandler):
+    """查看采样结果；POST enable=1/0 开启或关闭采样。只允许本机访问，设置了 profile_token 时校验 token"""
+
+    def prepare(self):
+        if options.profile_token:
+            token = self.request.headers.get("X-Profile-Token") or self.get_argument("token", "")
+            if not hmac.compare_digest(token.encode("utf-8"), options.profile_token.encode("utf-8")):
+                raise HTTPError(403, "token 不正确")
+            return
+        try:
+            local = ipaddress.ip_address(self.request.remote_ip).is_loopback
+        except ValueError:
+            local = False
+        if not local:
+            raise HTTPError(403, "/debug/profile 只允许本机访问，从其他机器访问需要设置 --profile_token")
+
+    def get(self):
+        pid = self.get_argument("id", None)
+        if pid:
+            profile = _profiles.get(pid)
+            if profile is None:
+                raise HTTPError(404, "没有 id 为 {} 的采样结果，多 worker 时只能在同一个 worker 中查看".format(pid))
+            self.set_header("Content-Type", "text/plain; charset=utf-8")
+            return self.finish(collapsed(profile['stacks']))
+
+        profiles = [{k: v for k, v in p.items() if k != "stacks"} for p in _profiles.values()]
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps({"enabled": enabled(), "profiles": profiles}, ensure_ascii=False))
+
+    def post(self):
+        enable = self.get_argument("enable", None)
+        if enable is not None:
+            set_enabled(enable in ["1", "true", "True"])
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps({"enabled": enabled()}))
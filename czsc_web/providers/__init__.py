@@ -0,0 +1,21 @@
+# coding: utf-8
+"""
+数据源
+
+每个数据源是 Provider 的子类，通过 register 注册，启动时按 --provider 创建：
+
+* ts    - Tushare Pro
+* jq    - 聚宽 JQData
+* gm    - 掘金
+* tq    - 天勤
+* local - 本地K线文件
+* replay - 回放录制的K线或者生成模拟K线，可以注入延迟，用于测试和压测
+
+各数据源的 SDK 在创建数据源时才导入，没有用到的数据源不需要安装对应的 SDK。
+"""
+from tornado.options import define
+from .base import Provider, provider_classes, register, create_providers
+from . import ts, jq, gm, tq, local, replay
+
+define('provider', type=str, multiple=True, default=['ts'],
+       help='使用的数据源，多个用逗号分隔，第一个为默认数据源，可选值为 ' + ",".join(provider_classes))
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+数据源基类和注册表
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from ..executor import run_io
+from ..meta import MetaService
+from ..metrics import mark, timer, upstream as upstream_timer
+from ..store import BarStore
+from ..resample import load_resampled, market_of
+from ..normalize import empty_kline
+from ..upstream import UpstreamGate, UpstreamUnavailable, permanent_errors, upstream_stale
+
+provider_classes = dict()
+
+
+def register(cls):
+    """注册数据源类，cls.name 为 --provider 中使用的名称"""
+    provider_classes[cls.name] = cls
+    return cls
+
+
+def create_providers(names):
+    """按名称创建数据源
+
+    :param names: list of str
+        数据源名称，如 ["ts", "jq"]
+    :return: dict
+        名称 -> Provider，顺序与 names 一致，第一个为默认数据源
+    """
+    providers = dict()
+    for name in names:
+        if name not in provider_classes:
+            raise ValueError("未知的数据源：{}，可选值为 {}".format(name, list(provider_classes)))
+        if name not in providers:
+            providers[name] = provider_classes[name]()
+    return providers
+
+
+class Provider:
+    """数据源
+
+    子类实现 get_kline，可以获取标的基本信息的数据源再实现 get_symbols，调用数据源接口时放在 self.upstream() 中。
+    本地K线存储、K线合成、限流熔断（见 czsc_web.upstream）、响应缓存和分析流程由所有数据源共用。
+
+    导入 SDK、设置 token 等初始化放在 connect 中，不在 __init__ 中执行，服务启动时不等待数据源。
+    """
+    # 数据源名称，同时用于本地K线存储、基本信息缓存、响应缓存和分析进程的 key
+    name = None
+    # 复权方式，本地K线存储按复权方式分开保存
+    adj = 'none'
+    # 没有指定开始时间时，每个级别获取的K线数量
+    count = 5000
+    # 每分钟最多调用数据源接口的次数，为 None 时不限制，可以用 --upstream_rate 覆盖
+    rate_limit = None
+    # 是否使用本地K线存储，数据本身就在本地的数据源不需要
+    use_store = True
+    # 没有某个级别的K线时，是否由 1 分钟K线和日线合成；K线的 dt 不是结束时间（见 czsc_web.resample）的数据源必须关闭
+    resample = True
+    # 数据源特有的请求参数及默认值，如 Tushare 的 asset
+    params = {}
+    # 返回 meta_records 格式的全部标的基本信息，阻塞，为 None 表示不支持
+    get_symbols = None
+
+    def __init__(self):
+        self.store = BarStore(self.name) if self.use_store else None
+        self.gate = UpstreamGate(self.name, self.rate_limit)
+        self.meta = MetaService(self.name, self.get_symbols) if self.get_symbols is not None else None
+        self.connected = False
+        self._connect_lock = threading.Lock()
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None, **params):
+        """从数据源获取K线，阻塞，在 IO 线程池中执行
+
+        :param symbol: str
+            标的代码
+        :param freq: str
+            K线级别
+        :param end_dt: datetime
+            截止时间（不包含）
+        :param start_dt: datetime
+            开始时间（包含），为 None 时获取截止时间之前最近的 count 根K线
+        :param count: int
+            K线数量
+        :return: pd.DataFrame
+            columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]
+        """
+        raise NotImplementedError
+
+    def connect(self):
+        """导入 SDK、设置 token、建立会话等，阻塞；第一次调用数据源接口之前执行，成功后不再执行"""
+        pass
+
+    def ensure_connected(self):
+        """执行 connect，多个线程同时调用时只执行一次，失败时下一次调用重新执行"""
+        if self.connected:
+            return
+        with self._connect_lock:
+            if not self.connected:
+                with timer("connect", self.name):
+                    self.connect()
+                self.connected = True
+
+    @contextmanager
+    def upstream(self):
+        """调用数据源接口：先完成 connect、取调用额度，并统计耗时、次数和错误，在 IO 线程中使用"""
+        self.ensure_connected()
+        self.gate.take()
+        with upstream_timer(self.name):
+            yield
+
+    def window_start(self, freq, end_dt):
+        """按时间范围获取K线的数据源返回开始时间，按数量获取的返回 None"""
+        return None
+
+    def start(self):
+        """在每个 worker 的 IOLoop 创建之后调用，启动后台任务"""
+        if self.meta is not None:
+            self.meta.start()
+
+    def request_params(self, args):
+        """从请求参数中取出数据源特有的参数，没有给出的使用默认值"""
+        return {k: args.get(k, v) for k, v in self.params.items()}
+
+    def load_kline(self, symbol, freq, end_dt, **params):
+        """优先从本地K线存储读取，只向数据源请求本地缺失的部分，阻塞
+
+        数据源没有 5/15/30/60 分钟K线或周线时由 1 分钟K线和日线合成，见 czsc_web.resample.load_resampled
+        """
+        def load(freq_):
+            start_dt = self.window_start(freq_, end_dt)
+            if self.store is None:
+                return self.get_kline(symbol, freq_, end_dt, start_dt=start_dt, count=self.count, **params)
+
+            def fetch(start, _):
+                return self.get_kline(symbol, freq_, end_dt, start_dt=start or start_dt, count=self.count, **params)
+
+            return self.store.load(symbol, freq_, self.adj, fetch, end_dt=end_dt, start_dt=start_dt,
+                                   count=None if start_dt else self.count)
+
+        if not self.resample:
+            return load(freq)
+        return load_resampled(load, freq, market_of(symbol, params.get('asset')))
+
+    async def fetch_bars(self, symbol, freq, end, count=None, **params):
+        """获取K线
+
+        :param symbol: str
+            标的代码
+        :param freq: str
+            K线级别
+        :param end: datetime
+            截止时间（不包含）
+        :param count: int
+            最多返回的K线数量，默认返回全部
+        :return: pd.DataFrame
+            columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]
+        """
+        try:
+            kline = await self.gate.call(self.load_kline, symbol, freq, end, **params)
+        except permanent_errors:
+            raise
+        except Exception as e:
+            # 数据源不可用时返回本地已有的K线，kline.attrs['stale'] 为 True
+            kline = await run_io(self.load_stale, symbol, freq, end, **params)
+            if len(kline) == 0:
+                raise UpstreamUnavailable("数据源 {} 不可用，本地也没有 {} {} 的K线：{}".format(
+                    self.name, symbol, freq, e)) from e
+            upstream_stale.inc(provider=self.name)
+            mark("stale", self.name)
+            kline.attrs['stale'] = True
+        if count:
+            kline = kline.iloc[-count:].reset_index(drop=True)
+        return kline
+
+    def load_stale(self, symbol, freq, end_dt, **params):
+        """只读取本地K线存储中已有的K线，阻塞"""
+        if self.store is None:
+            return empty_kline()
+        if not self.resample:
+            return self.store.peek(symbol, freq, self.adj, end_dt, self.count)
+        return load_resampled(lambda freq_: self.store.peek(symbol, freq_, self.adj, end_dt, self.count),
+                              freq, market_of(symbol, params.get('asset')))
+
+    def symbol_info(self, symbol):
+        """标的基本信息，直接从内存中的基本信息表查询，没有找到时返回 None"""
+        return self.meta.get(symbol) if self.meta is not None else None
+
+    def search(self, q, limit=20):
+        return self.meta.search(q, limit) if self.meta is not None else []
+
+
+def trade_date_of(end_dt):
+    """截止时间（不包含）对应的交易日，即前一天"""
+    return end_dt - timedelta(days=1)
@@ -0,0 +1,57 @@
+# coding: utf-8
+"""
+掘金数据源
+
+需要在本地启动掘金终端，并通过 --gm_token 设置 token，才能正常获取数据
+"""
+import pandas as pd
+from tornado.options import define, options
+from .base import Provider, register, trade_date_of
+from ..meta import meta_records
+from ..normalize import normalize_kline
+
+define('gm_token', type=str, default='', help='掘金 token')
+
+freq_convert = {"1min": "60s", "5min": "300s", "15min": "900s", "30min": "1800s", "60min": "3600s", "D": "1d"}
+
+
+@register
+class GmProvider(Provider):
+    """掘金，不复权K线"""
+    name = "gm"
+    count = 3000
+
+    def __init__(self):
+        if not options.gm_token:
+            raise ValueError("使用掘金数据源需要通过 --gm_token 设置 token")
+        super().__init__()
+        self.api = None
+
+    def connect(self):
+        from gm import api
+        api.set_token(options.gm_token)
+        self.api = api
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None):
+        """指定 start_dt 时获取 start_dt 之后的全部K线，否则获取最近 count 根K线"""
+        # 日线的截止时间为交易日当天，分钟K线为交易日的下一天
+        end_time = end_dt if freq.endswith('min') else trade_date_of(end_dt)
+        frequency = freq_convert.get(freq, freq)
+        with self.upstream():
+            if start_dt:
+                df = self.api.history(symbol=symbol, frequency=frequency, start_time=start_dt, end_time=end_time,
+                                      fields='symbol,eob,open,close,high,low,volume', df=True)
+            else:
+                df = self.api.history_n(symbol=symbol, frequency=frequency, end_time=end_time,
+                                        fields='symbol,eob,open,close,high,low,volume',
+                                        count=count or self.count, df=True)
+        return normalize_kline(df, rename={'eob': 'dt', 'volume': 'vol'})
+
+    def get_symbols(self):
+        """全部股票和指数的基本信息"""
+        with self.upstream():
+            df = self.api.get_instruments(sec_types=[self.api.SEC_TYPE_STOCK, self.api.SEC_TYPE_INDEX],
+                                          skip_suspended=False, skip_st=False,
+                                          fields='symbol,sec_name,exchange,listed_date', df=True)
+        df['list_date'] = pd.to_datetime(df['listed_date']).dt.strftime("%Y%m%d")
+        return meta_records(df, rename={'sec_name': 'name', 'exchange': 'market'})
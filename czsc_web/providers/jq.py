@@ -0,0 +1,93 @@
+# coding: utf-8
+"""
+聚宽 JQData 数据源
+
+首次使用，需要调用 set_token 保存账号：
+
+    from czsc_web.providers.jq import set_token
+    set_token("手机号", "密码")
+"""
+import io
+import pickle
+import warnings
+import pandas as pd
+from datetime import datetime
+from tornado.ioloop import IOLoop
+from .base import Provider, register, trade_date_of
+from ..jqdata import JqClient, file_token
+from ..meta import meta_records
+from ..normalize import read_csv_kline
+
+# 1m, 5m, 15m, 30m, 60m, 120m, 1d, 1w, 1M
+freq_convert = {"1min": "1m", "5min": '5m', '15min': '15m',
+                "30min": "30m", "60min": '60m', "D": "1d", "W": '1w'}
+
+
+def set_token(jq_mob, jq_pwd):
+    """
+
+    :param jq_mob: str
+        mob是申请JQData时所填写的手机号
+    :param jq_pwd: str
+        Password为聚宽官网登录密码，新申请用户默认为手机号后6位
+    :return:
+    """
+    pickle.dump([jq_mob, jq_pwd], open(file_token, 'wb'))
+
+
+def text2df(text):
+    return pd.read_csv(io.StringIO(text), engine='c')
+
+
+@register
+class JoinQuantProvider(Provider):
+    """聚宽，不复权K线，支持股票和期货，有实时数据"""
+    name = "jq"
+
+    def __init__(self):
+        self.client = JqClient()
+        super().__init__()
+
+    def start(self):
+        self.client.bind(IOLoop.current())
+        super().start()
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None):
+        """
+
+        >>> provider = JoinQuantProvider()
+        >>> end_dt = datetime.strptime("20200720", "%Y%m%d")
+        >>> df1 = provider.get_kline("000001.XSHG", "1min", end_dt, start_dt=datetime(2020, 7, 1))
+        >>> df2 = provider.get_kline("000001.XSHG", "1min", end_dt, count=1000)
+        """
+        if count and count > 5000:
+            warnings.warn(f"count={count}, 超过5000的最大值限制，仅返回最后5000条记录")
+
+        end_date = trade_date_of(end_dt).strftime("%Y-%m-%d")
+        if start_dt:
+            data = {"method": "get_price_period", "code": symbol, "unit": freq_convert[freq],
+                    "date": start_dt.strftime("%Y-%m-%d"), "end_date": end_date}
+        elif count:
+            data = {"method": "get_price", "code": symbol, "count": count, "unit": freq_convert[freq],
+                    "end_date": end_date}
+        else:
+            raise ValueError("start_dt 和 count 不能同时为空")
+
+        with self.upstream():
+            text = self.client.call_sync(**data)
+        return read_csv_kline(text, symbol, rename={'date': 'dt', 'volume': 'vol'},
+                              round_columns=['open', 'close', 'high', 'low', 'vol'])
+
+    def get_symbols(self):
+        """全部股票和指数的基本信息"""
+        date = datetime.now().strftime("%Y-%m-%d")
+        texts = []
+        for code in ['stock', 'index']:
+            # 每次调用取一个额度
+            with self.upstream():
+                texts.append(self.client.call_sync("get_all_securities", code=code, date=date))
+        df = pd.concat([text2df(text) for text in texts], ignore_index=True)
+        df['list_date'] = df['start_date'].str.replace("-", "")
+        # name 为拼音缩写，使用 display_name 作为名称
+        df = df.drop(columns=['name'])
+        return meta_records(df, rename={'code': 'symbol', 'display_name': 'name', 'type': 'market'})
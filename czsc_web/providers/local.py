@@ -0,0 +1,82 @@
+# coding: utf-8
+"""
+本地文件数据源
+
+K线文件为 {local_path}/{freq}/{symbol}.csv，列为 dt, open, close, high, low, vol，如：
+
+    ~/.czsc_web/local/1min/000001.SH.csv
+    ~/.czsc_web/local/D/000001.SH.csv
+
+可以用来回放导出的历史数据，或者在没有数据源账号时查看分析结果。
+只有 1 分钟K线和日线文件时，其他级别由它们合成。
+"""
+import os
+import threading
+import numpy as np
+from tornado.options import define, options
+from .base import Provider, register
+from ..normalize import read_csv_kline, empty_kline
+
+define('local_path', type=str, default=os.path.join(os.path.expanduser("~"), ".czsc_web", "local"),
+       help='local 数据源的K线文件目录')
+
+
+@register
+class LocalProvider(Provider):
+    """本地K线文件"""
+    name = "local"
+    use_store = False
+
+    def __init__(self, path=None):
+        self.path = path
+        # 文件 -> (修改时间, K线)，文件修改后重新读取
+        self._files = dict()
+        self._lock = threading.Lock()
+        super().__init__()
+
+    def _root(self):
+        return self.path or options.local_path
+
+    def read(self, symbol, freq):
+        """读取一个K线文件的全部K线"""
+        file = os.path.join(self._root(), freq, symbol + ".csv")
+        try:
+            mtime = os.path.getmtime(file)
+        except OSError:
+            return empty_kline()
+
+        cached = self._files.get(file)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self.upstream():
+            with open(file, 'r', encoding="utf-8") as f:
+                text = f.read()
+        kline = read_csv_kline(text, symbol, round_columns=[])
+        with self._lock:
+            self._files[file] = (mtime, kline)
+        return kline
+
+    def start(self):
+        # 目录中没有K线文件时不启动基本信息的后台刷新，避免反复报错
+        if self.get_symbols():
+            super().start()
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None):
+        kline = self.read(symbol, freq)
+        dt = kline['dt'].values
+        end = int(np.searchsorted(dt, np.datetime64(end_dt, 'ns'), side='left'))
+        if start_dt is not None:
+            start = int(np.searchsorted(dt, np.datetime64(start_dt, 'ns'), side='left'))
+        else:
+            start = max(0, end - (count or end))
+        return kline.iloc[start:end].reset_index(drop=True)
+
+    def get_symbols(self):
+        """目录中全部K线文件的标的代码"""
+        root = self._root()
+        symbols = set()
+        for freq in os.listdir(root) if os.path.isdir(root) else []:
+            if os.path.isdir(os.path.join(root, freq)):
+                symbols.update(f[:-4] for f in os.listdir(os.path.join(root, freq)) if f.endswith(".csv"))
+        return [{"symbol": s, "name": s, "area": "", "industry": "", "market": "", "list_date": ""}
+                for s in sorted(symbols)]
@@ -0,0 +1,120 @@
+# coding: utf-8
+"""
+回放数据源
+
+回放 {replay_path}/{freq}/{symbol}.csv 中录制的K线（格式同 local 数据源），没有录制文件时生成模拟K线。
+模拟K线由标的代码和级别确定随机数种子，相同的参数每次得到相同的K线，格式与 Tushare 的返回值一致
+（按时间倒序、时间为字符串），同样需要经过标准化。
+
+每次获取K线前等待 replay_latency 秒，模拟数据源的网络延迟。不需要账号和网络，用于测试和压测：
+
+    python -m czsc_web --provider=replay --replay_latency=0.2
+    http://localhost:8005/kline?ts_code=000001.SH&freq=1min&trade_date=null&bars=20000
+"""
+import os
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from tornado.options import define, options
+from .base import register, trade_date_of
+from .local import LocalProvider
+from ..normalize import normalize_kline
+from ..resample import sessions, freq_minutes
+
+define('replay_path', type=str, default=os.path.join(os.path.expanduser("~"), ".czsc_web", "replay"),
+       help='replay 数据源录制的K线文件目录')
+define('replay_latency', type=float, default=0, help='replay 数据源每次获取K线时注入的延迟（秒）')
+define('replay_bars', type=int, default=5000, help='replay 数据源没有录制文件时生成的K线数量')
+
+# 模拟K线的列名 -> 标准列名
+raw_rename = {'ts_code': 'symbol', 'trade_time': 'dt'}
+
+
+def _bar_times(freq, end_dt, n):
+    """截止时间之前最近 n 根K线的结束时间，分钟K线按A股交易时段生成，不考虑节假日"""
+    last_day = np.busday_offset(np.datetime64(trade_date_of(end_dt).date(), 'D'), 0, roll='backward')
+    if freq in freq_minutes:
+        step = freq_minutes[freq]
+        offsets = []
+        for start, end in sessions['stock']:
+            offsets.extend(range(start + step, end, step))
+            offsets.append(end)
+        offsets = np.array(offsets, dtype='timedelta64[m]')
+        n_days = -(-n // len(offsets))
+        days = np.busday_offset(last_day, np.arange(1 - n_days, 1))
+        dt = (days.astype('datetime64[m]')[:, None] + offsets[None, :]).ravel()
+    elif freq == 'D':
+        dt = np.busday_offset(last_day, np.arange(-n + 1, 1))
+    elif freq == 'W':
+        friday = np.busday_offset(last_day, 0, roll='backward', weekmask='Fri')
+        dt = friday + np.arange(-n + 1, 1) * 7
+    else:
+        raise ValueError("replay 数据源不支持 {} 级别".format(freq))
+    # 最早到 1900 年，周线等级别的 n 很大时返回的K线少于 n 根
+    dt = dt[-n:]
+    return dt[dt >= np.datetime64('1900-01-01')].astype('datetime64[ns]')
+
+
+def synthetic_kline(symbol, freq, end_dt, n):
+    """生成模拟K线，格式与 Tushare pro_bar 的返回值一致
+
+    :return: pd.DataFrame
+        columns = ["ts_code", "trade_time", "open", "close", "high", "low", "vol"]，按时间倒序
+    """
+    rng = np.random.default_rng(zlib.crc32("{}|{}".format(symbol, freq).encode("utf-8")))
+    dt = _bar_times(freq, end_dt, n)
+    n = len(dt)
+    minutes = freq_minutes.get(freq, 240 if freq == 'D' else 1200)
+    sigma = 0.015 * np.sqrt(minutes / 240)
+
+    close = 10 * np.exp(np.cumsum(rng.normal(0, sigma, n)))
+    open_ = np.r_[close[0], close[:-1]] * (1 + rng.normal(0, sigma / 4, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, sigma / 2, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, sigma / 2, n)))
+    vol = rng.integers(1000, 100000, n).astype(np.float64) * minutes
+    df = pd.DataFrame({"ts_code": symbol, "trade_time": np.datetime_as_string(dt, unit='s'),
+                       "open": open_, "close": close, "high": high, "low": low, "vol": vol})
+    return df.iloc[::-1].reset_index(drop=True)
+
+
+@register
+class ReplayProvider(LocalProvider):
+    """回放录制的K线，没有录制文件时生成模拟K线"""
+    name = "replay"
+    # 请求参数 bars 指定模拟K线的数量，默认为 replay_bars
+    params = {"bars": ""}
+
+    def _root(self):
+        return self.path or options.replay_path
+
+    def fetch_raw(self, symbol, freq, end_dt, bars=""):
+        """等待注入的延迟后返回未标准化的模拟K线"""
+        with self.upstream():
+            if options.replay_latency > 0:
+                time.sleep(options.replay_latency)
+            return synthetic_kline(symbol, freq, end_dt, int(bars) if bars else options.replay_bars)
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None, bars=""):
+        if os.path.exists(os.path.join(self._root(), freq, symbol + ".csv")):
+            if options.replay_latency > 0:
+                time.sleep(options.replay_latency)
+            return super().get_kline(symbol, freq, end_dt, start_dt=start_dt, count=count)
+
+        kline = normalize_kline(self.fetch_raw(symbol, freq, end_dt, bars), rename=raw_rename)
+        if start_dt is not None:
+            kline = kline[kline['dt'] >= np.datetime64(start_dt, 'ns')].reset_index(drop=True)
+        return kline
+
+    def record(self, kline, freq):
+        """把其他数据源获取的K线保存为录制文件，之后由 replay 数据源回放
+
+        :param kline: pd.DataFrame
+            columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]
+        :param freq: str
+            K线级别
+        """
+        symbol = kline['symbol'].iloc[0]
+        file = os.path.join(self._root(), freq, symbol + ".csv")
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        kline[['dt', 'open', 'close', 'high', 'low', 'vol']].to_csv(file, index=False)
@@ -0,0 +1,196 @@
+# coding: utf-8
+"""
+天勤数据源
+
+TqApi 不是线程安全的，由一个专用的桥接线程（TqBridge）独占：
+
+* 订阅 - 每个 (合约, 周期) 只调用一次 get_kline_serial（数量为 TqProvider.count），之后桥接线程不断调用 wait_update，
+  TqApi 持续更新这些K线序列；不同请求、不同数量的K线都从同一个订阅中截取
+* 快照 - 序列有更新时只做标记，请求到来时在桥接线程中把序列复制成一份只读的快照（时间戳向量化转换为北京时间），
+  之后的请求直接共用这份快照，构造 DataFrame 时也不再复制
+* 上限 - 订阅数超过 tq_max_subscriptions 时，关闭 TqApi，只重新订阅最近使用的一半。
+  TqSdk 没有取消K线订阅的接口，只能这样释放不再使用的订阅占用的内存和行情推送
+
+TqApi 在第一次获取K线时（或者 --warmup 时）才创建，桥接线程异常退出后下一次请求重新创建。
+天勤只能获取最新的K线，不支持指定截止日期。K线的时间为开始时间，各周期都直接订阅，不由 1 分钟K线合成。
+订阅的序列本身就在内存中并持续更新，不使用本地K线存储。
+"""
+import time
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Future
+from tornado.log import app_log
+from tornado.options import define, options
+from .base import Provider, register
+from ..cache import freq_seconds
+from ..normalize import columns
+
+define('tq_max_subscriptions', type=int, default=64, help='天勤同时订阅的K线序列数量上限')
+define('tq_poll', type=float, default=0.2, help='天勤桥接线程处理请求的最长等待秒数')
+
+# 天勤的时间为 UTC 纳秒时间戳，转换成北京时间
+_utc8 = np.int64(8 * 3600 * 10 ** 9)
+
+
+def to_snapshot(serial):
+    """把 get_kline_serial 返回的序列复制成只读的数组，没有数据的行（datetime 为 NaN）去掉
+
+    :return: dict
+        dt/open/close/high/low/vol -> np.ndarray
+    """
+    ns = serial['datetime'].values
+    valid = ~np.isnan(ns) if ns.dtype.kind == 'f' else ns > 0
+    snapshot = {"dt": (ns[valid].astype(np.int64) + _utc8).astype('datetime64[ns]')}
+    for col, source in [("open", "open"), ("close", "close"), ("high", "high"), ("low", "low"), ("vol", "volume")]:
+        snapshot[col] = serial[source].values[valid].astype(np.float64)
+    for arr in snapshot.values():
+        arr.flags.writeable = False
+    return snapshot
+
+
+class _Subscription:
+    def __init__(self, serial):
+        self.serial = serial
+        self.snapshot = None
+        self.dirty = True
+
+
+class TqBridge:
+    """独占 TqApi 的线程，其他线程通过 call 把操作交给它执行"""
+
+    def __init__(self, data_length):
+        self.data_length = data_length
+        self.api = None
+        self.alive = False
+        self._subs = OrderedDict()
+        self._commands = queue.Queue()
+
+    def start(self):
+        """启动桥接线程并创建 TqApi，阻塞到创建完成"""
+        ready = Future()
+        self._commands = queue.Queue()
+        threading.Thread(target=self._run, args=(ready,), name="tq-bridge", daemon=True).start()
+        ready.result()
+
+    def _create_api(self):
+        from tqsdk import TqApi
+        return TqApi()
+
+    def _run(self, ready):
+        try:
+            self.api = self._create_api()
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        self.alive = True
+        ready.set_result(None)
+        try:
+            while True:
+                self._drain()
+                self.api.wait_update(deadline=time.time() + options.tq_poll)
+                for sub in self._subs.values():
+                    if not sub.dirty and self.api.is_changing(sub.serial):
+                        sub.dirty = True
+        except Exception:
+            app_log.exception("天勤桥接线程异常退出")
+        finally:
+            self.alive = False
+            self._subs = OrderedDict()
+            self._drain(RuntimeError("天勤桥接线程已经退出"))
+            try:
+                self.api.close()
+            except Exception:
+                pass
+
+    def _drain(self, error=None):
+        while True:
+            try:
+                fn, args, future = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            if error is not None:
+                future.set_exception(error)
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def call(self, fn, *args):
+        """在桥接线程中执行 fn，阻塞等待结果"""
+        if not self.alive:
+            raise RuntimeError("天勤桥接线程没有运行")
+        future = Future()
+        self._commands.put((fn, args, future))
+        return future.result(timeout=options.upstream_timeout)
+
+    def _subscribe(self, key):
+        symbol, duration = key
+        self._subs[key] = _Subscription(self.api.get_kline_serial(symbol, duration, data_length=self.data_length))
+        # get_kline_serial 内部会调用 wait_update，期间其他序列的更新不会再被 is_changing 发现
+        for sub in self._subs.values():
+            sub.dirty = True
+
+    def _recycle(self):
+        """关闭 TqApi，重新订阅最近使用的一半序列"""
+        keep = list(self._subs)[len(self._subs) // 2:]
+        app_log.info("天勤订阅数达到上限 %s，重新连接并保留最近使用的 %s 个", len(self._subs), len(keep))
+        self.api.close()
+        self._subs = OrderedDict()
+        self.api = self._create_api()
+        for key in keep:
+            self._subscribe(key)
+
+    def _snapshot(self, symbol, duration):
+        key = (symbol, duration)
+        sub = self._subs.get(key)
+        if sub is None:
+            if len(self._subs) >= options.tq_max_subscriptions:
+                self._recycle()
+            self._subscribe(key)
+            sub = self._subs[key]
+        self._subs.move_to_end(key)
+        if sub.dirty:
+            sub.snapshot = to_snapshot(sub.serial)
+            sub.dirty = False
+        return sub.snapshot
+
+    def snapshot(self, symbol, duration):
+        """合约 symbol、周期 duration 秒的最新K线快照，见 to_snapshot；返回的数组是只读的，多个请求共用"""
+        return self.call(self._snapshot, symbol, duration)
+
+
+@register
+class TqProvider(Provider):
+    """天勤，不复权K线，支持期货"""
+    name = "tq"
+    # 订阅的序列已经在内存中，经过本地K线存储只会多复制、多写一次文件
+    use_store = False
+    # 天勤K线的 datetime 为开始时间，不能按结束时间合成；各周期都直接订阅
+    resample = False
+
+    def __init__(self):
+        super().__init__()
+        self.bridge = TqBridge(self.count)
+
+    def connect(self):
+        self.bridge.start()
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None):
+        if self.connected and not self.bridge.alive:
+            # 桥接线程退出了，upstream 中重新 connect
+            self.connected = False
+        with self.upstream():
+            snapshot = self.bridge.snapshot(symbol, freq_seconds[freq])
+        end = int(np.searchsorted(snapshot['dt'], np.datetime64(end_dt, 'ns')))
+        start = max(0, end - (count or self.count))
+        if start_dt is not None:
+            start = min(end, max(start, int(np.searchsorted(snapshot['dt'], np.datetime64(start_dt, 'ns')))))
+        data = {col: arr[start:end] for col, arr in snapshot.items()}
+        data['symbol'] = np.full(end - start, symbol, dtype=object)
+        return pd.DataFrame(data, columns=columns, copy=False)
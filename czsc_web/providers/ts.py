@@ -0,0 +1,70 @@
+# coding: utf-8
+"""
+Tushare Pro 数据源
+
+首次使用，需要设置 tushare token，在同一台机器上只需要设置一次：
+
+    import tushare as ts
+    ts.set_token("your tushare token")
+
+没有 token，到 https://tushare.pro/register?reg=7 注册获取
+"""
+from datetime import timedelta
+from .base import Provider, register, trade_date_of
+from ..meta import meta_records
+from ..normalize import normalize_kline, empty_kline
+
+# 各级别获取的历史长度
+_history = {
+    '1min': timedelta(days=60),
+    '5min': timedelta(days=150),
+    '15min': timedelta(days=150),
+    '30min': timedelta(days=1000),
+    '60min': timedelta(days=1000),
+    'D': timedelta(weeks=1000),
+    'W': timedelta(weeks=1000),
+}
+
+
+@register
+class TushareProvider(Provider):
+    """Tushare Pro，前复权K线"""
+    name = "ts"
+    adj = "qfq"
+    # 交易资产类型，可选值 E股票 I沪深指数 C数字货币 FT期货 FD基金 O期权 CB可转债（v1.2.39），默认E
+    params = {"asset": "E"}
+    # 与 2000 积分账号每个接口每分钟 200 次的限制一致，积分不同时通过 --upstream_rate=ts:次数 调整
+    rate_limit = 200
+
+    def __init__(self):
+        super().__init__()
+        self.ts = None
+
+    def connect(self):
+        import tushare
+        self.ts = tushare
+
+    def window_start(self, freq, end_dt):
+        if freq not in _history:
+            raise ValueError("'freq' value error, current value is %s, "
+                             "optional valid values are %s" % (freq, list(_history)))
+        return trade_date_of(end_dt) - _history[freq]
+
+    def get_kline(self, symbol, freq, end_dt, start_dt=None, count=None, asset='E'):
+        start_dt = start_dt or self.window_start(freq, end_dt)
+        with self.upstream():
+            df = self.ts.pro_bar(ts_code=symbol, freq=freq, start_date=start_dt.strftime("%Y%m%d"),
+                                 end_date=end_dt.strftime("%Y%m%d"), adj='qfq', asset=asset)
+        if df is None or df.empty:
+            return empty_kline()
+
+        dt_col = "trade_time" if "min" in freq else "trade_date"
+        # 分钟K线清理 9:30 的空数据
+        return normalize_kline(df, rename={'ts_code': "symbol", dt_col: "dt"}, drop_open_auction=freq.endswith("min"))
+
+    def get_symbols(self):
+        """全部上市股票的基本信息"""
+        with self.upstream():
+            pro = self.ts.pro_api()
+            df = pro.stock_basic(exchange='', list_status='L', fields='ts_code,name,area,industry,market,list_date')
+        return meta_records(df, rename={'ts_code': 'symbol'})
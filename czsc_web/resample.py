@@ -0,0 +1,226 @@
+# coding: utf-8
+"""
+K线合成
+
+由 1 分钟K线合成 5/15/30/60 分钟K线，由日线合成周线，全部使用 NumPy 向量化计算。
+
+数据源每次调用都有数量（聚宽 5000、掘金 3000）或者行数（Tushare 分钟K线）的上限，一次获取的 1 分钟K线
+合成之后远不够其他级别的历史长度，所以有这个级别的数据源都直接获取，合成只用于数据源没有这个级别的K线时
+（如 local 数据源只有 1 分钟K线和日线文件）。
+
+分钟K线的 dt 为K线结束时间，按交易时段切分：每个时段从开盘时间开始每 n 分钟一根K线，
+时段最后一根不足 n 分钟的K线以收盘时间结束。A股 09:30 的集合竞价K线直接丢弃；
+期货夜盘的收盘时间按品种查表（23:00、次日 01:00 或 02:30），跨过零点的K线仍然归属到同一个时段。
+"""
+from datetime import datetime, timedelta
+import re
+import numpy as np
+import pandas as pd
+
+# 交易时段，单位为当天的分钟数；夜盘收盘时间超过 24:00 的部分按次日计算
+_futures_day = [(540, 690), (810, 900)]
+sessions = {
+    "stock": [(570, 690), (780, 900)],
+    # 没有夜盘的期货品种
+    "futures": _futures_day,
+    "futures_2300": _futures_day + [(1260, 1380)],
+    "futures_0100": _futures_day + [(1260, 1500)],
+    "futures_0230": _futures_day + [(1260, 1590)],
+}
+
+# 期货品种代码（小写） -> 夜盘类型，不在表中的品种没有夜盘
+_night_sessions = dict()
+for _market, _products in [
+    ("futures_0230", "au ag sc"),
+    ("futures_0100", "cu al zn pb ni sn ss bc ao"),
+    ("futures_2300", "rb hc bu ru fu sp br lu nr "
+                     "a b m y p c cs j jm i l v pp eg eb pg rr "
+                     "sr cf cy ta ma fg rm oi zc sa pf sh px"),
+]:
+    _night_sessions.update((product, _market) for product in _products.split())
+
+# 合成目标级别所使用的基础级别
+resample_base = {'5min': '1min', '15min': '1min', '30min': '1min', '60min': '1min', 'W': 'D'}
+
+freq_minutes = {'1min': 1, '5min': 5, '15min': 15, '30min': 30, '60min': 60}
+
+# 日线、周线的结束时间：15:00 收盘
+_daily_close = 900
+
+_futures_exchanges = ['CCFX', 'XDCE', 'XSGE', 'XZCE', 'XINE', 'CFX', 'DCE', 'SHF', 'ZCE', 'INE',
+                      'CFFEX', 'SHFE', 'CZCE', 'GFEX', 'GFE', 'XGFE']
+_cffex = ['CFFEX', 'CCFX', 'CFX']
+
+
+def _product_of(parts):
+    """期货合约代码中的品种，如 rb2110、RB2110 中的 rb"""
+    for part in reversed(parts):
+        if part not in _futures_exchanges:
+            match = re.match(r"[A-Za-z]+", part)
+            return match.group(0).lower() if match else ""
+    return ""
+
+
+def market_of(symbol, asset=None):
+    """根据标的代码判断交易时段类型
+
+    :param symbol: str
+        标的代码，支持 Tushare（600000.SH、RB2110.SHF）、聚宽（600000.XSHG）、掘金和天勤（SHFE.rb2110）格式
+    :param asset: str
+        Tushare 资产类型，FT 表示期货
+    :return: str
+        sessions 中的 key：stock，或者 futures / futures_2300 / futures_0100 / futures_0230
+    """
+    # 天勤的主连合约如 KQ.m@SHFE.rb
+    parts = symbol.upper().split("@")[-1].split(".")
+    if parts[0] in _cffex or parts[-1] in _cffex:
+        # 中金所的股指期货与股票的交易时段一致
+        return "stock"
+    if asset == 'FT' or parts[0] in _futures_exchanges or parts[-1] in _futures_exchanges:
+        return _night_sessions.get(_product_of(parts), "futures")
+    return "stock"
+
+
+def bar_closes(freq, market="stock"):
+    """一天中各根K线的结束时间（当天的分钟数，升序）"""
+    if freq not in freq_minutes:
+        return [_daily_close]
+    n = freq_minutes[freq]
+    closes = set()
+    for start, end in sessions[market]:
+        closes.update(range(start + n, end, n))
+        closes.add(end)
+    return sorted(t % 1440 for t in closes)
+
+
+def next_close(freq, market="stock", now=None):
+    """下一根K线的结束时间，跳过周末
+
+    :return: datetime
+    """
+    now = now or datetime.now()
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    minute = (now - day).total_seconds() / 60
+    closes = bar_closes(freq, market)
+    for i in range(8):
+        date = day + timedelta(days=i)
+        if date.weekday() >= 5:
+            continue
+        for t in closes:
+            if i > 0 or t > minute:
+                return date + timedelta(minutes=t)
+    raise ValueError("没有找到 {} 的下一根K线".format(freq))
+
+
+def _aggregate(df, labels, keep):
+    """按 labels 对K线分组聚合，df 必须按 dt 升序排列
+
+    :param labels: np.ndarray
+        每根K线所属的合成K线的 dt（datetime64[ns]）
+    :param keep: np.ndarray
+        bool 数组，False 表示丢弃这根K线
+    """
+    labels = labels[keep]
+    if len(labels) == 0:
+        return pd.DataFrame(columns=['symbol', 'dt', 'open', 'close', 'high', 'low', 'vol'])
+
+    o = df['open'].values[keep]
+    c = df['close'].values[keep]
+    h = df['high'].values[keep]
+    l = df['low'].values[keep]
+    v = df['vol'].values[keep].astype(np.float64)
+
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)] - 1
+    return pd.DataFrame({
+        "symbol": df['symbol'].values[0],
+        "dt": labels[starts],
+        "open": o[starts],
+        "close": c[ends],
+        "high": np.maximum.reduceat(h, starts),
+        "low": np.minimum.reduceat(l, starts),
+        "vol": np.add.reduceat(v, starts),
+    })
+
+
+def resample_minutes(df, freq, market="stock"):
+    """由 1 分钟K线合成 n 分钟K线
+
+    :param df: pd.DataFrame
+        1 分钟K线，columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]，按 dt 升序排列
+    :param freq: str
+        目标级别，可选值 5min / 15min / 30min / 60min
+    :param market: str
+        交易时段类型，stock 或 futures
+    :return: pd.DataFrame
+    """
+    n = freq_minutes[freq]
+    dt = pd.to_datetime(df['dt']).values.astype('datetime64[ns]')
+    day = dt.astype('datetime64[D]').astype('datetime64[ns]')
+    m = ((dt - day) // np.timedelta64(1, 'm')).astype(np.int64)
+
+    starts = np.array([x[0] for x in sessions[market]])
+    ends = np.array([x[1] for x in sessions[market]])
+    if ends[-1] > 1440:
+        # 夜盘零点之后的K线归属到前一天的夜盘时段
+        after_midnight = m <= ends[-1] - 1440
+        m = np.where(after_midnight, m + 1440, m)
+        day = np.where(after_midnight, day - np.timedelta64(1, 'D'), day)
+
+    i = np.minimum(np.searchsorted(ends, m, side='left'), len(ends) - 1)
+    in_session = (m > starts[i]) & (m <= ends[i])
+    bucket = np.minimum(starts[i] + -(-(m - starts[i]) // n) * n, ends[i])
+    # 不在交易时段内的K线（如部分品种的特殊时段）按自然时间对齐
+    bucket = np.where(in_session, bucket, -(-m // n) * n)
+
+    keep = np.ones(len(m), dtype=bool)
+    if market == "stock":
+        # 清理 9:30 的集合竞价K线
+        keep = m != starts[0]
+
+    labels = day + bucket * np.timedelta64(1, 'm')
+    return _aggregate(df, labels, keep)
+
+
+def resample_weekly(df):
+    """由日线合成周线，周线的 dt 为这一周最后一个交易日
+
+    :param df: pd.DataFrame
+        日线，按 dt 升序排列
+    :return: pd.DataFrame
+    """
+    dt = pd.to_datetime(df['dt']).values.astype('datetime64[ns]')
+    days = dt.astype('datetime64[D]').astype(np.int64)
+    # 1970-01-01 是周四，(days + 3) % 7 为 0 表示周一
+    week = days - (days + 3) % 7
+    starts = np.flatnonzero(np.r_[True, week[1:] != week[:-1]])
+    ends = np.r_[starts[1:], len(week)] - 1
+    labels = np.repeat(dt[ends], ends - starts + 1)
+    return _aggregate(df, labels, np.ones(len(dt), dtype=bool))
+
+
+def resample(df, freq, market="stock"):
+    """由 resample_base[freq] 级别的K线合成 freq 级别的K线"""
+    if freq == 'W':
+        return resample_weekly(df)
+    return resample_minutes(df, freq, market)
+
+
+def load_resampled(load, freq, market="stock"):
+    """获取 freq 级别的K线，数据源没有这个级别的K线时由基础级别合成
+
+    :param load: callable
+        load(freq) 返回指定级别的K线
+    :param freq: str
+        目标级别
+    :param market: str
+        交易时段类型
+    :return: pd.DataFrame
+    """
+    direct = load(freq)
+    base = resample_base.get(freq)
+    if len(direct) == 0 and base:
+        df = load(base)
+        if len(df) > 0:
+            return resample(df, freq, market)
+    return direct
@@ -0,0 +1,274 @@
+# coding: utf-8
+"""
+多标的批量分析（选股）
+
+对一批标的的多个级别执行同样的缠论分析，每个标的只输出一行摘要：最后一笔、最后一个线段、
+最新的分型以及 czsc.KlineSignals 的单级别信号。
+
+通过接口使用，结果按完成先后逐行输出（NDJSON），客户端断开连接时任务自动取消：
+
+    http://localhost:8005/screen?symbols=all&freqs=D,30min
+    http://localhost:8005/screen?symbols=000001.SZ,600000.SH&freqs=D&trade_date=20200228
+
+    {"job": "1", "total": 2, "freqs": ["D"]}
+    {"symbol": "000001.SZ", "done": 1, "total": 2, "D": {"dt": ..., "close": ..., "bi": ..., "xd": ..., "fx": ..., "signals": ...}}
+    ...
+    {"job": "1", "status": "done", "done": 2, "total": 2, "seconds": 1.2}
+
+symbols 为逗号分隔的标的代码，all 表示数据源的全部标的（需要数据源支持标的基本信息）；标的较多时可以用 POST 提交。
+/screen/jobs 查看正在运行和最近完成的任务的进度，DELETE /screen/jobs?id=.. 取消任务。多 worker 时任务只在接收请求的 worker 中。
+
+也可以在命令行中运行，不需要启动服务：
+
+    python -m czsc_web.screen --provider=ts --screen_symbols=all --screen_freqs=D,30min --screen_output=screen.ndjson
+
+标的按 screen_chunk 个一组，每组在 IO 线程池中获取K线（使用本地K线存储，只请求缺失的部分），
+然后整组交给一个分析进程，同时进行的组数为分析进程数的两倍，获取K线和分析可以重叠进行。
+批量分析与 /kline 共用分析进程池，但不使用、也不替换分析进程中为图表缓存的分析结果。
+"""
+import sys
+import json
+import time
+import asyncio
+import itertools
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from tornado.escape import json_encode
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.options import define, options, parse_command_line
+from .analyze import _analyzer
+from .executor import run_cpu
+from .providers import create_providers
+from .upstream import BATCH, set_priority
+
+define('screen_bars', type=int, default=1000, help='批量分析时每个级别使用的K线数量')
+define('screen_chunk', type=int, default=16, help='批量分析时每个分析任务包含的标的数量')
+define('screen_keep', type=int, default=20, help='保留的已完成批量分析任务数量')
+define('screen_symbols', type=str, default='all', help='命令行批量分析的标的，逗号分隔，all 表示全部标的')
+define('screen_freqs', type=str, multiple=True, default=['D'], help='命令行批量分析的K线级别，多个用逗号分隔')
+define('screen_trade_date', type=str, default='', help='命令行批量分析的交易日期，默认为今天')
+define('screen_output', type=str, default='-', help='命令行批量分析的输出文件，- 表示标准输出')
+
+jobs = OrderedDict()
+_job_ids = itertools.count(1)
+
+
+def _dt(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _point(x, name):
+    if x is None:
+        return None
+    return {"direction": "up" if x['fx_mark'] == 'g' else "down", "dt": _dt(x['dt']), "value": x[name]}
+
+
+def summarize(ka):
+    """单个级别的分析摘要
+
+    :param ka: KlineAnalyze
+    :return: dict
+        bi / xd 的 direction 为最后一笔、最后一个线段的方向（结束于顶分型为 up），
+        signals 为 czsc.KlineSignals 的单级别信号，去掉了名称前缀
+    """
+    from czsc import KlineSignals
+    fx = ka.fx_list[-1] if ka.fx_list else None
+    signals = dict()
+    for method in [KlineSignals.fx_signals, KlineSignals.bi_signals, KlineSignals.bd_signals]:
+        signals.update(method(ka))
+    prefix = ka.name + "_"
+    return {
+        "dt": _dt(ka.end_dt),
+        "close": ka.latest_price,
+        "bars": len(ka.kline_raw),
+        "bi": _point(ka.bi_list[-1] if ka.bi_list else None, 'bi'),
+        "xd": _point(ka.xd_list[-1] if ka.xd_list else None, 'xd'),
+        "fx": {"mark": fx['fx_mark'], "dt": _dt(fx['dt']), "value": fx['fx']} if fx else None,
+        "signals": {k[len(prefix):] if k.startswith(prefix) else k: v for k, v in signals.items()},
+    }
+
+
+def screen_chunk(items):
+    """在分析进程中执行一组标的的分析，单个标的出错不影响其他标的
+
+    :param items: list
+        [(symbol, freq, kline), ...]
+    :return: list
+        [(symbol, freq, 摘要或者 {"error": 错误信息}), ...]
+    """
+    results = []
+    for symbol, freq, kline in items:
+        try:
+            if len(kline) == 0:
+                raise ValueError("没有K线数据")
+            results.append((symbol, freq, summarize(_analyzer(kline, None))))
+        except Exception as e:
+            results.append((symbol, freq, {"error": "{}: {}".format(type(e).__name__, e)}))
+    return results
+
+
+def universe(provider, symbols):
+    """解析标的列表
+
+    :param symbols: str
+        逗号或空白分隔的标的代码，all 表示数据源的全部标的
+    :return: list of str
+    """
+    if symbols.strip() == "all":
+        if provider.meta is None:
+            raise ValueError("数据源 {} 不支持获取全部标的".format(provider.name))
+        if not len(provider.meta.table):
+            raise ValueError("还没有获取到数据源 {} 的标的基本信息".format(provider.name))
+        return list(provider.meta.table.records)
+    return list(OrderedDict.fromkeys(s for s in symbols.replace(",", " ").split() if s))
+
+
+class ScreenJob:
+    """一次批量分析，结果逐行放入 lines 队列，最后放入 None"""
+
+    def __init__(self, provider, symbols, freqs, trade_date, params=None, bars=None):
+        self.id = str(next(_job_ids))
+        self.provider = provider
+        self.symbols = symbols
+        self.freqs = freqs
+        self.trade_date = trade_date
+        self.params = params or dict()
+        self.bars = bars or options.screen_bars
+        self.total = len(symbols)
+        self.done = 0
+        self.errors = 0
+        self.status = "pending"
+        self.started_at = None
+        self.finished_at = None
+        self.lines = asyncio.Queue()
+        # 同时进行的获取不超过 IO 线程数，其余的在这里等待，取消后不再开始
+        self._fetching = asyncio.Semaphore(options.io_workers)
+
+    def status_dict(self):
+        end = self.finished_at or time.time()
+        return {"job": self.id, "provider": self.provider.name, "status": self.status, "done": self.done,
+                "total": self.total, "errors": self.errors, "freqs": self.freqs, "trade_date": self.trade_date,
+                "seconds": round(end - self.started_at, 3) if self.started_at else 0}
+
+    def cancel(self):
+        """尽力取消：还没开始的获取和分析不再执行，已经开始的数据源请求和分析任务会执行完"""
+        if self.status in ["pending", "running"]:
+            self.status = "cancelled"
+
+    async def _fetch(self, symbol, freq, end_dt):
+        async with self._fetching:
+            if self.status != "running":
+                return symbol, freq, None
+            return await self._fetch_bars(symbol, freq, end_dt)
+
+    async def _fetch_bars(self, symbol, freq, end_dt):
+        try:
+            kline = await self.provider.fetch_bars(symbol, freq, end_dt, count=self.bars, **self.params)
+            return symbol, freq, kline
+        except Exception as e:
+            return symbol, freq, e
+
+    async def _run_chunk(self, symbols, end_dt, limit):
+        async with limit:
+            if self.status != "running":
+                return
+            fetched = await asyncio.gather(*[self._fetch(s, f, end_dt) for s in symbols for f in self.freqs])
+            if self.status != "running":
+                return
+            results = {s: dict() for s in symbols}
+            items = []
+            for symbol, freq, kline in fetched:
+                if isinstance(kline, Exception):
+                    results[symbol][freq] = {"error": "{}: {}".format(type(kline).__name__, kline)}
+                else:
+                    items.append((symbol, freq, kline))
+            if items:
+                for symbol, freq, summary in await run_cpu(screen_chunk, items):
+                    results[symbol][freq] = summary
+
+        for symbol in symbols:
+            if self.status != "running":
+                return
+            self.done += 1
+            if any("error" in results[symbol].get(f, {}) for f in self.freqs):
+                self.errors += 1
+            line = {"symbol": symbol, "done": self.done, "total": self.total}
+            line.update((f, results[symbol].get(f)) for f in self.freqs)
+            self.lines.put_nowait(line)
+
+    async def run(self):
+        """执行批量分析，出错或取消时也会放入最后一行"""
+        self.status = "running"
+        self.started_at = time.time()
+        # 排在打开图表和后台预取之后调用数据源
+        set_priority(BATCH)
+        self.lines.put_nowait({"job": self.id, "total": self.total, "freqs": self.freqs})
+        end_dt = datetime.strptime(self.trade_date, "%Y%m%d") + timedelta(days=1)
+        limit = asyncio.Semaphore(2 * options.cpu_workers)
+        n = max(1, options.screen_chunk)
+        try:
+            await asyncio.gather(*[self._run_chunk(self.symbols[i:i + n], end_dt, limit)
+                                   for i in range(0, self.total, n)])
+            if self.status == "running":
+                self.status = "done"
+        except Exception as e:
+            app_log.exception("批量分析任务 %s 失败", self.id)
+            self.status = "error: {}".format(e)
+        self.finished_at = time.time()
+        self.lines.put_nowait(self.status_dict())
+        self.lines.put_nowait(None)
+
+
+def start_job(job):
+    """登记并在后台执行任务，只保留最近 screen_keep 个已结束的任务"""
+    jobs[job.id] = job
+    finished = [k for k, j in jobs.items() if j.finished_at]
+    for k in finished[:max(0, len(finished) - options.screen_keep)]:
+        del jobs[k]
+    IOLoop.current().spawn_callback(job.run)
+    return job
+
+
+async def iter_lines(job):
+    """依次返回任务输出的每一行（JSON 字符串）"""
+    while True:
+        line = await job.lines.get()
+        if line is None:
+            return
+        yield json_encode(line)
+
+
+async def run_cli():
+    providers = create_providers(options.provider)
+    provider = next(iter(providers.values()))
+    provider.start()
+    if options.screen_symbols.strip() == "all" and provider.meta is not None and not len(provider.meta.table):
+        await provider.meta.refresh()
+    symbols = universe(provider, options.screen_symbols)
+    trade_date = options.screen_trade_date or datetime.now().strftime("%Y%m%d")
+    job = start_job(ScreenJob(provider, symbols, options.screen_freqs, trade_date))
+
+    out = sys.stdout if options.screen_output == "-" else open(options.screen_output, 'w', encoding="utf-8")
+    printed = 0
+    try:
+        async for line in iter_lines(job):
+            out.write(line + "\n")
+            if job.done != printed and job.done % max(1, job.total // 100) == 0:
+                printed = job.done
+                sys.stderr.write("\r{}/{} {:.0f}s".format(job.done, job.total, time.time() - job.started_at))
+        sys.stderr.write("\n{}\n".format(json.dumps(job.status_dict(), ensure_ascii=False)))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return job
+
+
+def main():
+    parse_command_line()
+    job = IOLoop.current().run_sync(run_cli)
+    sys.exit(0 if job.status == "done" else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# coding: utf-8
+"""
+启动 HTTP 服务
+
+--workers N（N > 1）时主进程先绑定端口，再 fork 出 N 个 worker 进程共同监听，主进程只负责管理：
+
+* worker 异常退出时自动重新启动
+* 主进程收到 SIGHUP 时逐个平滑重启 worker：先启动新的 worker，等它开始接受连接后再让旧的 worker 退出，
+  然后再替换下一个，端口始终有进程在监听
+* 主进程收到 SIGTERM / SIGINT 时通知全部 worker 平滑退出
+
+worker 收到 SIGTERM 后不再接受新的连接，等正在处理的请求完成（最多 graceful_timeout 秒）后退出。
+
+多个 worker 共用同一个本地K线存储目录（见 czsc_web.store，更新时有进程间的文件锁），
+响应缓存通过 shared_cache 指定的 sqlite 文件共用（见 czsc_web.cache）。
+每个 worker 有自己的 IO 线程池和分析进程池，总的分析进程数为 workers * cpu_workers。
+"""
+import os
+import sys
+import time
+import signal
+import select
+import asyncio
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.netutil import bind_sockets
+from tornado.options import define, options
+from .cache import shared_cache_path
+
+define('workers', type=int, default=1, help='worker 进程数，0 表示与 CPU 核数相同')
+define('graceful_timeout', type=float, default=10, help='平滑退出时等待正在处理的请求的最长时间（秒）')
+define('worker_start_timeout', type=float, default=30, help='平滑重启时等待新的 worker 开始接受连接的最长时间（秒）')
+
+
+_master_signals = [signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD]
+
+# worker 开始接受连接后向这个管道写入一个字节，通知主进程已经就绪，见 _notify_ready
+_ready_fd = None
+
+
+def _ignore_signal(signum, frame):
+    # 只用来唤醒主循环：信号编号由 signal.set_wakeup_fd 写入管道，在主循环中处理
+    pass
+
+
+def _read_signals(fd):
+    signums = []
+    while True:
+        try:
+            data = os.read(fd, 64)
+        except BlockingIOError:
+            break
+        if not data:
+            break
+        signums.extend(data)
+    return signums
+
+
+def _notify_ready():
+    global _ready_fd
+    if _ready_fd is None:
+        return
+    try:
+        os.write(_ready_fd, b"1")
+    except OSError:
+        # 主进程不等待这个 worker 就绪时已经关闭了读端
+        pass
+    os.close(_ready_fd)
+    _ready_fd = None
+
+
+def _stop_children(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.time() + options.graceful_timeout + 5
+    while time.time() < deadline:
+        try:
+            if os.waitpid(-1, os.WNOHANG) == (0, 0):
+                time.sleep(0.1)
+        except ChildProcessError:
+            break
+
+
+def _prefork(n):
+    """fork 出 n 个 worker，在 worker 中返回编号，主进程一直运行到收到退出信号
+
+    信号处理函数只通过 signal.set_wakeup_fd 写入管道，主循环用 select 等待信号、worker 退出和 worker 就绪，
+    在主循环中处理，不会在任意位置打断主进程。
+    """
+    children = dict()
+    retiring = set()
+    # 平滑重启时等待替换的旧 worker，以及正在启动的新 worker：(就绪管道读端, 新 pid, 旧 pid, 截止时间)
+    pending = []
+    starting = None
+
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+
+    def spawn(i, wait_ready=False):
+        global _ready_fd
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            signal.set_wakeup_fd(-1)
+            for signum in _master_signals:
+                signal.signal(signum, signal.SIG_DFL)
+            for fd in [wakeup_r, wakeup_w, ready_r] + ([starting[0]] if starting else []):
+                os.close(fd)
+            _ready_fd = ready_w
+            return i
+        os.close(ready_w)
+        children[pid] = i
+        if not wait_ready:
+            os.close(ready_r)
+            return None
+        return pid, ready_r
+
+    signal.set_wakeup_fd(wakeup_w)
+    for signum in _master_signals:
+        signal.signal(signum, _ignore_signal)
+
+    for i in range(n):
+        if spawn(i) is not None:
+            return i
+    app_log.info("主进程 %s 启动了 %s 个 worker", os.getpid(), n)
+
+    while children:
+        fds = [wakeup_r] + ([starting[0]] if starting else [])
+        readable = select.select(fds, [], [], 1)[0]
+
+        for signum in _read_signals(wakeup_r) if wakeup_r in readable else []:
+            if signum == signal.SIGHUP:
+                if pending or starting:
+                    app_log.info("上一次平滑重启还没有完成，忽略 SIGHUP")
+                    continue
+                app_log.info("平滑重启全部 worker")
+                pending = list(children)
+            elif signum in (signal.SIGTERM, signal.SIGINT):
+                app_log.info("通知全部 worker 退出")
+                for signum_ in _master_signals:
+                    signal.signal(signum_, signal.SIG_IGN)
+                _stop_children(list(children) + list(retiring))
+                sys.exit(0)
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in retiring:
+                retiring.discard(pid)
+                continue
+            i = children.pop(pid, None)
+            if i is None:
+                continue
+            if starting and starting[1] == pid:
+                # 新的 worker 没能启动，旧的 worker 继续运行，停止这次平滑重启
+                app_log.warning("新的 worker %s（pid %s）启动失败，状态 %s，停止平滑重启", i, pid, status)
+                os.close(starting[0])
+                starting = None
+                pending = []
+                continue
+            if pid in pending:
+                pending.remove(pid)
+            if starting and starting[2] == pid:
+                # 正在被替换的旧 worker 退出了，由新的 worker 接替，不再重新启动
+                app_log.warning("worker %s（pid %s）退出，状态 %s", i, pid, status)
+                continue
+            app_log.warning("worker %s（pid %s）退出，状态 %s，重新启动", i, pid, status)
+            time.sleep(1)
+            if spawn(i) is not None:
+                return i
+
+        if starting and (starting[0] in readable or time.time() > starting[3]):
+            fd, pid, old, _ = starting
+            ready = starting[0] in readable and os.read(fd, 1) == b"1"
+            os.close(fd)
+            starting = None
+            if ready:
+                if old in children:
+                    del children[old]
+                    retiring.add(old)
+                    os.kill(old, signal.SIGTERM)
+            else:
+                app_log.warning("新的 worker（pid %s）没有在 %s 秒内开始接受连接，停止平滑重启",
+                                pid, options.worker_start_timeout)
+                pending = []
+                if pid in children:
+                    del children[pid]
+                    retiring.add(pid)
+                    os.kill(pid, signal.SIGTERM)
+
+        # 逐个替换：上一个新的 worker 开始接受连接之后，才启动下一个
+        while starting is None and pending:
+            old = pending.pop(0)
+            if old not in children:
+                continue
+            started = spawn(children[old], wait_ready=True)
+            if not isinstance(started, tuple):
+                return started
+            pid, fd = started
+            starting = (fd, pid, old, time.time() + options.worker_start_timeout)
+    sys.exit(0)
+
+
+class _Inflight:
+    """统计正在处理的请求数，平滑退出时等待这些请求完成"""
+
+    def __init__(self, app):
+        self.count = 0
+        find_handler = app.find_handler
+        log_request = app.log_request
+
+        def _find_handler(request, **kwargs):
+            self.count += 1
+            return find_handler(request, **kwargs)
+
+        def _log_request(handler):
+            self.count -= 1
+            log_request(handler)
+
+        app.find_handler = _find_handler
+        app.log_request = _log_request
+
+
+def serve(app, port, on_start=None):
+    """启动服务，直到收到退出信号
+
+    :param app: tornado.web.Application
+    :param port: int
+        监听的端口
+    :param on_start: callable
+        每个 worker 中 IOLoop 创建之后、开始服务之前调用，用于启动后台任务
+    """
+    sockets = bind_sockets(port)
+    workers = options.workers or os.cpu_count()
+    if workers > 1:
+        if not hasattr(os, "fork"):
+            raise RuntimeError("当前系统不支持 --workers")
+        if not options.shared_cache:
+            options.shared_cache = shared_cache_path
+        _prefork(workers)
+
+    inflight = _Inflight(app)
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    io_loop = IOLoop.current()
+    # IOLoop 开始运行之后才会接受连接，这时再通知主进程
+    io_loop.add_callback(_notify_ready)
+
+    async def shutdown():
+        server.stop()
+        deadline = time.time() + options.graceful_timeout
+        while inflight.count > 0 and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        await server.close_all_connections()
+        io_loop.stop()
+
+    def on_signal():
+        app_log.info("进程 %s 收到退出信号，等待正在处理的请求完成", os.getpid())
+        io_loop.add_callback(shutdown)
+
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        try:
+            io_loop.asyncio_loop.add_signal_handler(signum, on_signal)
+        except NotImplementedError:
+            pass
+
+    if on_start is not None:
+        on_start()
+    io_loop.start()
@@ -0,0 +1,119 @@
+# coding: utf-8
+"""
+启动速度
+
+服务进程只导入 tornado、pandas 等必需的模块就开始监听，首页等静态文件以及 /basic、/search
+（使用本地缓存的标的基本信息）立即可用：
+
+* czsc 导入较慢（依赖 matplotlib、pyecharts 等），只在分析进程第一次分析时导入，见 czsc_web.analyze
+* 数据源的 SDK、token、会话在第一次调用数据源接口时才初始化，见 Provider.connect
+
+这样第一次打开图表会慢一些，加上 --warmup 时，服务开始监听后立即在后台导入 czsc 并连接数据源：
+
+    python -m czsc_web --provider=ts --warmup
+
+查看导入各个包的耗时，以及从启动服务到首页返回第一个字节的时间：
+
+    python -m czsc_web.startup --provider=ts
+    python -m czsc_web.startup --provider=ts --import_top=30
+"""
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+from collections import defaultdict
+from urllib.request import urlopen
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from tornado.options import define, options, parse_command_line
+from .analyze import warm_up as warm_up_analyzer
+from .executor import get_cpu_executors, run_io
+
+define('import_top', type=int, default=20, help='导入耗时报告中列出的包的数量')
+
+
+async def warm_up(providers):
+    """在每个分析进程中导入 czsc，并连接全部数据源，失败时只记录日志"""
+    start = time.time()
+    loop = IOLoop.current()
+    tasks = [loop.run_in_executor(executor, warm_up_analyzer) for executor in get_cpu_executors()]
+    tasks += [run_io(provider.ensure_connected) for provider in providers.values()]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for provider, result in zip(providers.values(), results[-len(providers):]):
+        if isinstance(result, Exception):
+            app_log.warning("连接数据源 %s 失败：%s", provider.name, result)
+    app_log.info("预热完成，耗时 %.1f 秒", time.time() - start)
+
+
+def import_times(module="czsc_web.app"):
+    """在新的进程中用 python -X importtime 导入 module
+
+    :return: list
+        [(模块名, 自身耗时, 累计耗时), ...]，单位为秒，按导入完成的先后排列
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return rows
+
+
+def first_byte(args=(), timeout=60):
+    """启动服务，返回从启动到首页返回第一个字节的秒数
+
+    :param args: list of str
+        传给 python -m czsc_web 的命令行参数
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, "-m", "czsc_web", "--port=%d" % port, "--workers=1"] + list(args),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.time() - start < timeout:
+            try:
+                with urlopen("http://127.0.0.1:%d/" % port, timeout=1) as response:
+                    response.read(1)
+                return time.time() - start
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError("服务启动失败，退出码 {}".format(proc.returncode))
+                time.sleep(0.02)
+        raise TimeoutError("服务在 {} 秒内没有返回首页".format(timeout))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def report(top=20, args=()):
+    """导入 czsc_web.app 各个包的耗时和启动到第一个字节的时间，args 为启动服务的命令行参数"""
+    rows = import_times()
+    packages = defaultdict(float)
+    for name, seconds, _ in rows:
+        packages[name.split(".")[0]] += seconds
+    lines = ["导入 czsc_web.app 共 {:.3f} 秒（-X importtime 的计时偏大）".format(sum(s for _, s, _ in rows)),
+             "{:<23}{:>9}".format("包", "秒")]
+    for name, seconds in sorted(packages.items(), key=lambda x: -x[1])[:top]:
+        lines.append("{:<24}{:>10.3f}".format(name, seconds))
+    heavy = [name for name in ["czsc", "matplotlib", "pyecharts", "tushare", "gm", "tqsdk", "requests"]
+             if name in packages]
+    lines.append("服务进程导入的重量级依赖：{}".format(", ".join(heavy) or "无"))
+    lines.append("启动到首页第一个字节 {:.3f} 秒".format(first_byte(args)))
+    return "\n".join(lines)
+
+
+def main():
+    # 导入服务的全部命令行参数定义，除 import_top 以外的参数原样传给启动的服务；app 只在 --warmup 时才导入这个模块
+    from . import app
+    parse_command_line()
+    print(report(options.import_top, [arg for arg in sys.argv[1:] if not arg.startswith("--import_top")]))
+
+
+if __name__ == '__main__':
+    main()
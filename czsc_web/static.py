@@ -0,0 +1,245 @@
+# coding: utf-8
+"""
+网页静态文件
+
+代替 tornado 的 StaticFileHandler 提供 web 目录下的前端文件：
+
+* 预压缩 - 文件旁边有较新的 .gz / .br 文件（python -m czsc_web.static 生成，与 nginx 的 gzip_static 相同）时直接使用；
+  没有时在 IO 线程池中压缩一次，按内容的哈希保存在 static_cache_path 中，之后重启也不再压缩。
+  服务启动后在后台把全部文件准备好（--static_preload），第一次打开页面不用等待压缩
+* 缓存头 - 文件名中带有内容哈希的文件（如 app.fdd123f3.js）一年内不再请求（immutable），
+  index.html 等其他文件每次通过 ETag 确认（no-cache），更新前端之后马上生效
+* 内存 - 不超过 static_memory_max 的文件（包括压缩结果）读入内存直接输出，较大的文件在 IO 线程中分块读取，
+  读文件、计算 ETag 和压缩都不在 IOLoop 中进行，不影响 /kline 等接口
+
+生成预压缩文件：
+
+    python -m czsc_web.static
+    python -m czsc_web.static --static_path=/path/to/dist
+"""
+import os
+import re
+import gzip
+import time
+import asyncio
+import hashlib
+import mimetypes
+from datetime import datetime, timezone
+from tornado.iostream import StreamClosedError
+from tornado.log import app_log
+from tornado.options import define, options, parse_command_line
+from tornado.web import RequestHandler, HTTPError
+from .executor import run_io
+from .wire import brotli, choose_encoding
+
+web_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "web")
+
+define('static_path', type=str, default=web_path, help='前端文件目录')
+define('static_cache_path', type=str, default=os.path.join(os.path.expanduser("~"), ".czsc_web", "static"),
+       help='前端文件压缩结果的缓存目录')
+define('static_memory_max', type=int, default=1024 * 1024, help='读入内存的前端文件（或压缩结果）的大小上限（字节）')
+define('static_preload', type=bool, default=True, help='服务启动后在后台读取并压缩全部前端文件')
+
+# 值得压缩的文件类型，woff、图片等本身已经压缩
+_compressible = {".html", ".js", ".css", ".map", ".json", ".svg", ".ttf", ".txt", ".ico"}
+_min_size = 1024
+_extensions = {"gzip": ".gz", "br": ".br"}
+# 文件名中的内容哈希，如 chunk-vendors.aefc5aaa.js、app.fdd123f3.js.map
+_hashed = re.compile(r"\.[0-9a-f]{8,}\.[a-z0-9]+(\.map)?$")
+_chunk_size = 256 * 1024
+_immutable = "public, max-age=31536000, immutable"
+
+
+def _compress(data, encoding, best=False):
+    """best 为 True 时使用最高压缩级别，用于预先生成"""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11 if best else 9)
+
+
+def _encodings():
+    return ["gzip", "br"] if brotli is not None else ["gzip"]
+
+
+def _write(file, data):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    file_tmp = "{}.{}.tmp".format(file, os.getpid())
+    with open(file_tmp, 'wb') as f:
+        f.write(data)
+    os.replace(file_tmp, file)
+
+
+class Asset:
+    """一个前端文件及其压缩结果"""
+
+    def __init__(self, path, data, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.size = len(data)
+        self.etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        self.hashed = bool(_hashed.search(os.path.basename(path)))
+        self.content_type = mimetypes.guess_type(path)[0] or \
+            ("application/json" if path.endswith(".map") else "application/octet-stream")
+        self.body = data if self.size <= options.static_memory_max else None
+        # encoding -> (文件, 大小, 内存中的内容或 None)
+        self.variants = dict()
+
+    def fresh(self):
+        try:
+            return os.path.getmtime(self.path) == self.mtime
+        except OSError:
+            return False
+
+    def add_variant(self, encoding, file):
+        size = os.path.getsize(file)
+        # 压缩效果不明显时不使用
+        if size > self.size * 0.9:
+            return
+        body = None
+        if size <= options.static_memory_max:
+            with open(file, 'rb') as f:
+                body = f.read()
+        self.variants[encoding] = (file, size, body)
+
+
+def load_asset(path):
+    """读取文件、计算 ETag，并准备压缩结果，阻塞，在 IO 线程中执行
+
+    :return: Asset
+    :raise: HTTPError 文件不存在时为 404
+    """
+    if not os.path.isfile(path):
+        raise HTTPError(404)
+    mtime = os.path.getmtime(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    asset = Asset(path, data, mtime)
+    if os.path.splitext(path)[1] not in _compressible or asset.size < _min_size:
+        return asset
+
+    digest = asset.etag.strip('"')
+    for encoding in _encodings():
+        ext = _extensions[encoding]
+        file = path + ext
+        if not (os.path.exists(file) and os.path.getmtime(file) >= mtime):
+            file = os.path.join(options.static_cache_path, digest + ext)
+            if not os.path.exists(file):
+                _write(file, _compress(data, encoding))
+        asset.add_variant(encoding, file)
+    return asset
+
+
+def _read(file, offset, size):
+    with open(file, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+_assets = dict()
+_loading = dict()
+
+
+async def get_asset(path):
+    """返回 path 对应的 Asset，文件名中不带哈希的文件每次检查是否修改过；同一个文件同时只读取一次"""
+    asset = _assets.get(path)
+    if asset is not None and (asset.hashed or asset.fresh()):
+        return asset
+    if path not in _loading:
+        _loading[path] = run_io(load_asset, path)
+        _loading[path].add_done_callback(lambda _: _loading.pop(path, None))
+    asset = await asyncio.shield(_loading[path])
+    _assets[path] = asset
+    return asset
+
+
+async def preload(root):
+    """在后台读取并压缩 root 下的全部文件"""
+    start = time.time()
+    files = await run_io(lambda: [os.path.join(d, f) for d, _, fs in os.walk(root) for f in fs
+                                  if os.path.splitext(f)[1] not in [".gz", ".br"]])
+    for file in files:
+        try:
+            await get_asset(file)
+        except Exception as e:
+            app_log.warning("读取前端文件 %s 失败：%s", file, e)
+    app_log.info("准备好 %s 个前端文件，耗时 %.1f 秒", len(files), time.time() - start)
+
+
+class AssetHandler(RequestHandler):
+    """前端文件，见模块说明"""
+
+    def initialize(self, path, default_filename="index.html"):
+        self.root = os.path.abspath(path)
+        self.default_filename = default_filename
+
+    def resolve(self, path):
+        abspath = os.path.abspath(os.path.join(self.root, path))
+        if abspath != self.root and not abspath.startswith(self.root + os.sep):
+            raise HTTPError(403, "{} 不在前端文件目录中".format(path))
+        if not path or path.endswith("/"):
+            abspath = os.path.join(abspath, self.default_filename)
+        return abspath
+
+    async def get(self, path, include_body=True):
+        asset = await get_asset(self.resolve(path))
+        encoding = choose_encoding(self.request.headers.get("Accept-Encoding"), asset.variants)
+        # 不同压缩方式的内容不同，ETag 也要区分
+        self.set_header("Etag", asset.etag if encoding is None else asset.etag[:-1] + "-" + encoding + '"')
+        self.set_header("Last-Modified", datetime.fromtimestamp(asset.mtime, timezone.utc))
+        self.set_header("Cache-Control", _immutable if asset.hashed else "no-cache")
+        if asset.variants:
+            self.set_header("Vary", "Accept-Encoding")
+        if self.check_etag_header():
+            self.set_status(304)
+            return self.finish()
+
+        self.set_header("Content-Type", asset.content_type)
+        if encoding is not None:
+            self.set_header("Content-Encoding", encoding)
+        file, size, body = asset.variants[encoding] if encoding else (asset.path, asset.size, asset.body)
+        self.set_header("Content-Length", size)
+        if not include_body:
+            return self.finish()
+        if body is not None:
+            return self.finish(body)
+
+        for offset in range(0, size, _chunk_size):
+            self.write(await run_io(_read, file, offset, _chunk_size))
+            try:
+                await self.flush()
+            except StreamClosedError:
+                return
+        self.finish()
+
+    def head(self, path):
+        return self.get(path, include_body=False)
+
+
+def build(root):
+    """在 root 下每个值得压缩的文件旁边生成 .gz / .br 文件，返回 [(文件, 原始大小, {encoding: 压缩后大小})]"""
+    results = []
+    for d, _, files in os.walk(root):
+        for name in sorted(files):
+            path = os.path.join(d, name)
+            if os.path.splitext(name)[1] not in _compressible or os.path.getsize(path) < _min_size:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            sizes = dict()
+            for encoding in _encodings():
+                compressed = _compress(data, encoding, best=True)
+                _write(path + _extensions[encoding], compressed)
+                sizes[encoding] = len(compressed)
+            results.append((path, len(data), sizes))
+    return results
+
+
+def main():
+    parse_command_line()
+    for path, size, sizes in build(options.static_path):
+        print("{}  {}  {}".format(os.path.relpath(path, options.static_path), size,
+                                  "  ".join("{} {}".format(k, v) for k, v in sizes.items())))
+
+
+if __name__ == '__main__':
+    main()
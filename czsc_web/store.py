@@ -0,0 +1,311 @@
+# coding: utf-8
+"""
+本地K线存储
+
+每个 (数据源, 复权方式, K线级别, 标的) 对应一个定长记录的二进制文件，通过 np.memmap 读取；
+命中缓存时只向上游请求最后一根K线之后的数据并追加到文件末尾。
+
+复权数据在分红送转之后会改写全部历史价格，所以追加之前会用重叠部分的K线做校验，
+价格不一致时说明上游重新复权了，丢弃本地数据，重新全量获取。
+
+本地数据停在很早以前（如先打开了历史日期的图表）时，缺失的部分可能比一次全量获取还长，
+这时不做增量请求，直接按数据源的时间范围或数量全量获取。
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from tornado.options import define, options
+from .resample import bar_closes, sessions
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+define('store_path', type=str, default=os.path.join(os.path.expanduser("~"), ".czsc_web", "bars"),
+       help='本地K线存储目录')
+define('store_overlap', type=int, default=3, help='增量更新时与本地数据重叠校验的K线数量')
+define('store_refresh_interval', type=float, default=3, help='同一序列两次向上游增量请求的最短间隔（秒）')
+
+bar_dtype = np.dtype([('dt', '<i8'), ('open', '<f8'), ('close', '<f8'),
+                      ('high', '<f8'), ('low', '<f8'), ('vol', '<f8')])
+
+
+@contextmanager
+def _file_lock(file):
+    """进程间的文件锁，多个 worker 进程共用存储目录时，同一个序列同时只有一个进程更新"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def df_to_bars(df):
+    """DataFrame 转换成定长记录数组
+
+    :param df: pd.DataFrame
+        columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]
+    :return: np.ndarray
+    """
+    bars = np.empty(len(df), dtype=bar_dtype)
+    bars['dt'] = pd.to_datetime(df['dt']).values.astype('datetime64[ns]').view('i8')
+    for col in ['open', 'close', 'high', 'low', 'vol']:
+        bars[col] = df[col].values
+    return bars
+
+
+def bars_to_df(bars, symbol):
+    """定长记录数组转换成 DataFrame，列与各数据源 get_kline 的返回值一致"""
+    return pd.DataFrame({
+        "symbol": symbol,
+        "dt": bars['dt'].astype('datetime64[ns]'),
+        "open": bars['open'],
+        "close": bars['close'],
+        "high": bars['high'],
+        "low": bars['low'],
+        "vol": bars['vol'],
+    })
+
+
+def bars_per_day(freq):
+    """一个交易日最多的K线数量，按交易时间最长的品种计算"""
+    return max(len(bar_closes(freq, market)) for market in sessions)
+
+
+class BarStore:
+    def __init__(self, provider, path=None):
+        """
+
+        :param provider: str
+            数据源名称，如 ts / jq / gm
+        :param path: str
+            存储目录，默认为 options.store_path
+        """
+        self.provider = provider
+        self.path = path or options.store_path
+        self._locks = dict()
+        self._locks_guard = threading.Lock()
+
+    def _file(self, symbol, freq, adj):
+        return os.path.join(self.path, self.provider, adj, freq, "{}.bin".format(symbol))
+
+    def _lock(self, key):
+        with self._locks_guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def read(self, symbol, freq, adj):
+        """读取本地K线，没有数据时返回空数组"""
+        file = self._file(symbol, freq, adj)
+        if not os.path.exists(file):
+            return np.empty(0, dtype=bar_dtype)
+        # 写入中断时文件末尾可能残留不完整的记录，直接忽略
+        n = os.path.getsize(file) // bar_dtype.itemsize
+        if n == 0:
+            return np.empty(0, dtype=bar_dtype)
+        return np.memmap(file, dtype=bar_dtype, mode='r', shape=(n,))
+
+    def write(self, symbol, freq, adj, bars):
+        """全量覆盖写入"""
+        file = self._file(symbol, freq, adj)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        file_tmp = "{}.{}.tmp".format(file, os.getpid())
+        bars.tofile(file_tmp)
+        os.replace(file_tmp, file)
+
+    def append(self, symbol, freq, adj, bars):
+        """追加写入，本地已有的 dt >= bars[0]['dt'] 的K线会被替换"""
+        if len(bars) == 0:
+            return
+        if not os.path.exists(self._file(symbol, freq, adj)):
+            self.write(symbol, freq, adj, bars)
+            return
+        file = self._file(symbol, freq, adj)
+        old = self.read(symbol, freq, adj)
+        keep = int(np.searchsorted(old['dt'], bars[0]['dt'], side='left'))
+        if keep + len(bars) < len(old):
+            # 文件变短时不能原地截断，其他读者持有的 memmap 会越界，改为整体替换
+            self.write(symbol, freq, adj, np.concatenate([old[:keep], bars]))
+            return
+        del old
+        with open(file, 'r+b') as f:
+            f.seek(keep * bar_dtype.itemsize)
+            f.write(bars.tobytes())
+
+    def invalidate(self, symbol, freq, adj):
+        file = self._file(symbol, freq, adj)
+        for f in [file, file + ".json"]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def read_meta(self, symbol, freq, adj):
+        """读取存储的元信息
+
+        covered_from 表示本地数据从这个时间点开始是完整的；
+        refreshed_at、refreshed_end 为最近一次向上游请求的时间和请求的截止时间
+        """
+        file = self._file(symbol, freq, adj) + ".json"
+        if not os.path.exists(file):
+            return {"covered_from": None}
+        with open(file, 'r') as f:
+            return json.load(f)
+
+    def write_meta(self, symbol, freq, adj, meta):
+        file = self._file(symbol, freq, adj) + ".json"
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        file_tmp = "{}.{}.tmp".format(file, os.getpid())
+        with open(file_tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(file_tmp, file)
+
+    def _refresh(self, symbol, freq, adj, fetch, end_dt, start_dt, count):
+        """全量获取并覆盖本地数据"""
+        bars = df_to_bars(fetch(None, end_dt))
+        if count and len(bars) < count:
+            # 上游返回的数量不足，说明已经是全部历史
+            covered_from = 0
+        elif start_dt is not None:
+            covered_from = int(np.datetime64(start_dt, 'ns').view('i8'))
+        elif len(bars):
+            covered_from = int(bars['dt'][0])
+        else:
+            covered_from = None
+        self.write(symbol, freq, adj, bars)
+        meta = self.read_meta(symbol, freq, adj)
+        meta['covered_from'] = covered_from
+        self.write_meta(symbol, freq, adj, meta)
+
+    def _is_readjusted(self, old, new):
+        """比较重叠部分的K线，价格不一致说明上游重新复权了
+
+        本地最后一根K线可能是未完成的K线，不参与比较
+        """
+        old = old[:-1]
+        common, i_old, i_new = np.intersect1d(old['dt'], new['dt'], return_indices=True)
+        if len(common) == 0:
+            return len(old) > 0
+        for col in ['open', 'close', 'high', 'low']:
+            if not np.allclose(old[col][i_old], new[col][i_new], rtol=1e-6, atol=1e-4):
+                return True
+        return False
+
+    def _update(self, symbol, freq, adj, fetch, end_dt, start_dt, count):
+        old = self.read(symbol, freq, adj)
+        if len(old) > 0 and end_dt is not None and old['dt'][-1] >= np.datetime64(end_dt, 'ns').view('i8'):
+            # 本地数据已经覆盖请求区间
+            return
+
+        # 多个图表同时用到同一个序列时（如由 1 分钟K线合成其他级别），只请求一次上游；
+        # 请求时间记录在元信息中，多个 worker 进程之间同样生效
+        meta = self.read_meta(symbol, freq, adj)
+        end = None if end_dt is None else int(np.datetime64(end_dt, 'ns').view('i8'))
+        if meta.get('refreshed_end') == end and time.time() - meta.get('refreshed_at', 0) < options.store_refresh_interval:
+            return
+        meta.update(refreshed_at=time.time(), refreshed_end=end)
+        self.write_meta(symbol, freq, adj, meta)
+        try:
+            self._fetch_update(symbol, freq, adj, fetch, end_dt, start_dt, count, old)
+        except Exception:
+            # 请求上游失败，清除请求时间，重试时不会被当作刚刚更新过
+            meta.update(refreshed_at=0)
+            self.write_meta(symbol, freq, adj, meta)
+            raise
+
+    def _gap_too_large(self, freq, last, end_dt, start_dt, count):
+        """本地最后一根K线到 end_dt 之间缺失的K线是否比一次全量获取还多
+
+        :param last: int
+            本地最后一根K线的 dt（纳秒）
+        """
+        if start_dt is not None:
+            return last < np.datetime64(start_dt, 'ns').view('i8')
+        if count:
+            end = np.datetime64(end_dt if end_dt is not None else pd.Timestamp.now(), 'D')
+            days = np.busday_count(np.datetime64(last, 'ns').astype('datetime64[D]'), end) + 1
+            return days * bars_per_day(freq) > count
+        return False
+
+    def _fetch_update(self, symbol, freq, adj, fetch, end_dt, start_dt, count, old):
+        if len(old) == 0 or self._gap_too_large(freq, int(old['dt'][-1]), end_dt, start_dt, count):
+            self._refresh(symbol, freq, adj, fetch, end_dt, start_dt, count)
+            return
+
+        overlap = np.array(old[-options.store_overlap:])
+        tail_start = pd.Timestamp(overlap['dt'][0]).to_pydatetime()
+        new = df_to_bars(fetch(tail_start, end_dt))
+        if len(new) == 0:
+            return
+
+        if self._is_readjusted(overlap, new):
+            self._refresh(symbol, freq, adj, fetch, end_dt, start_dt, count)
+        else:
+            new = new[new['dt'] >= overlap['dt'][-1]]
+            self.append(symbol, freq, adj, new)
+
+    def peek(self, symbol, freq, adj, end_dt=None, count=None):
+        """只读取本地已有的K线，不调用数据源，用于数据源不可用时
+
+        :return: pd.DataFrame
+        """
+        # 不加锁：获取数据的线程可能卡在上游调用中并持有锁，而写入都是整体替换或者追加完整的记录
+        bars = np.array(self.read(symbol, freq, adj))
+        if end_dt is not None:
+            bars = bars[:np.searchsorted(bars['dt'], np.datetime64(end_dt, 'ns').view('i8'), side='left')]
+        if count:
+            bars = bars[-count:]
+        return bars_to_df(bars, symbol)
+
+    def load(self, symbol, freq, adj, fetch, end_dt=None, start_dt=None, count=None):
+        """从本地存储读取K线，本地数据不完整时调用 fetch 补齐
+
+        :param symbol: str
+            标的代码
+        :param freq: str
+            K线级别
+        :param adj: str
+            复权方式，如 qfq / none
+        :param fetch: callable
+            fetch(start_dt, end_dt) 返回 dt >= start_dt 且 dt < end_dt 的K线 DataFrame；
+            start_dt 为 None 时全量获取
+        :param end_dt: datetime
+            截止时间（不包含），为 None 时表示最新
+        :param start_dt: datetime
+            开始时间（包含）
+        :param count: int
+            最多返回的K线数量
+        :return: pd.DataFrame
+            columns = ["symbol", "dt", "open", "close", "high", "low", "vol"]
+        """
+        with self._lock((symbol, freq, adj)), _file_lock(self._file(symbol, freq, adj) + ".lock"):
+            self._update(symbol, freq, adj, fetch, end_dt, start_dt, count)
+            bars = self.read(symbol, freq, adj)
+            covered_from = self.read_meta(symbol, freq, adj)['covered_from']
+
+        if end_dt is not None:
+            bars = bars[:np.searchsorted(bars['dt'], np.datetime64(end_dt, 'ns').view('i8'), side='left')]
+        if start_dt is not None:
+            start = np.datetime64(start_dt, 'ns').view('i8')
+            short = covered_from is None or covered_from > start
+            bars = bars[np.searchsorted(bars['dt'], start, side='left'):]
+        elif count:
+            short = len(bars) < count and (covered_from is None or covered_from > 0)
+        else:
+            short = False
+
+        if short:
+            # 本地历史不够长（如更早日期的请求），直接从上游获取，不写入本地
+            bars = df_to_bars(fetch(None, end_dt))
+        if count:
+            bars = bars[-count:]
+        return bars_to_df(np.array(bars), symbol)
@@ -0,0 +1,312 @@
+# coding: utf-8
+"""
+数据源调用的限流、排队、重试和熔断
+
+每个数据源一个 UpstreamGate：
+
+* 令牌桶 - 每次调用数据源接口前取一个令牌，速率为每分钟 rate 次（Provider.rate_limit，可以用 --upstream_rate 覆盖），
+  令牌不够时在 IO 线程中等待，不会超出数据源的每分钟调用限制
+* 优先级排队 - 同一个数据源同时进行的K线获取不超过 upstream_concurrency 个，其余按优先级排队：
+  打开图表（INTERACTIVE）优先于后台预取（PREFETCH），后台预取优先于批量分析（BATCH）。
+  优先级通过 contextvar 传递，批量分析等后台任务在开始时调用 set_priority。
+  SingleFlight 合并的计算以发起者的优先级开始，更高优先级的调用者加入时通过 Priority.raise_to 提高，
+  正在排队的调用随之提前，打开图表不会等在一次批量分析的获取后面
+* 超时和重试 - 每次获取最多等待 upstream_timeout 秒，失败后按指数退避重试 upstream_retries 次；
+  参数错误（ValueError、KeyError 等）不重试
+* 熔断 - 连续失败 upstream_failures 次后熔断 upstream_reset 秒，期间不再调用数据源，之后放行一个请求试探。
+  熔断或者重试都失败时，返回本地K线存储中已有的K线（可能不是最新的），响应带 Warning 头；本地也没有时返回 503
+
+超时的调用无法中止，占用的 IO 线程和排队名额在数据源真正返回之后才释放，数据源卡住时不会占满 IO 线程池。
+"""
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from tornado.options import define, options
+from .executor import run_io
+from .metrics import Counter, Gauge, upstream_retries, timer
+
+define('upstream_rate', type=str, multiple=True, default=[],
+       help='数据源每分钟最多调用次数，如 ts:500,gm:300，没有给出的使用数据源的默认值')
+define('upstream_concurrency', type=int, default=8, help='每个数据源同时进行的K线获取数量')
+define('upstream_timeout', type=float, default=30, help='每次获取K线的超时秒数')
+define('upstream_retries', type=int, default=2, help='获取K线失败后的重试次数')
+define('upstream_backoff', type=float, default=0.5, help='第一次重试前的等待秒数，之后每次翻倍')
+define('upstream_failures', type=int, default=5, help='连续失败多少次后熔断')
+define('upstream_reset', type=float, default=30, help='熔断持续的秒数')
+
+INTERACTIVE = 0
+PREFETCH = 1
+BATCH = 2
+
+_priority = contextvars.ContextVar("czsc_priority", default=INTERACTIVE)
+
+upstream_stale = Counter("czsc_upstream_stale_total", "数据源不可用时返回本地K线的次数", ["provider"])
+circuit_open = Gauge("czsc_upstream_circuit_open", "数据源是否处于熔断状态", ["provider"])
+
+
+class ProviderError(Exception):
+    """数据源接口返回的错误（参数错误、没有权限、超出额度等），不是网络问题，重试也不会成功"""
+    pass
+
+
+# 参数错误、数据源接口返回的错误、没有安装 SDK，重试也不会成功，也不计入熔断
+permanent_errors = (ValueError, KeyError, TypeError, IndexError, NotImplementedError, ImportError, ProviderError)
+
+
+class UpstreamUnavailable(Exception):
+    """数据源熔断或者调用失败，并且本地也没有K线"""
+    pass
+
+
+class RateLimited(Exception):
+    """等待令牌超时"""
+    pass
+
+
+class Priority:
+    """可以提高的优先级，由多个调用者共用的计算使用（见 czsc_web.cache.SingleFlight）"""
+
+    def __init__(self, value):
+        self.value = value
+        self._queued = []
+
+    def watch(self, limiter, fut):
+        """记录正在 limiter 中排队的调用，提高优先级时一起提前"""
+        self._queued = [(lim, f) for lim, f in self._queued if not f.done()]
+        self._queued.append((limiter, fut))
+
+    def raise_to(self, value):
+        if value >= self.value:
+            return
+        self.value = value
+        for limiter, fut in self._queued:
+            if not fut.done():
+                limiter.requeue(value, fut)
+
+
+def set_priority(priority):
+    """设置当前任务（及其创建的子任务）调用数据源的优先级
+
+    :param priority: int or Priority
+    """
+    _priority.set(priority)
+
+
+def get_priority():
+    priority = _priority.get()
+    return priority.value if isinstance(priority, Priority) else priority
+
+
+def current_priority():
+    """当前的优先级，可能是共用的 Priority 对象"""
+    return _priority.get()
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate, burst=None):
+        """
+
+        :param rate: float
+            每分钟的令牌数
+        :param burst: float
+            最多积累的令牌数，默认为 rate 的六分之一（10 秒的量），至少为 1
+        """
+        self.rate = rate / 60.0
+        self.burst = burst or max(1.0, rate / 6.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        """取一个令牌，返回需要等待的秒数，为 0 时已经取到"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def take(self, timeout=None):
+        """取一个令牌，阻塞，在 IO 线程中调用"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            wait = self._wait()
+            if wait == 0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise RateLimited("等待调用额度超过 {} 秒".format(timeout))
+            time.sleep(wait)
+
+
+class PriorityLimiter:
+    """按优先级排队的并发限制，在 IOLoop 中使用"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority):
+        """
+
+        :param priority: int or Priority
+            为 Priority 时，排队期间优先级提高会随之提前
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        if isinstance(priority, Priority):
+            priority.watch(self, fut)
+            priority = priority.value
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已经分到名额之后才被取消，交给下一个
+                self.release()
+            raise
+
+    def requeue(self, priority, fut):
+        # 原来的条目留在堆中，轮到时 fut 已经完成，直接跳过
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+class CircuitBreaker:
+    """连续失败 failures 次后熔断 reset 秒，之后只放行一个试探请求"""
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.time() - self.opened_at < options.upstream_reset or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record(self, ok):
+        self.probing = False
+        if ok:
+            self.failures = 0
+            if self.opened_at is not None:
+                self.opened_at = None
+                circuit_open.dec(provider=self.name)
+            return
+        self.failures += 1
+        if self.failures >= options.upstream_failures:
+            if self.opened_at is None:
+                circuit_open.inc(provider=self.name)
+            self.opened_at = time.time()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+def _rate_of(name, default):
+    for item in options.upstream_rate:
+        key, _, value = item.partition(":")
+        if key.strip() == name:
+            return float(value) if value else None
+    return default
+
+
+class UpstreamGate:
+    def __init__(self, name, rate=None):
+        """
+
+        :param name: str
+            数据源名称
+        :param rate: float
+            默认的每分钟最多调用次数，为 None 时不限制
+        """
+        self.name = name
+        self._rate = rate
+        self._bucket = None
+        self._limiter = None
+        self.breaker = CircuitBreaker(name)
+
+    @property
+    def bucket(self):
+        # 在解析命令行参数之后才创建
+        if self._bucket is None:
+            rate = _rate_of(self.name, self._rate)
+            self._bucket = TokenBucket(rate) if rate else False
+        return self._bucket
+
+    @property
+    def limiter(self):
+        if self._limiter is None:
+            self._limiter = PriorityLimiter(options.upstream_concurrency)
+        return self._limiter
+
+    def take(self):
+        """调用数据源接口之前取令牌，阻塞，在 IO 线程中调用"""
+        if self.bucket:
+            with timer("throttle", self.name):
+                self.bucket.take(options.upstream_timeout)
+
+    async def _attempt(self, fn, args, kwargs):
+        await self.limiter.acquire(current_priority())
+        future = run_io(fn, *args, **kwargs)
+        try:
+            done, _ = await asyncio.wait([future], timeout=options.upstream_timeout)
+        except asyncio.CancelledError:
+            future.add_done_callback(lambda _: self.limiter.release())
+            raise
+        if not done:
+            # 线程无法中止，等它结束后再释放名额
+            future.add_done_callback(lambda _: self.limiter.release())
+            raise TimeoutError("数据源 {} 超过 {} 秒没有返回".format(self.name, options.upstream_timeout))
+        self.limiter.release()
+        return future.result()
+
+    async def call(self, fn, *args, **kwargs):
+        """在 IO 线程池中执行 fn，排队、超时、重试、熔断
+
+        :return: fn 的返回值
+        :raise: UpstreamUnavailable 熔断时；其他异常为最后一次调用的异常
+        """
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("数据源 {} 暂时不可用（熔断中）".format(self.name))
+        for attempt in range(options.upstream_retries + 1):
+            try:
+                result = await self._attempt(fn, args, kwargs)
+            except asyncio.CancelledError:
+                self.breaker.probing = False
+                raise
+            except permanent_errors:
+                self.breaker.record(True)
+                raise
+            except Exception:
+                self.breaker.record(False)
+                if attempt >= options.upstream_retries or self.breaker.is_open:
+                    raise
+                upstream_retries.inc(provider=self.name)
+                await asyncio.sleep(options.upstream_backoff * 2 ** attempt * (0.5 + random.random()))
+            else:
+                self.breaker.record(True)
+                return result
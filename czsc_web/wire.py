@@ -0,0 +1,233 @@
+# coding: utf-8
+"""
+K线分析结果的输出格式
+
+通过 format 参数或者 Accept 请求头选择：
+
+* json（默认） - 与原来一致，{"kdata": [[dt, open, close, low, high, vol, fx_mark, fx, bi, xd], ...]}
+* columnar - 按列输出的 JSON，dt 为秒级时间戳（按 UTC 解释即为原始的本地时间），
+  分型、笔、线段只输出所在K线的下标和数值
+* binary - 类型化数组，前 4 字节为 b"CZK1"，接着是 4 字节小端整数表示的头部长度和 JSON 头部，
+  头部的 arrays 给出每个数组的 dtype、offset、length，数组按 8 字节对齐，可以直接构造 Float32Array 等
+* msgpack - 与 columnar 的结构一致，数组以二进制类型化数组的形式放在 msgpack 中，需要安装 msgpack
+
+请求中带有窗口或抽稀参数时，各格式都多一个 window 字段（binary 在头部中），见 czsc_web.lod。
+请求中带有指标参数时，json 和 columnar 多一个 indicators 字段（输出名称 -> 与K线对齐的数组，保留 4 位小数），
+binary 和 msgpack 按输出名称增加 float32 数组，见 czsc_web.indicators。
+
+编码和 gzip/brotli 压缩都在分析进程中完成，压缩后的内容与原始内容一起缓存。
+"""
+import gzip
+import json
+import struct
+import numpy as np
+from tornado.escape import json_encode, utf8
+from tornado.web import HTTPError
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+content_types = {
+    "json": "application/json; charset=UTF-8",
+    "columnar": "application/json; charset=UTF-8",
+    "binary": "application/octet-stream",
+    "msgpack": "application/x-msgpack",
+}
+
+_accept_formats = [
+    ("application/x-msgpack", "msgpack"),
+    ("application/msgpack", "msgpack"),
+    ("application/octet-stream", "binary"),
+    ("application/vnd.czsc.columnar+json", "columnar"),
+]
+
+_binary_magic = b"CZK1"
+
+
+class Payload:
+    """编码后的响应内容，variants 为不同 Content-Encoding 的压缩结果"""
+
+    def __init__(self, body, content_type):
+        self.body = utf8(body)
+        self.content_type = content_type
+        self.variants = dict()
+        # 生成这个响应时分析进程中各阶段的耗时（秒）和采样结果，见 czsc_web.metrics / czsc_web.profiler
+        self.timings = dict()
+        self.profile = None
+        # 数据源不可用时用本地已有的K线生成，见 czsc_web.upstream
+        self.stale = False
+
+    def compress(self, min_size=1024):
+        if len(self.body) < min_size:
+            return self
+        self.variants['gzip'] = gzip.compress(self.body, compresslevel=6)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body, quality=5)
+        return self
+
+    def choose(self, accept_encoding):
+        """根据 Accept-Encoding 选择压缩方式
+
+        :return: (encoding, body)，encoding 为 None 表示不压缩
+        """
+        encoding = choose_encoding(accept_encoding, self.variants)
+        return encoding, self.variants[encoding] if encoding else self.body
+
+
+def choose_encoding(accept_encoding, available):
+    """按 br、gzip 的顺序选择客户端接受并且有压缩结果的方式，都没有时返回 None"""
+    accepted = [x.split(";")[0].strip() for x in (accept_encoding or "").split(",")]
+    for encoding in ['br', 'gzip']:
+        if encoding in accepted and encoding in available:
+            return encoding
+    return None
+
+
+def negotiate(handler, allowed=None):
+    """根据 format 参数或 Accept 请求头确定输出格式
+
+    :param handler: RequestHandler
+    :param allowed: list
+        允许的格式，默认为全部
+    :return: str
+    """
+    fmt = handler.get_argument("format", None)
+    if not fmt:
+        accept = handler.request.headers.get("Accept", "")
+        fmt = next((f for mime, f in _accept_formats if mime in accept), "json")
+    allowed = allowed or list(content_types.keys())
+    if fmt not in allowed or (fmt == "msgpack" and msgpack is None):
+        raise HTTPError(406, "不支持的输出格式：{}，可选值为 {}".format(fmt, allowed))
+    return fmt
+
+
+def _rows(result):
+    """原始格式，每根K线一行"""
+    dt = np.char.replace(np.datetime_as_string(result['dt'].astype('datetime64[s]'), unit='s'), "T", " ")
+    n = len(dt)
+    fx_mark = np.full(n, "o", dtype=object)
+    fx = np.full(n, "", dtype=object)
+    bi = np.full(n, "", dtype=object)
+    xd = np.full(n, "", dtype=object)
+    fx_mark[result['fx_index']] = result['fx_mark']
+    fx[result['fx_index']] = result['fx']
+    bi[result['bi_index']] = result['bi']
+    xd[result['xd_index']] = result['xd']
+    return [list(row) for row in zip(dt.tolist(), result['open'].tolist(), result['close'].tolist(),
+                                     result['low'].tolist(), result['high'].tolist(), result['vol'].tolist(),
+                                     fx_mark.tolist(), fx.tolist(), bi.tolist(), xd.tolist())]
+
+
+def _sparse(result):
+    data = {
+        "fx": {"index": result['fx_index'].tolist(), "mark": list(result['fx_mark']), "value": list(result['fx'])},
+        "bi": {"index": result['bi_index'].tolist(), "value": list(result['bi'])},
+        "xd": {"index": result['xd_index'].tolist(), "value": list(result['xd'])},
+    }
+    if 'window' in result:
+        data['window'] = result['window']
+    return data
+
+
+def _indicators(result):
+    return {name: np.round(values, 4).tolist() for name, values in result['indicators'].items()}
+
+
+def _epoch_seconds(dt):
+    return dt.astype('datetime64[s]').astype(np.int64)
+
+
+def columnar(result):
+    """按列整理的分析结果，dt 为秒级时间戳"""
+    data = {
+        "n": len(result['dt']),
+        "dt": _epoch_seconds(result['dt']).tolist(),
+        "open": result['open'].tolist(),
+        "close": result['close'].tolist(),
+        "high": result['high'].tolist(),
+        "low": result['low'].tolist(),
+        "vol": result['vol'].tolist(),
+    }
+    data.update(_sparse(result))
+    if 'indicators' in result:
+        data['indicators'] = _indicators(result)
+    return data
+
+
+def encode_columnar(result):
+    return json_encode(columnar(result))
+
+
+def _typed_arrays(result):
+    arrays = [
+        ("dt", _epoch_seconds(result['dt']).astype('<f8')),
+        ("open", result['open'].astype('<f4')),
+        ("close", result['close'].astype('<f4')),
+        ("high", result['high'].astype('<f4')),
+        ("low", result['low'].astype('<f4')),
+        ("vol", result['vol'].astype('<f4')),
+    ]
+    for name, values in result.get('indicators', {}).items():
+        arrays.append((name, values.astype('<f4')))
+    return arrays
+
+
+def encode_binary(result):
+    arrays = []
+    buffers = []
+    offset = 0
+    for name, arr in _typed_arrays(result):
+        arrays.append({"name": name, "dtype": arr.dtype.str, "offset": offset, "length": len(arr)})
+        raw = arr.tobytes()
+        raw += b"\0" * (-len(raw) % 8)
+        buffers.append(raw)
+        offset += len(raw)
+
+    header = {"n": len(result['dt']), "arrays": arrays}
+    header.update(_sparse(result))
+    header = utf8(json.dumps(header, separators=(",", ":")))
+    # 头部补齐到 8 字节，保证数组在整个响应中也是对齐的
+    header += b" " * (-(len(header) + 8) % 8)
+    return _binary_magic + struct.pack("<I", len(header)) + header + b"".join(buffers)
+
+
+def encode_msgpack(result):
+    data = {"n": len(result['dt'])}
+    for name, arr in _typed_arrays(result):
+        data[name] = arr.tobytes()
+    data.update(_sparse(result))
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def encode_payload(result, fmt="json"):
+    """把 analyze_kline 的结果编码成指定格式，并生成压缩版本
+
+    :param result: dict
+        analyze_kline 的返回值
+    :param fmt: str
+        输出格式，可选值 json / columnar / binary / msgpack
+    :return: Payload
+    """
+    if fmt == "json":
+        data = {"kdata": _rows(result)}
+        if 'window' in result:
+            data['window'] = result['window']
+        if 'indicators' in result:
+            data['indicators'] = _indicators(result)
+        body = json_encode(data)
+    elif fmt == "columnar":
+        body = encode_columnar(result)
+    elif fmt == "binary":
+        body = encode_binary(result)
+    elif fmt == "msgpack":
+        body = encode_msgpack(result)
+    else:
+        raise ValueError("fmt value error, current value is %s" % fmt)
+    return Payload(body, content_types[fmt]).compress()
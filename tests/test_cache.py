@@ -0,0 +1,58 @@
+# coding: utf-8
+import asyncio
+from czsc_web.cache import SingleFlight, get_or_compute_result, kline_cache
+from czsc_web.upstream import BATCH, INTERACTIVE, PREFETCH, PriorityLimiter, current_priority, set_priority
+
+
+def test_get_or_compute_result_coalesces_callers():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"n": len(calls)}
+
+    async def main():
+        key = ("live", "test", "000001.SH", "1min")
+        try:
+            first = await asyncio.gather(*[get_or_compute_result(key, 10, compute) for _ in range(5)])
+            # 缓存有效期内的轮询直接使用缓存
+            again = await get_or_compute_result(key, 10, compute)
+        finally:
+            kline_cache.clear()
+        return first, again
+
+    first, again = asyncio.run(main())
+    assert calls == [1]
+    assert all(r is first[0] for r in first)
+    assert again is first[0]
+
+
+def test_joining_caller_raises_flight_priority():
+    # 名额被占满时，批量分析发起的计算排在后台预取之后；打开图表的请求加入后应该先于后台预取
+    limiter = PriorityLimiter(1)
+    flight = SingleFlight()
+    order = []
+
+    async def fetch(name):
+        await limiter.acquire(current_priority())
+        order.append(name)
+        limiter.release()
+        return name
+
+    async def with_priority(priority, coro_fn):
+        set_priority(priority)
+        return await coro_fn()
+
+    async def main():
+        await limiter.acquire(INTERACTIVE)
+        batch = asyncio.ensure_future(with_priority(BATCH, lambda: flight.do("k", lambda: fetch("flight"))))
+        prefetch = asyncio.ensure_future(with_priority(PREFETCH, lambda: fetch("prefetch")))
+        await asyncio.sleep(0)
+        chart = asyncio.ensure_future(with_priority(INTERACTIVE, lambda: flight.do("k", lambda: fetch("again"))))
+        await asyncio.sleep(0)
+        limiter.release()
+        return await asyncio.gather(batch, prefetch, chart)
+
+    assert asyncio.run(main()) == ["flight", "prefetch", "flight"]
+    assert order == ["flight", "prefetch"]
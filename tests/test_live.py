@@ -0,0 +1,62 @@
+# coding: utf-8
+import numpy as np
+from czsc_web.live import diff_result
+
+
+def result(n, first="2021-06-01 09:31", fx=(), bi=(), xd=()):
+    """n 根 1 分钟K线的分析结果，fx/bi/xd 给出 (index, ...) 的取值"""
+    dt = np.datetime64(first, 'ns') + np.arange(n) * np.timedelta64(1, 'm')
+    close = np.arange(n, dtype=np.float64) + 10
+    return {
+        "dt": dt, "open": close.copy(), "close": close.copy(), "high": close + 1, "low": close - 1,
+        "vol": np.full(n, 100.0),
+        "fx_index": np.array([i for i, _, _ in fx], dtype=np.int64),
+        "fx_mark": [m for _, m, _ in fx], "fx": [v for _, _, v in fx],
+        "bi_index": np.array([i for i, _ in bi], dtype=np.int64), "bi": [v for _, v in bi],
+        "xd_index": np.array([i for i, _ in xd], dtype=np.int64), "xd": [v for _, v in xd],
+    }
+
+
+def seconds(r, i):
+    return int(r['dt'][i].astype('datetime64[s]').astype(np.int64))
+
+
+def test_snapshot_without_previous_result():
+    new = result(3)
+    message = diff_result(None, new)
+    assert message['type'] == "snapshot"
+    assert message['data']['n'] == 3
+    assert diff_result(result(0), new)['type'] == "snapshot"
+
+
+def test_unchanged_returns_none():
+    assert diff_result(result(5), result(5)) is None
+
+
+def test_delta_updates_last_bar_and_appends_new_bars():
+    old, new = result(5), result(7)
+    new['close'][4] = 99
+    message = diff_result(old, new)
+    assert message['type'] == "delta"
+    assert message['bars']['dt'] == [seconds(new, i) for i in range(4, 7)]
+    assert message['bars']['close'] == [99, 15, 16]
+
+
+def test_delta_sets_and_removes_points():
+    old = result(5, fx=[(1, "g", 12.0), (4, "d", 13.0)], bi=[(1, 12.0), (4, 13.0)])
+    new = result(6, fx=[(1, "g", 12.0), (5, "d", 14.0)], bi=[(1, 12.0), (5, 14.0)])
+    message = diff_result(old, new)
+    assert message['fx'] == {"set": [[seconds(new, 5), "d", 14.0]], "remove": [seconds(old, 4)]}
+    assert message['bi'] == {"set": [[seconds(new, 5), 14.0]], "remove": [seconds(old, 4)]}
+    assert message['xd'] == {"set": [], "remove": []}
+
+
+def test_snapshot_when_completed_bar_changed():
+    # 数据源重新复权，已完成的K线变化
+    old, new = result(5), result(6)
+    new['close'][3] = 50
+    assert diff_result(old, new)['type'] == "snapshot"
+
+
+def test_snapshot_when_last_bar_missing():
+    assert diff_result(result(5), result(5, first="2021-06-02 09:31"))['type'] == "snapshot"
@@ -0,0 +1,89 @@
+# coding: utf-8
+import numpy as np
+import pandas as pd
+import pytest
+from czsc_web.resample import load_resampled, market_of, resample_minutes, bar_closes
+
+
+def minute_bars(first, n, symbol="000001.SH"):
+    """dt 为结束时间，从 first 开始每分钟一根、共 n 根K线，不考虑交易时段"""
+    dt = np.datetime64(first, 'ns') + np.arange(n) * np.timedelta64(1, 'm')
+    close = np.arange(n, dtype=np.float64) + 10
+    return pd.DataFrame({"symbol": symbol, "dt": dt, "open": close, "close": close,
+                         "high": close + 1, "low": close - 1, "vol": 100.0})
+
+
+class Loader:
+    """按级别返回给定的K线，并记录请求过的级别"""
+
+    def __init__(self, bars):
+        self.bars = bars
+        self.calls = []
+
+    def __call__(self, freq):
+        self.calls.append(freq)
+        return self.bars.get(freq, minute_bars("2021-01-04 09:31", 0))
+
+
+def test_fetches_target_directly():
+    # 一次获取的 1 分钟K线合成之后不够 5 分钟K线的历史长度，有这个级别时直接获取
+    direct = minute_bars("2020-01-02 09:35", 5000)
+    load = Loader({"1min": minute_bars("2021-01-04 09:31", 5000), "5min": direct})
+    k = load_resampled(load, "5min")
+    assert k is direct
+    assert load.calls == ["5min"]
+
+
+def test_resamples_when_target_is_missing():
+    # local 数据源只有 1 分钟K线文件
+    load = Loader({"1min": minute_bars("2021-01-04 09:31", 120)})
+    k = load_resampled(load, "5min")
+    assert load.calls == ["5min", "1min"]
+    assert len(k) == 24
+    assert k['dt'].iloc[0] == pd.Timestamp("2021-01-04 09:35")
+
+
+@pytest.mark.parametrize("symbol, asset, market", [
+    ("000001.SH", "I", "stock"),
+    ("600000.XSHG", None, "stock"),
+    ("CFFEX.IF2106", None, "stock"),
+    ("IF2106.CFX", "FT", "stock"),
+    ("SHFE.au2112", None, "futures_0230"),
+    ("AG2112.SHF", "FT", "futures_0230"),
+    ("INE.sc2109", None, "futures_0230"),
+    ("CU2109.XSGE", None, "futures_0100"),
+    ("SHFE.rb2110", None, "futures_2300"),
+    ("KQ.m@SHFE.rb", None, "futures_2300"),
+    ("DCE.m2109", None, "futures_2300"),
+    ("CZCE.SR109", None, "futures_2300"),
+    ("DCE.jd2109", None, "futures"),
+    ("CZCE.AP110", None, "futures"),
+    ("GFEX.si2309", None, "futures"),
+])
+def test_market_of_night_session_per_product(symbol, asset, market):
+    assert market_of(symbol, asset) == market
+
+
+def night_bars(symbol, last):
+    """从 21:01 到 last（含）每分钟一根K线，dt 为结束时间"""
+    n = int((np.datetime64(last) - np.datetime64("2021-06-01T21:01")) // np.timedelta64(1, 'm')) + 1
+    return minute_bars("2021-06-01 21:01", n, symbol)
+
+
+def test_night_session_ends_at_2300():
+    k = resample_minutes(night_bars("SHFE.rb2110", "2021-06-01T23:00"), "60min", "futures_2300")
+    assert k['dt'].tolist() == [pd.Timestamp("2021-06-01 22:00"), pd.Timestamp("2021-06-01 23:00")]
+
+
+def test_night_session_crossing_midnight_ends_at_0100():
+    k = resample_minutes(night_bars("SHFE.cu2109", "2021-06-02T01:00"), "60min", "futures_0100")
+    assert k['dt'].tolist() == [pd.Timestamp("2021-06-01 22:00"), pd.Timestamp("2021-06-01 23:00"),
+                                pd.Timestamp("2021-06-02 00:00"), pd.Timestamp("2021-06-02 01:00")]
+    assert k['vol'].tolist() == [6000.0] * 4
+
+
+def test_bar_closes_per_night_session():
+    assert bar_closes("60min", "futures")[-1] == 900
+    assert 23 * 60 in bar_closes("60min", "futures_2300")
+    assert 60 in bar_closes("60min", "futures_0100")
+    assert 150 in bar_closes("30min", "futures_0230")
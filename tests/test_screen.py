@@ -0,0 +1,35 @@
+# coding: utf-8
+import asyncio
+from czsc_web.screen import ScreenJob
+
+
+class Provider:
+    """第一次获取K线时取消任务的数据源"""
+    name = "test"
+
+    def __init__(self):
+        self.job = None
+        self.fetched = []
+
+    async def fetch_bars(self, symbol, freq, end_dt, **params):
+        self.fetched.append(symbol)
+        self.job.cancel()
+        await asyncio.sleep(0.01)
+        raise ValueError("no data")
+
+
+def test_cancel_stops_pending_fetches():
+    async def main():
+        provider = Provider()
+        job = provider.job = ScreenJob(provider, ["s{}".format(i) for i in range(40)], ["D", "30min"], "20210601")
+        await job.run()
+        lines = []
+        while not job.lines.empty():
+            lines.append(job.lines.get_nowait())
+        return provider, job, lines
+
+    provider, job, lines = asyncio.run(main())
+    assert job.status == "cancelled"
+    assert provider.fetched == ["s0"]
+    assert lines[-1] is None
+    assert lines[-2]['status'] == "cancelled"
@@ -0,0 +1,122 @@
+# coding: utf-8
+import time
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from czsc_web.store import BarStore, bar_dtype, df_to_bars, _file_lock
+
+
+def daily_bars(first, n, price=10.0, symbol="000001.SH"):
+    dt = pd.bdate_range(first, periods=n).values.astype('datetime64[ns]')
+    close = price + np.arange(n, dtype=np.float64)
+    return pd.DataFrame({"symbol": symbol, "dt": dt, "open": close, "close": close,
+                         "high": close + 1, "low": close - 1, "vol": 100.0})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BarStore("test", path=str(tmp_path))
+
+
+class Fetch:
+    """记录每次调用的 start_dt，全量获取（start_dt 为 None）时返回 full，否则返回 tail 中 dt >= start_dt 的部分"""
+
+    def __init__(self, full, tail=None):
+        self.full = full
+        self.tail = tail if tail is not None else full
+        self.starts = []
+
+    def __call__(self, start_dt, end_dt):
+        self.starts.append(start_dt)
+        if start_dt is None:
+            return self.full
+        return self.tail[self.tail['dt'] >= pd.Timestamp(start_dt)].reset_index(drop=True)
+
+
+def test_append_replaces_overlap_and_extends(store):
+    store.write("a", "D", "qfq", df_to_bars(daily_bars("2021-01-04", 5)))
+    store.append("a", "D", "qfq", df_to_bars(daily_bars("2021-01-07", 4, price=20)))
+    bars = np.array(store.read("a", "D", "qfq"))
+    assert len(bars) == 7
+    assert bars['close'][2] == 12
+    assert list(bars['close'][3:]) == [20, 21, 22, 23]
+
+
+def test_append_shorter_tail_rewrites_file(store):
+    store.write("a", "D", "qfq", df_to_bars(daily_bars("2021-01-04", 5)))
+    store.append("a", "D", "qfq", df_to_bars(daily_bars("2021-01-05", 1, price=30)))
+    bars = np.array(store.read("a", "D", "qfq"))
+    assert list(bars['close']) == [10, 30]
+
+
+def test_is_readjusted(store):
+    old = df_to_bars(daily_bars("2021-01-04", 4))
+    assert not store._is_readjusted(old, df_to_bars(daily_bars("2021-01-05", 5, price=11)))
+    # 复权后历史价格整体变化
+    assert store._is_readjusted(old, df_to_bars(daily_bars("2021-01-05", 5, price=5.5)))
+    # 没有重叠的K线，无法校验
+    assert store._is_readjusted(old, df_to_bars(daily_bars("2021-02-01", 3)))
+    # 最后一根是未完成的K线，不参与比较
+    new = df_to_bars(daily_bars("2021-01-05", 3, price=11))
+    new['close'][-1] += 1
+    assert not store._is_readjusted(old, new)
+
+
+def test_incremental_tail_fetch(store):
+    full = daily_bars("2021-01-04", 100)
+    fetch = Fetch(full.iloc[:90].reset_index(drop=True), full)
+    store.load("a", "D", "qfq", fetch, end_dt=datetime(2021, 4, 1), count=100)
+    store.load("a", "D", "qfq", fetch, end_dt=datetime(2021, 6, 1), count=100)
+    assert fetch.starts[0] is None
+    assert fetch.starts[1] is not None
+    assert len(store.read("a", "D", "qfq")) == 100
+
+
+def test_large_gap_rebuilds_instead_of_unbounded_tail(store):
+    # 先打开了几年前的图表，再打开当天的图表：缺失的K线比 count 还多，直接全量获取
+    old = daily_bars("2015-01-05", 50)
+    recent = daily_bars("2021-01-04", 50)
+    fetch = Fetch(old)
+    store.load("a", "D", "qfq", fetch, end_dt=datetime(2015, 3, 20), count=50)
+    fetch.full = recent
+    kline = store.load("a", "D", "qfq", fetch, end_dt=datetime(2021, 3, 20), count=50)
+    assert fetch.starts == [None, None]
+    assert kline['dt'].iloc[0] == recent['dt'].iloc[0]
+
+
+def test_large_gap_rebuilds_for_window_providers(store):
+    fetch = Fetch(daily_bars("2015-01-05", 50))
+    store.load("a", "D", "qfq", fetch, end_dt=datetime(2015, 3, 20), start_dt=datetime(2015, 1, 1))
+    fetch.full = daily_bars("2021-01-04", 50)
+    store.load("a", "D", "qfq", fetch, end_dt=datetime(2021, 3, 20), start_dt=datetime(2021, 1, 1))
+    assert fetch.starts == [None, None]
+
+
+def test_file_lock_excludes_other_holders(tmp_path):
+    file = str(tmp_path / "x.lock")
+    holding = threading.Event()
+    order = []
+
+    def hold():
+        with _file_lock(file):
+            holding.set()
+            time.sleep(0.2)
+            order.append("released")
+
+    t = threading.Thread(target=hold)
+    t.start()
+    holding.wait()
+    # 每次 open 得到独立的文件描述，同一进程中的 flock 同样互斥
+    with _file_lock(file):
+        order.append("acquired")
+    t.join()
+    assert order == ["released", "acquired"]
+
+
+def test_read_ignores_partial_record(store):
+    store.write("a", "D", "qfq", df_to_bars(daily_bars("2021-01-04", 3)))
+    with open(store._file("a", "D", "qfq"), 'ab') as f:
+        f.write(b"\0" * (bar_dtype.itemsize // 2))
+    assert len(store.read("a", "D", "qfq")) == 3
@@ -0,0 +1,162 @@
+# coding: utf-8
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from tornado.options import options
+from czsc_web.providers.tq import TqBridge, TqProvider, to_snapshot
+
+
+def start_labelled(freq_minutes, first, n, symbol="SHFE.rb2110"):
+    """天勤格式的K线：dt 为K线的开始时间"""
+    dt = np.datetime64(first, 'ns') + np.arange(n) * np.timedelta64(freq_minutes, 'm')
+    close = np.arange(n, dtype=np.float64) + 4000
+    return pd.DataFrame({"symbol": symbol, "dt": dt, "open": close, "close": close,
+                         "high": close + 1, "low": close - 1, "vol": 10.0})
+
+
+def session_bars(freq_minutes, symbol="SHFE.rb2110"):
+    """夜盘 21:00 开盘和日盘 09:00 开盘各一小时的K线"""
+    n = 60 // freq_minutes
+    return pd.concat([start_labelled(freq_minutes, "2021-06-01 21:00", n, symbol),
+                      start_labelled(freq_minutes, "2021-06-02 09:00", n, symbol)], ignore_index=True)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    p = TqProvider()
+    bars = {"1min": session_bars(1), "5min": session_bars(5)}
+    calls = []
+
+    def get_kline(symbol, freq, end_dt, start_dt=None, count=None):
+        calls.append(freq)
+        return bars[freq]
+
+    monkeypatch.setattr(p, "get_kline", get_kline)
+    p.calls = calls
+    p.bars = bars
+    return p
+
+
+@pytest.mark.parametrize("symbol", ["SHFE.rb2110", "CFFEX.IF2106"])
+def test_tq_minute_bars_are_not_resampled(provider, symbol):
+    kline = provider.load_kline(symbol, "5min", datetime(2021, 6, 3))
+    assert provider.calls == ["5min"]
+    assert kline['dt'].tolist() == provider.bars["5min"]['dt'].tolist()
+    # 开盘的第一根K线保留，不会出现只有一根 1 分钟K线的合成K线
+    dt = pd.DatetimeIndex(kline['dt'])
+    assert pd.Timestamp("2021-06-01 21:00") in dt
+    assert pd.Timestamp("2021-06-02 09:00") in dt
+    assert len(kline) == 24
+
+
+def test_tq_never_derives_from_start_labelled_bars(provider):
+    # 没有 5 分钟K线时也不能用 1 分钟K线合成：合成要求 dt 为结束时间，开始时间会整体错后一分钟
+    provider.bars["5min"] = provider.bars["5min"].iloc[:0]
+    kline = provider.load_kline("SHFE.rb2110", "5min", datetime(2021, 6, 3))
+    assert "1min" not in provider.calls
+    assert len(kline) == 0
+
+
+def test_tq_does_not_use_store():
+    assert TqProvider().store is None
+
+
+def serial(first, n, nan=0):
+    """get_kline_serial 格式的序列：datetime 为 UTC 纳秒时间戳（float），前 nan 行还没有数据"""
+    ns = (np.datetime64(first, 'ns') + np.arange(n) * np.timedelta64(1, 'm')).astype(np.int64).astype(np.float64)
+    ns[:nan] = np.nan
+    close = np.arange(n, dtype=np.float64) + 4000
+    return pd.DataFrame({"datetime": ns, "open": close, "close": close, "high": close + 1, "low": close - 1,
+                         "volume": 10.0})
+
+
+def test_to_snapshot_converts_to_beijing_time():
+    snapshot = to_snapshot(serial("2021-06-01T13:00", 5, nan=2))
+    assert pd.DatetimeIndex(snapshot['dt']).equals(pd.date_range("2021-06-01 21:02", periods=3, freq="min"))
+    assert snapshot['close'].tolist() == [4002, 4003, 4004]
+    assert snapshot['vol'].tolist() == [10.0] * 3
+    assert all(not arr.flags.writeable for arr in snapshot.values())
+
+
+class SnapshotBridge:
+    alive = True
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def snapshot(self, symbol, duration):
+        return self._snapshot
+
+
+def test_get_kline_honours_start_dt():
+    p = TqProvider()
+    p.connected = True
+    # 北京时间 2021-06-01 21:00 开始的 120 根 1 分钟K线
+    p.bridge = SnapshotBridge(to_snapshot(serial("2021-06-01T13:00", 120)))
+    kline = p.get_kline("SHFE.rb2110", "1min", datetime(2021, 6, 1, 22, 30),
+                        start_dt=datetime(2021, 6, 1, 22, 0), count=1000)
+    assert kline['dt'].iloc[0] == pd.Timestamp("2021-06-01 22:00")
+    assert kline['dt'].iloc[-1] == pd.Timestamp("2021-06-01 22:29")
+    assert len(p.get_kline("SHFE.rb2110", "1min", datetime(2021, 6, 1, 22, 30), count=10)) == 10
+    assert len(p.get_kline("SHFE.rb2110", "1min", datetime(2021, 6, 1, 22, 0),
+                           start_dt=datetime(2021, 6, 1, 22, 30))) == 0
+
+
+class FakeApi:
+    """记录订阅和关闭的 TqApi"""
+
+    def __init__(self):
+        self.subscribed = []
+        self.closed = False
+
+    def get_kline_serial(self, symbol, duration, data_length=None):
+        self.subscribed.append((symbol, duration))
+        return serial("2021-06-01T13:00", 3)
+
+    def wait_update(self, deadline=None):
+        time.sleep(max(0.0, min(deadline - time.time(), 0.01)))
+
+    def is_changing(self, obj):
+        return False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBridge(TqBridge):
+    def __init__(self, data_length):
+        super().__init__(data_length)
+        self.apis = []
+
+    def _create_api(self):
+        self.apis.append(FakeApi())
+        return self.apis[-1]
+
+
+@pytest.fixture
+def bridge():
+    b = FakeBridge(100)
+    b.start()
+    return b
+
+
+def test_bridge_subscribes_each_serial_once(bridge):
+    first = bridge.snapshot("SHFE.rb2110", 60)
+    assert bridge.snapshot("SHFE.rb2110", 60) is first
+    bridge.snapshot("SHFE.rb2110", 300)
+    assert bridge.apis[0].subscribed == [("SHFE.rb2110", 60), ("SHFE.rb2110", 300)]
+
+
+def test_bridge_recycle_keeps_recently_used_half(bridge, monkeypatch):
+    monkeypatch.setattr(options, "tq_max_subscriptions", 4)
+    for symbol in ["a", "b", "c", "d"]:
+        bridge.snapshot(symbol, 60)
+    # 最近使用过的 a 排到最后
+    bridge.snapshot("a", 60)
+    bridge.snapshot("e", 60)
+    old, new = bridge.apis
+    assert old.closed
+    assert new.subscribed == [("d", 60), ("a", 60), ("e", 60)]
+    assert list(bridge._subs) == [("d", 60), ("a", 60), ("e", 60)]
@@ -0,0 +1,102 @@
+# coding: utf-8
+import gzip
+import json
+import struct
+import numpy as np
+import pytest
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler
+from czsc_web.cache import CacheEntry, CachedResponseMixin
+from czsc_web.wire import choose_encoding, encode_payload, negotiate
+
+
+def result(n=200):
+    dt = np.datetime64("2021-06-01 09:31", 'ns') + np.arange(n) * np.timedelta64(1, 'm')
+    close = np.arange(n, dtype=np.float64) + 10
+    return {
+        "dt": dt, "open": close, "close": close, "high": close + 1, "low": close - 1, "vol": np.full(n, 100.0),
+        "fx_index": np.array([1, 3]), "fx_mark": ["g", "d"], "fx": [12.0, 11.0],
+        "bi_index": np.array([1, 3]), "bi": [12.0, 11.0],
+        "xd_index": np.array([], dtype=np.int64), "xd": [],
+    }
+
+
+@pytest.mark.parametrize("accept_encoding, available, encoding", [
+    ("gzip, deflate, br", {"gzip": b"", "br": b""}, "br"),
+    ("gzip;q=1.0, identity", {"gzip": b"", "br": b""}, "gzip"),
+    ("br", {"gzip": b""}, None),
+    ("", {"gzip": b"", "br": b""}, None),
+    (None, {"gzip": b""}, None),
+])
+def test_choose_encoding(accept_encoding, available, encoding):
+    assert choose_encoding(accept_encoding, available) == encoding
+
+
+class KlineHandler(CachedResponseMixin, RequestHandler):
+    def get(self):
+        fmt = negotiate(self, allowed=self.application.settings.get('formats'))
+        self.finish_entry(CacheEntry(encode_payload(result(), fmt), 60))
+
+
+class WireTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([("/kline", KlineHandler)], formats=["json", "columnar", "binary"])
+
+    def get(self, path="/kline", **headers):
+        return self.fetch(path, headers=headers, decompress_response=False)
+
+    def test_default_json(self):
+        response = self.get()
+        assert response.code == 200
+        assert response.headers['Content-Type'].startswith("application/json")
+        assert len(json.loads(response.body)['kdata']) == 200
+
+    def test_columnar_by_format_and_accept(self):
+        for response in [self.get("/kline?format=columnar"),
+                         self.get(Accept="application/vnd.czsc.columnar+json")]:
+            data = json.loads(response.body)
+            assert data['n'] == 200
+            assert data['fx'] == {"index": [1, 3], "mark": ["g", "d"], "value": [12.0, 11.0]}
+
+    def test_binary_arrays(self):
+        body = self.get(Accept="application/octet-stream").body
+        assert body[:4] == b"CZK1"
+        size = struct.unpack("<I", body[4:8])[0]
+        header = json.loads(body[8:8 + size])
+        assert (8 + size) % 8 == 0
+        arrays = {a['name']: a for a in header['arrays']}
+        close = arrays['close']
+        values = np.frombuffer(body, dtype=close['dtype'], count=close['length'], offset=8 + size + close['offset'])
+        assert values.tolist() == result()['close'].tolist()
+        dt = arrays['dt']
+        assert np.frombuffer(body, dtype=dt['dtype'], count=1, offset=8 + size + dt['offset'])[0] == \
+            np.datetime64("2021-06-01 09:31", 's').astype(np.int64)
+
+    def test_unknown_or_disallowed_format_is_406(self):
+        assert self.get("/kline?format=csv").code == 406
+        assert self.get("/kline?format=msgpack").code == 406
+
+    def test_etag_per_encoding(self):
+        plain = self.get()
+        gz = self.get(**{"Accept-Encoding": "gzip"})
+        assert gz.headers['Content-Encoding'] == "gzip"
+        assert gzip.decompress(gz.body) == plain.body
+        assert gz.headers['Etag'] == plain.headers['Etag'][:-1] + '-gzip"'
+        assert "Accept-Encoding" in gz.headers['Vary']
+
+    def test_if_none_match_returns_304(self):
+        etag = self.get().headers['Etag']
+        response = self.get(**{"If-None-Match": etag})
+        assert response.code == 304
+        assert response.body == b""
+
+    def test_gzip_304_only_for_gzip_etag(self):
+        etag = self.get(**{"Accept-Encoding": "gzip"}).headers['Etag']
+        response = self.get(**{"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert response.code == 304
+        assert response.headers['Etag'] == etag
+        assert "Content-Encoding" not in response.headers
+        # 未压缩的 ETag 不能匹配压缩的响应，反之亦然
+        assert self.get(**{"If-None-Match": etag}).code == 200
+        plain = self.get().headers['Etag']
+        assert self.get(**{"Accept-Encoding": "gzip", "If-None-Match": plain}).code == 200